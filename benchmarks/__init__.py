@@ -0,0 +1,5 @@
+"""
+Benchmarks and load tests of the netfshare hot paths.
+
+Run `python -m benchmarks --help` from the repository root.
+"""
@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+from . import trees, inprocess, live
+from .stats import compare, format_comparison
+from netfshare.server import SERVER_MODES
+
+parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                 description='Benchmark the netfshare download, upload and page hot paths.')
+parser.add_argument('--profile', choices=list(trees.PROFILES), default='small',
+                    help='size of the generated shared tree')
+parser.add_argument('--tree', default=None,
+                    help='directory of the generated tree, reused between runs (default: a temporary directory)')
+parser.add_argument('--clients', type=int, default=10, help='concurrent simulated clients')
+parser.add_argument('--requests', type=int, default=20, help='page requests per client')
+parser.add_argument('--upload-size', type=int, default=1024**2, help='size of uploaded files (bytes)')
+parser.add_argument('--upload-files', type=int, default=3, help='files uploaded by each client')
+parser.add_argument('--server', choices=list(SERVER_MODES), default='dev',
+                    help='serving mode of the real server benchmarks')
+parser.add_argument('--processes', type=int, default=None,
+                    help='worker processes of the real server (eventlet/gevent)')
+parser.add_argument('--skip-server', action='store_true', help='only run the test client benchmarks')
+parser.add_argument('--skip-inprocess', action='store_true', help='only run the real server benchmarks')
+parser.add_argument('--save', default=None, help='write the results to this JSON file')
+parser.add_argument('--compare', default=None, help='compare the results with this JSON baseline')
+parser.add_argument('--threshold', type=float, default=0.1,
+                    help='relative change reported as a regression (default: 0.1)')
+args = parser.parse_args()
+
+root = os.path.abspath(args.tree or tempfile.mkdtemp(prefix='netfshare-tree-'))
+os.makedirs(root, exist_ok=True)
+print(f'Generating {args.profile} tree in {root}...', file=sys.stderr)
+start = time.perf_counter()
+directories = trees.generate_tree(root, args.profile)
+trees.write_config(root)
+print(f'Tree ready in {time.perf_counter() - start:.1f} s.', file=sys.stderr)
+
+results = {
+    'meta': {
+        'profile': args.profile,
+        'clients': args.clients,
+        'requests': args.requests,
+        'server': args.server,
+        'processes': args.processes or 1,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    },
+    'tree': directories,
+}
+
+# The test client benchmarks also set up the shares used by the real server
+module, inprocess_results = inprocess.run(
+    root, directories, clients=args.clients if not args.skip_inprocess else 1,
+    requests=args.requests if not args.skip_inprocess else 1,
+    upload_size=args.upload_size, upload_files=args.upload_files)
+if not args.skip_inprocess:
+    results['test_client'] = inprocess_results
+
+if not args.skip_server:
+    results['server'], results['meta']['distinct_clients'] = live.run(
+        root, args.server, clients=args.clients, requests=args.requests,
+        upload_size=args.upload_size, upload_files=args.upload_files, workers=args.clients * 4,
+        processes=args.processes)
+
+output = json.dumps(results, indent=2, sort_keys=True)
+if args.save:
+    with open(args.save, 'w') as f:
+        f.write(output + '\n')
+print(output)
+
+if args.compare:
+    with open(args.compare, 'r') as f:
+        baseline = json.load(f)
+    rows = compare(baseline, results, args.threshold)
+    print(format_comparison(rows), file=sys.stderr)
+    if any(regression for *_, regression in rows):
+        sys.exit(1)
@@ -0,0 +1,233 @@
+import io
+import os
+import time
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .stats import summarize, throughput
+from .trees import READ_ONLY_DIRS, UPLOAD_DIR
+
+ADMIN_HEADERS = {'Host': '127.0.0.1'}
+
+
+class QueryCounter:
+    """
+    Counts SQL statements executed by the current thread.
+    """
+    def __init__(self, engine):
+        self._local = threading.local()
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def take(self):
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        return count
+
+
+def client_address(index):
+    return f'10.77.{index // 250}.{index % 250 + 1}'
+
+
+def load_app(root):
+    """
+    Imports the netfshare app serving `root`, with the benchmark shares
+    set up: read only directories, an upload directory accepting repeated
+    uploads. Returns the `netfshare.netfshare` module.
+    """
+    os.chdir(root)
+    from netfshare import netfshare as module
+    module.startup()
+    app, db = module.app, module.db
+    modes = {path: 1 for path in READ_ONLY_DIRS}
+    modes[UPLOAD_DIR] = 2
+    with app.app_context():
+        module.add_shared_folders()
+        for directory in module.Directory.query.all():
+            directory.mode = modes.get(directory.path, 0)
+        config = module.ConfigBool.query.filter(module.ConfigBool.name == 'allow_multiple_uploads').first()
+        config.value = True
+        db.session.commit()
+        module.shared_tree.set_modes({d.path: d.mode for d in module.Directory.query.all()})
+    module.app_cache.invalidate_config()
+    return module
+
+
+def identified_client(module, index):
+    """
+    Returns a test client of simulated client number `index`, identified with the app.
+    """
+    client = module.app.test_client()
+    client.environ_base['REMOTE_ADDR'] = client_address(index)
+    client.post('/id', data={'id': f'{index:04d}', 'name': f'Student {index}'})
+    return client
+
+
+def bench_archives(module, root, directories):
+    """
+    Times cold, incremental and cached builds of each read only directory
+    in a fresh archive cache.
+    """
+    from netfshare.archive_cache import ArchiveCache
+    results = {}
+    cache_dir = tempfile.mkdtemp(prefix='netfshare-bench-')
+    try:
+        cache = ArchiveCache(cache_dir, compresslevel=module.app.config.get('ZIP_COMPRESSLEVEL', 6),
+                             workers=module.app.config.get('ARCHIVE_WORKERS'))
+        for name in READ_ONLY_DIRS:
+            directory = os.path.join(root, name)
+            policy = module.directory_compression(name)
+            start = time.perf_counter()
+            archive, manifest = cache.get(name, directory, policy)
+            cold = time.perf_counter() - start
+
+            # Change a single file and rebuild
+            changed = sorted(os.path.join(r, f) for r, _, files in os.walk(directory) for f in files)[0]
+            os.utime(changed, ns=(time.time_ns(), time.time_ns()))
+            cache.invalidate(name)
+            start = time.perf_counter()
+            cache.get(name, directory, policy)
+            incremental = time.perf_counter() - start
+
+            start = time.perf_counter()
+            cache.get(name, directory, policy)
+            cached = time.perf_counter() - start
+
+            results[name] = {
+                'cold_build_s': round(cold, 4),
+                'incremental_build_s': round(incremental, 4),
+                'cached_get_ms': round(cached * 1000, 3),
+                'archive_bytes': manifest['size'],
+                'cold_mb_per_s': throughput(directories[name]['bytes'], cold),
+            }
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def bench_queries(module, client, counter):
+    """
+    Counts the SQL statements of one request to each page.
+    """
+    paths = {
+        'index': ('/', {}),
+        'browse': (f'/browse/{READ_ONLY_DIRS[0]}/', {}),
+        'upload_page': (f'/upload/{UPLOAD_DIR}', {}),
+        'download_cached': (f'/download/{READ_ONLY_DIRS[-1]}', {'Range': 'bytes=0-'}),
+        'admin': ('/admin', ADMIN_HEADERS),
+    }
+    results = {}
+    for name, (path, headers) in paths.items():
+        admin = name == 'admin'
+        page_client = module.app.test_client() if admin else client
+        page_client.get(path, headers=headers)
+        counter.take()
+        page_client.get(path, headers=headers)
+        results[name] = counter.take()
+    return results
+
+
+def bench_pages(module, clients, requests):
+    """
+    Measures page latency with all simulated `clients` requesting pages concurrently.
+    """
+    paths = {'index': '/', 'browse': f'/browse/{READ_ONLY_DIRS[0]}/'}
+    results = {}
+    for name, path in paths.items():
+        def run(client):
+            durations = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                response = client.get(path)
+                durations.append(time.perf_counter() - start)
+                assert response.status_code == 200, (path, response.status_code)
+            return durations
+        with ThreadPoolExecutor(len(clients)) as pool:
+            durations = [d for result in pool.map(run, clients) for d in result]
+        results[name] = summarize(durations)
+    return results
+
+
+def bench_downloads(module, clients):
+    """
+    Downloads each read only directory with all `clients` at once, first
+    without a cached archive (streamed while the archive is built), then
+    from the archive cache.
+    """
+    results = {}
+    for name in READ_ONLY_DIRS:
+        for label in ('cold', 'cached'):
+            def run(client):
+                start = time.perf_counter()
+                response = client.get(f'/download/{name}')
+                size = len(response.data)
+                return time.perf_counter() - start, size
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(len(clients)) as pool:
+                timings = list(pool.map(run, clients))
+            elapsed = time.perf_counter() - start
+            total = sum(size for _, size in timings)
+            results[f'{name}_{label}'] = {
+                'ms': summarize([t for t, _ in timings]),
+                'mb_per_s': throughput(total, elapsed),
+            }
+    return results
+
+
+def bench_uploads(module, root, clients, file_size, files_per_client):
+    """
+    Uploads `files_per_client` files of `file_size` bytes with all `clients`
+    at once through the form upload.
+    """
+    shutil.rmtree(os.path.join(root, UPLOAD_DIR), ignore_errors=True)
+    os.makedirs(os.path.join(root, UPLOAD_DIR), exist_ok=True)
+    payload = os.urandom(file_size)
+
+    def run(client):
+        data = {'file': [(io.BytesIO(payload), f'work/file_{i}.bin') for i in range(files_per_client)]}
+        start = time.perf_counter()
+        response = client.post(f'/upload/{UPLOAD_DIR}', data=data, content_type='multipart/form-data')
+        assert response.status_code in (200, 302), response.status_code
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(clients)) as pool:
+        durations = list(pool.map(run, clients))
+    elapsed = time.perf_counter() - start
+    return {
+        'ms': summarize(durations),
+        'mb_per_s': throughput(file_size * files_per_client * len(clients), elapsed),
+    }
+
+
+def run(root, directories, clients=10, requests=20, upload_size=1024**2, upload_files=3):
+    """
+    Runs all benchmarks against the app through the Flask test client.
+    """
+    module = load_app(root)
+    with module.app.app_context():
+        counter = QueryCounter(module.db.engine)
+    test_clients = [identified_client(module, i) for i in range(clients)]
+    results = {
+        'archive': bench_archives(module, root, directories),
+        'queries': bench_queries(module, test_clients[0], counter),
+        'page_latency_ms': bench_pages(module, test_clients, requests),
+        'upload': bench_uploads(module, root, test_clients, upload_size, upload_files),
+    }
+    # Downloads start from an empty archive cache
+    original_cache = module.archive_cache
+    module.archive_cache = original_cache.__class__(
+        tempfile.mkdtemp(prefix='netfshare-bench-'),
+        compresslevel=original_cache.compresslevel, workers=original_cache.workers)
+    try:
+        results['download'] = bench_downloads(module, test_clients)
+    finally:
+        shutil.rmtree(module.archive_cache.cache_dir, ignore_errors=True)
+        module.archive_cache = original_cache
+    return module, results
@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+import json
+import socket
+import subprocess
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from .stats import summarize, throughput
+from .trees import READ_ONLY_DIRS, UPLOAD_DIR
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READ_SIZE = 256 * 1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def loopback_addresses(count):
+    """
+    Returns a source address for each of `count` simulated clients, so the
+    server sees them as different clients. Falls back to 127.0.0.1 for all
+    clients where other loopback addresses are not available (e.g. macOS).
+    """
+    addresses = [f'127.0.{i // 250}.{i % 250 + 2}' for i in range(count)]
+    try:
+        with socket.socket() as s:
+            s.bind((addresses[-1], 0))
+    except OSError:
+        return ['127.0.0.1'] * count
+    return addresses
+
+
+class LiveServer:
+    """
+    `python -m netfshare` serving `root` in a subprocess, for the duration
+    of a `with` block.
+    """
+    def __init__(self, root, mode='dev', port=None, workers=None, processes=None):
+        self.root = root
+        self.mode = mode
+        self.port = port or free_port()
+        self.workers = workers
+        self.processes = processes
+        self.process = None
+        self.log_path = os.path.join(root, '.netfshare', 'benchmark-server.log')
+
+    def __enter__(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPOSITORY, os.environ.get('PYTHONPATH')])))
+        command = [sys.executable, '-m', 'netfshare', '--server', self.mode, '--port', str(self.port)]
+        if self.workers:
+            command += ['--workers', str(self.workers)]
+        if self.processes:
+            command += ['--processes', str(self.processes)]
+        self._log = open(self.log_path, 'wb')
+        self.process = subprocess.Popen(command, cwd=self.root, env=env,
+                                        stdout=self._log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Server exited, see {self.log_path}')
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                    return self
+            except OSError:
+                time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError(f'Server did not start, see {self.log_path}')
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._log.close()
+
+
+class SimulatedClient:
+    """
+    A browser on its own (loopback) address, with one keep-alive connection.
+    """
+    def __init__(self, port, address, index):
+        self.port = port
+        self.address = address
+        self.index = index
+        self.connection = None
+
+    def _connect(self):
+        self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=600,
+                                                     source_address=(self.address, 0))
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Sends a request and reads the response. Returns
+        `(status, body size, time to first byte, total time)`.
+        """
+        for attempt in (1, 2):
+            if self.connection is None:
+                self._connect()
+            start = time.perf_counter()
+            try:
+                self.connection.request(method, path, body=body, headers=headers or {})
+                response = self.connection.getresponse()
+                first = response.read1(READ_SIZE)
+                first_byte = time.perf_counter() - start
+                size = len(first)
+                while True:
+                    data = response.read(READ_SIZE)
+                    if not data:
+                        break
+                    size += len(data)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # Stale keep-alive connection
+                self.connection.close()
+                self.connection = None
+                if attempt == 2:
+                    raise
+                continue
+            if response.will_close:
+                self.connection.close()
+                self.connection = None
+            return response.status, size, first_byte, time.perf_counter() - start
+
+    def identify(self):
+        body = urllib.parse.urlencode({'id': f'{self.index:04d}', 'name': f'Student {self.index}'})
+        self.request('POST', '/id', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+def bench_downloads(clients):
+    """
+    Downloads each read only directory with all `clients` at once.
+    """
+    results = {}
+    for name in READ_ONLY_DIRS:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(len(clients)) as pool:
+            timings = list(pool.map(lambda c: c.request('GET', f'/download/{name}'), clients))
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            'ttfb_ms': summarize([t[2] for t in timings]),
+            'ms': summarize([t[3] for t in timings]),
+            'mb_per_s': throughput(sum(t[1] for t in timings), elapsed),
+        }
+    return results
+
+
+def bench_pages(clients, requests):
+    """
+    Measures page latency with all `clients` requesting pages concurrently.
+    """
+    results = {}
+    for name, path in (('index', '/'), ('browse', f'/browse/{READ_ONLY_DIRS[0]}/')):
+        def run(client):
+            return [client.request('GET', path)[3] for _ in range(requests)]
+        with ThreadPoolExecutor(len(clients)) as pool:
+            results[name] = summarize([d for result in pool.map(run, clients) for d in result])
+    return results
+
+
+def bench_uploads(clients, file_size, files_per_client):
+    """
+    Uploads `files_per_client` files of `file_size` bytes with all `clients`
+    at once through the chunked upload API, as the upload page does.
+    """
+    payload = os.urandom(file_size)
+
+    def run(client):
+        files = [{'name': f'work/file_{i}.bin', 'size': file_size} for i in range(files_per_client)]
+        start = time.perf_counter()
+        status, session = _json_request(client, 'POST', f'/upload/{UPLOAD_DIR}/session', {'files': files})
+        assert status == 201, session
+        chunk_size = session['chunk_size']
+        for index, file in enumerate(session['files']):
+            for chunk in file['missing']:
+                body = payload[chunk * chunk_size:(chunk + 1) * chunk_size]
+                status = client.request('PUT', f'/upload/session/{session["id"]}/{index}/{chunk}', body,
+                                        {'Content-Type': 'application/octet-stream'})[0]
+                assert status == 200, status
+        status = client.request('POST', f'/upload/session/{session["id"]}/finish')[0]
+        assert status == 200, status
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(clients)) as pool:
+        durations = list(pool.map(run, clients))
+    elapsed = time.perf_counter() - start
+    return {
+        'ms': summarize(durations),
+        'mb_per_s': throughput(file_size * files_per_client * len(clients), elapsed),
+    }
+
+
+def _json_request(client, method, path, data):
+    if client.connection is None:
+        client._connect()
+    client.connection.request(method, path, body=json.dumps(data),
+                              headers={'Content-Type': 'application/json'})
+    response = client.connection.getresponse()
+    body = json.loads(response.read())
+    if response.will_close:
+        client.connection.close()
+        client.connection = None
+    return response.status, body
+
+
+def run(root, mode='dev', clients=10, requests=20, upload_size=1024**2, upload_files=3, workers=None,
+        processes=None):
+    """
+    Runs the benchmarks against a real server in serving `mode` (with
+    `processes` worker processes), with `clients` concurrent simulated
+    clients. Returns the results and the number of distinct client
+    addresses used.
+    """
+    addresses = loopback_addresses(clients)
+    with LiveServer(root, mode, workers=workers, processes=processes) as server:
+        simulated = [SimulatedClient(server.port, address, 1000 + i) for i, address in enumerate(addresses)]
+        for client in simulated:
+            client.identify()
+        try:
+            results = {
+                'download': bench_downloads(simulated),
+                'page_latency_ms': bench_pages(simulated, requests),
+                'upload': bench_uploads(simulated, upload_size, upload_files),
+            }
+        finally:
+            for client in simulated:
+                client.close()
+    return results, len(set(addresses))
@@ -0,0 +1,84 @@
+import math
+
+# Metrics where larger values are better; for all other metrics smaller is better
+HIGHER_IS_BETTER = ('mb_per_s',)
+
+
+def percentile(values, q):
+    """
+    Returns the `q`-th percentile (0-100) of `values`, linearly interpolated.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    low, high = math.floor(position), math.ceil(position)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def summarize(seconds):
+    """
+    Returns the count, mean, p50, p99 and max of durations `seconds`, in ms.
+    """
+    if not seconds:
+        return {'count': 0}
+    ms = [s * 1000 for s in seconds]
+    return {
+        'count': len(ms),
+        'mean': round(sum(ms) / len(ms), 3),
+        'p50': round(percentile(ms, 50), 3),
+        'p99': round(percentile(ms, 99), 3),
+        'max': round(max(ms), 3),
+    }
+
+
+def throughput(size, seconds):
+    """
+    Returns the throughput of `size` bytes in `seconds`, in MB/s.
+    """
+    return round(size / seconds / 1e6, 2) if seconds else None
+
+
+def flatten(results, prefix=''):
+    """
+    Flattens nested result dicts to `{'dotted.key': value}` of numbers.
+    """
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compares the numeric results of two runs, except their `meta` data.
+    Returns a list of `(key, baseline, current, change, regression)`, where
+    `change` is relative and `regression` marks changes for the worse by
+    more than `threshold`.
+    """
+    old = flatten({k: v for k, v in baseline.items() if k != 'meta'})
+    new = flatten({k: v for k, v in current.items() if k != 'meta'})
+    rows = []
+    for key in sorted(old.keys() | new.keys()):
+        a, b = old.get(key), new.get(key)
+        if a is None or b is None or key.endswith('.count'):
+            rows.append((key, a, b, None, False))
+            continue
+        change = (b - a) / a if a else (0.0 if b == a else math.inf)
+        worse = -change if key.rsplit('.', 1)[-1] in HIGHER_IS_BETTER else change
+        rows.append((key, a, b, change, worse > threshold))
+    return rows
+
+
+def format_comparison(rows):
+    lines = []
+    width = max((len(row[0]) for row in rows), default=0)
+    for key, a, b, change, regression in rows:
+        change_text = '' if change is None else f'{change:+.1%}'
+        marker = '  << regression' if regression else ''
+        lines.append(f'{key:<{width}}  {a!s:>12}  {b!s:>12}  {change_text:>8}{marker}')
+    return '\n'.join(lines)
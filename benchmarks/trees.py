@@ -0,0 +1,119 @@
+import os
+import json
+import random
+
+from netfshare import config as default_config
+
+MiB = 1024**2
+
+# Synthetic shared trees: many small files, a few huge files and deep nesting
+PROFILES = {
+    'small': {
+        'small_files': 500, 'small_size': 4096,
+        'huge_files': 2, 'huge_size': 16 * MiB,
+        'depth': 10, 'files_per_level': 5, 'nested_size': 2048,
+    },
+    'default': {
+        'small_files': 5000, 'small_size': 8192,
+        'huge_files': 3, 'huge_size': 256 * MiB,
+        'depth': 30, 'files_per_level': 20, 'nested_size': 4096,
+    },
+}
+
+# Shared subdirectories of a generated tree and their share modes
+READ_ONLY_DIRS = ['many_small', 'huge', 'deep']
+UPLOAD_DIR = 'uploads'
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+         'incididunt ut labore et dolore magna aliqua').split()
+
+# Config overrides of the benchmarked server: no background pings
+CONFIG_OVERRIDES = {
+    'PING_INTERVAL': 0,
+    'DEBUG': False,
+}
+
+
+def _text(rng, size):
+    # Compressible, text-like content
+    data = ' '.join(rng.choice(WORDS) for _ in range(size // 4)).encode()
+    return data[:size].ljust(size, b'.')
+
+
+def _binary(rng, file_path, size, block=MiB):
+    with open(file_path, 'wb') as f:
+        while size > 0:
+            f.write(rng.randbytes(min(block, size)))
+            size -= block
+
+
+def write_config(root, overrides=None):
+    """
+    Writes the local config of the shared directory `root`: the default
+    config with the benchmark `overrides`.
+    """
+    config = {k: getattr(default_config, k) for k in dir(default_config) if k.isupper()}
+    config.update(CONFIG_OVERRIDES)
+    config.update(overrides or {})
+    os.makedirs(os.path.join(root, '.netfshare'), exist_ok=True)
+    with open(os.path.join(root, '.netfshare', 'config.json'), 'w') as f:
+        json.dump(config, f, indent=2)
+
+
+def generate_tree(root, profile='small', seed=0):
+    """
+    Generates the synthetic shared tree of `profile` in `root`, unless it
+    was already generated there. Returns `{directory: {'files', 'bytes'}}`.
+    """
+    settings = PROFILES[profile]
+    marker = os.path.join(root, '.netfshare', 'benchmark-tree.json')
+    try:
+        with open(marker, 'r') as f:
+            stored = json.load(f)
+        if stored['profile'] == profile and stored['seed'] == seed:
+            return stored['directories']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    rng = random.Random(seed)
+    directories = {}
+
+    def add(directory, file_path, size):
+        stats = directories.setdefault(directory, {'files': 0, 'bytes': 0})
+        stats['files'] += 1
+        stats['bytes'] += size
+
+    many_small = os.path.join(root, 'many_small')
+    for i in range(settings['small_files']):
+        directory = os.path.join(many_small, f'group_{i // 100:03d}')
+        os.makedirs(directory, exist_ok=True)
+        size = rng.randint(settings['small_size'] // 2, settings['small_size'] * 2)
+        file_path = os.path.join(directory, f'file_{i:05d}.txt')
+        with open(file_path, 'wb') as f:
+            f.write(_text(rng, size))
+        add('many_small', file_path, size)
+
+    huge = os.path.join(root, 'huge')
+    os.makedirs(huge, exist_ok=True)
+    for i in range(settings['huge_files']):
+        file_path = os.path.join(huge, f'video_{i}.mp4' if i % 2 else f'dataset_{i}.bin')
+        _binary(rng, file_path, settings['huge_size'])
+        add('huge', file_path, settings['huge_size'])
+
+    directory = os.path.join(root, 'deep')
+    for level in range(settings['depth']):
+        directory = os.path.join(directory, f'level_{level:02d}')
+        os.makedirs(directory, exist_ok=True)
+        for i in range(settings['files_per_level']):
+            file_path = os.path.join(directory, f'notes_{i:03d}.txt')
+            with open(file_path, 'wb') as f:
+                f.write(_text(rng, settings['nested_size']))
+            add('deep', file_path, settings['nested_size'])
+
+    os.makedirs(os.path.join(root, UPLOAD_DIR), exist_ok=True)
+    directories.setdefault(UPLOAD_DIR, {'files': 0, 'bytes': 0})
+
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    with open(marker, 'w') as f:
+        json.dump({'profile': profile, 'seed': seed, 'directories': directories}, f)
+    return directories
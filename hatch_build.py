@@ -0,0 +1,18 @@
+import sys
+
+from hatchling.builders.hooks.plugin.interface import BuildHookInterface
+
+
+class VendorAssetsHook(BuildHookInterface):
+    """
+    Refuses to build a package without the vendored third-party client
+    assets, which clients without internet access depend on. The build
+    itself never downloads anything.
+    """
+    def initialize(self, version, build_data):
+        sys.path.insert(0, self.root)
+        from netfshare.assets import unvendored
+        missing = unvendored()
+        if missing:
+            raise RuntimeError(f'{", ".join(missing)} missing from netfshare/static or not matching '
+                               'its integrity hash, vendor it with `python -m netfshare.assets`.')
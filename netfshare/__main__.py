@@ -1,10 +1,52 @@
-import os
+import sys
+import argparse
 
-from .netfshare import app, netfshare
+if sys.argv[1:2] == ['sync']:
+    # Client mode, does not serve the current directory
+    from .sync import main
+    main(sys.argv[2:])
+    sys.exit()
+
+from .server import SERVER_MODES, server_mode, local_setting, check_worker_mode, fork_workers, prepare, run
+
+parser = argparse.ArgumentParser(prog='netfshare', description='Share the current directory on the local network.')
+parser.add_argument('--server', choices=list(SERVER_MODES), default=None,
+                    help='serving mode, defaults to SERVER_MODE from the config')
+parser.add_argument('--port', type=int, default=None, help='port to listen on')
+parser.add_argument('--workers', type=int, default=None,
+                    help='maximum concurrent connections (eventlet/gevent)')
+parser.add_argument('--processes', type=int, default=None,
+                    help='worker processes serving the port (eventlet/gevent), defaults to PROCESSES from the config')
+args = parser.parse_args()
+
+mode = args.server or server_mode()
+processes = args.processes or int(local_setting('PROCESSES', 1))
+listener = ready = None
+if processes > 1:
+    if mode == 'dev':
+        parser.error('worker processes require the eventlet or gevent server')
+    try:
+        # Fails before forking, instead of in every restarted worker
+        check_worker_mode(mode)
+    except RuntimeError as e:
+        parser.error(str(e))
+    # The parent process only supervises the workers and does not return
+    port = args.port or int(local_setting('PORT', 5000))
+    index, listener, ready = fork_workers(processes, host='0.0.0.0', port=port)
+
+# Monkey patching must happen before the app is imported
+prepare(mode)
+
+from .netfshare import app, netfshare, socketio, startup
 
 # Register netfshare views blueprint
 app.register_blueprint(netfshare)
-port = int(app.config.get("PORT", 5000))
-app.run(port=port, host='0.0.0.0')
+startup()
+if ready is not None:
+    ready()
+port = args.port or int(app.config.get("PORT", 5000))
+run(app, socketio, mode, host='0.0.0.0', port=port,
+    workers=args.workers or app.config.get('WORKER_CONNECTIONS'),
+    keepalive=app.config.get('KEEPALIVE', True), listener=listener)
 
 print()
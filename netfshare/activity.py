@@ -0,0 +1,195 @@
+import queue
+import logging
+import datetime
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class ActivityEvent:
+    """
+    A download or upload to be recorded in the database. `files` of an
+    upload are `(path, size, hash, deduplicated)` tuples, saved into the
+    client's `folder` of the directory.
+    """
+    __slots__ = ('kind', 'client_id', 'directory', 'time', 'files_count', 'files', 'folder')
+
+    def __init__(self, kind, client_id, directory, files_count=None, files=(), folder=None):
+        self.kind = kind
+        self.client_id = client_id
+        self.directory = directory
+        self.time = datetime.datetime.now()
+        self.files_count = files_count
+        self.files = files
+        self.folder = folder
+
+    def __repr__(self):
+        return f'ActivityEvent: {self.kind} of {self.directory} by client {self.client_id}'
+
+
+class ActivityRecord:
+    """
+    A download or upload kept in memory by `ActivityStore`.
+    """
+    __slots__ = ('client_id', 'directory', 'time', 'files_count')
+
+    def __init__(self, client_id, directory, time, files_count=None):
+        self.client_id = client_id
+        self.directory = directory
+        self.time = time
+        self.files_count = files_count
+
+
+class ActivityTotals:
+    """
+    Running totals of the activity in a directory or of a client.
+    """
+    __slots__ = ('downloads', 'uploads', 'files', 'last', 'clients')
+
+    def __init__(self):
+        self.downloads = 0
+        self.uploads = 0
+        self.files = 0
+        self.last = None
+        # Distinct client ids, kept for directories only
+        self.clients = set()
+
+
+class ActivityStore:
+    """
+    Compact in-memory record of the downloads and uploads of the session,
+    for the admin views.
+
+    Records are appended in time order, so a page of the newest records is
+    a slice of the list whatever the length of the history. Per-directory
+    and per-client totals are updated as records are added.
+    """
+    KINDS = ('download', 'upload')
+
+    def __init__(self):
+        self._records = {kind: [] for kind in self.KINDS}
+        self.directories = {}
+        self.clients = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, client_id, directory, time, files_count=None):
+        record = ActivityRecord(client_id, directory, time, files_count)
+        with self._lock:
+            self._records[kind].append(record)
+            for totals, key in ((self.directories, directory), (self.clients, client_id)):
+                entry = totals.get(key)
+                if entry is None:
+                    entry = totals[key] = ActivityTotals()
+                if kind == 'download':
+                    entry.downloads += 1
+                else:
+                    entry.uploads += 1
+                    entry.files += files_count or 0
+                if entry.last is None or time > entry.last:
+                    entry.last = time
+            self.directories[directory].clients.add(client_id)
+
+    def count(self, kind):
+        return len(self._records[kind])
+
+    def page(self, kind, page, page_size):
+        """
+        Returns the records of `kind` on `page` (from 1), newest first.
+        """
+        with self._lock:
+            records = self._records[kind]
+            end = max(len(records) - (page - 1) * page_size, 0)
+            return records[max(end - page_size, 0):end][::-1]
+
+    def directory_totals(self):
+        """
+        Returns `(directory, ActivityTotals)` pairs, sorted by directory.
+        """
+        with self._lock:
+            return sorted(self.directories.items(), key=lambda item: item[0] or '')
+
+    def clear(self):
+        with self._lock:
+            for records in self._records.values():
+                records.clear()
+            self.directories.clear()
+            self.clients.clear()
+
+
+class ActivityLogger(threading.Thread):
+    """
+    Write-behind log of client activity.
+
+    Views put events on a queue with `log` and return immediately; a
+    background thread collects them for up to `interval` seconds (or
+    `batch_size` events) and passes each batch to `write_batch`, which
+    stores it in a single transaction. Events are added to the `store`, if
+    given, right away.
+    """
+    def __init__(self, write_batch, batch_size=200, interval=0.5, store=None):
+        super().__init__(daemon=True, name='netfshare-activity')
+        self.write_batch = write_batch
+        self.store = store
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue()
+        self._write_lock = threading.Lock()
+        # Events taken from the queue by the background thread, not written yet
+        self._held = []
+        self._stopped = threading.Event()
+
+    def log(self, kind, client_id, directory, files_count=None, files=(), folder=None):
+        """
+        Queues a `download` or `upload` event of `client_id` in `directory`.
+        """
+        event = ActivityEvent(kind, client_id, directory, files_count, files, folder)
+        if self.store is not None:
+            self.store.add(kind, client_id, directory, event.time, files_count)
+        self.queue.put(event)
+
+    def _drain(self, batch):
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            self.write_batch(batch)
+        except Exception as e:
+            log.error('Failed to record %d activity events: %s', len(batch), e)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                first = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            with self._write_lock:
+                self._held.append(first)
+            # Give concurrent requests a moment to join this batch
+            self._stopped.wait(self.interval)
+            with self._write_lock:
+                batch, self._held = self._held, []
+                if batch:
+                    self._write(self._drain(batch))
+
+    def flush(self):
+        """
+        Writes all queued events now, from the calling thread.
+        """
+        with self._write_lock:
+            batch, self._held = self._held, []
+            if batch:
+                self._write(self._drain(batch))
+            while True:
+                batch = self._drain([])
+                if not batch:
+                    break
+                self._write(batch)
+
+    def stop(self):
+        self._stopped.set()
+        self.flush()
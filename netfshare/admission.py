@@ -0,0 +1,168 @@
+import time
+import shutil
+import threading
+import collections
+
+from .uploads import UploadError
+
+
+class AdmissionError(UploadError):
+    """
+    Raised when an upload is refused, with the seconds after which the
+    client may retry (`retry_after`), if any.
+    """
+    def __init__(self, message, status=503, retry_after=None):
+        super().__init__(message, status)
+        self.retry_after = retry_after
+
+
+class Admission:
+    """
+    An admitted upload, holding its concurrency slots and disk reservation
+    until `release` (or the end of a `with` block).
+    """
+    def __init__(self, controller, directory, size, slot=True):
+        self.controller = controller
+        self.directory = directory
+        self.size = size
+        self.slot = slot
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class UploadAdmission:
+    """
+    Admission control of uploads, decided from the declared size before
+    the request body is read.
+
+    An upload is refused if it is larger than `max_size` bytes (413), or if
+    it would leave less than `min_free` bytes free on the disk of
+    `disk_path` (507), counting the space reserved by uploads in progress.
+    At most `limit` uploads run at once, and at most `directory_limit` per
+    directory; further uploads wait in arrival order for up to
+    `queue_timeout` seconds and are then refused with 503 and a
+    `Retry-After` of `retry_after` seconds. Uploads waiting for a slot of
+    their own (busy) directory do not hold up uploads to other directories.
+    Limits of 0 mean unlimited.
+
+    Reservations are held until the upload ends, so the space of a file is
+    counted twice while it is written, erring on the safe side. Limits and
+    reservations apply to the uploads of this process only.
+    """
+    def __init__(self, disk_path, limit=0, directory_limit=0, max_size=0, min_free=0,
+                 queue_timeout=10, retry_after=10):
+        self.disk_path = disk_path
+        self.limit = limit
+        self.directory_limit = directory_limit
+        self.max_size = max_size
+        self.min_free = min_free
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self.reserved = 0
+        self.rejected = collections.Counter()
+        self._directories = collections.Counter()
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+
+    def configure(self, limit=None, directory_limit=None, max_size=None):
+        with self._cond:
+            if limit is not None:
+                self.limit = limit
+            if directory_limit is not None:
+                self.directory_limit = directory_limit
+            if max_size is not None:
+                self.max_size = max_size
+            self._cond.notify_all()
+
+    def free_space(self):
+        """
+        Returns the free bytes of the disk that are not reserved.
+        """
+        return shutil.disk_usage(self.disk_path).free - self.reserved
+
+    def _reject(self, reason, message, status, retry_after=None):
+        self.rejected[reason] += 1
+        raise AdmissionError(message, status, retry_after)
+
+    def _directory_free(self, directory):
+        return not self.directory_limit or self._directories[directory] < self.directory_limit
+
+    def _is_next(self, ticket):
+        # The first waiting upload whose directory has a free slot goes next
+        if self.limit and self.active >= self.limit:
+            return False
+        for waiting, directory in self._queue:
+            if self._directory_free(directory):
+                return waiting is ticket
+        return False
+
+    def _check_space(self, size):
+        if size and size > self.free_space() - self.min_free:
+            self._reject('disk', 'Not enough disk space on the server for this upload.', 507)
+
+    def admit(self, directory, size, wait=True, slot=True):
+        """
+        Admits an upload of `size` bytes to `directory`, waiting in line for
+        a free slot (unless not `wait`). Without `slot`, only the size and
+        disk space are checked. Returns an `Admission` or raises `AdmissionError`.
+        """
+        with self._cond:
+            if self.max_size and size > self.max_size:
+                self._reject('size', f'Upload too large, the limit is {self.max_size // 1024**2} MB.', 413)
+            self._check_space(size)
+            if not slot:
+                self.reserved += size
+                return Admission(self, directory, size, slot=False)
+
+            ticket = object()
+            self._queue.append((ticket, directory))
+            deadline = time.monotonic() + (self.queue_timeout if wait else 0)
+            try:
+                while not self._is_next(ticket):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject('busy', 'The server is busy with other uploads, retrying shortly.', 503,
+                                     self.retry_after)
+                    self._cond.wait(remaining)
+            finally:
+                self._queue.remove((ticket, directory))
+                self._cond.notify_all()
+
+            # Free space may have changed while waiting
+            self._check_space(size)
+            self.active += 1
+            self._directories[directory] += 1
+            self.reserved += size
+            return Admission(self, directory, size)
+
+    def _release(self, admission):
+        with self._cond:
+            if admission.slot:
+                self.active -= 1
+                self._directories[admission.directory] -= 1
+                if not self._directories[admission.directory]:
+                    del self._directories[admission.directory]
+            self.reserved -= admission.size
+            self._cond.notify_all()
+
+    @property
+    def waiting(self):
+        return len(self._queue)
+
+    def status(self):
+        """
+        Returns `{directory: active uploads}`.
+        """
+        with self._cond:
+            return dict(self._directories)
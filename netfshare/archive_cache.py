@@ -0,0 +1,462 @@
+import os
+import json
+import time
+import logging
+import hashlib
+import tempfile
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from .zipstream import (ZipStreamWriter, ZIP_DEFLATED, ZIP_STORED, compress_file,
+                        compression_policy, iter_directory_files)
+from .state import file_lock
+
+HASH_DIGEST_SIZE = 16
+HASH_READ_SIZE = 256 * 1024
+# Seconds between build progress reports
+PROGRESS_INTERVAL = 0.5
+
+log = logging.getLogger(__name__)
+
+
+def file_hash():
+    """
+    Returns a new hash object used for file content and archive digests.
+    """
+    return hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+
+
+def scan_directory(directory):
+    """
+    Returns a list of `(file_path, relative_path, stat_result)` for all files
+    in `directory`, in archive order.
+    """
+    entries = []
+    for file_path, relative_path in iter_directory_files(directory):
+        try:
+            entries.append((file_path, relative_path, os.stat(file_path)))
+        except OSError:
+            continue
+    return entries
+
+
+class BuildCancelled(Exception):
+    """
+    Raised by `ArchiveCache.build` when its `cancel` event is set.
+    """
+
+
+class _Flight:
+    """
+    A directory refresh in progress, shared by all requests for that directory.
+    """
+    __slots__ = ('done', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class ArchiveCache:
+    """
+    Content-addressed cache of directory archives under `cache_dir`.
+
+    For every cached directory a manifest stores the relative path, size,
+    mtime and content hash of each file, along with the position of its
+    compressed data in the archive. When files change, a new archive is
+    assembled from the compressed members of the previous one, and only new
+    or modified files are read and compressed. Archives are named by the
+    digest of their content and evicted in least-recently-used order once
+    their total size exceeds `max_bytes`.
+
+    Refreshes are single-flight: while one request checks and rebuilds the
+    archive of a directory, concurrent requests for the same directory wait
+    for its result instead of building their own copy. Archives are written
+    to a unique temporary file and renamed into place atomically.
+
+    The cache can be shared by several processes: builds of a directory are
+    serialized by a lock file, and manifests are reloaded when another
+    process replaces them.
+
+    `on_build(name, seconds, manifest)` is called after every build.
+    """
+    def __init__(self, cache_dir, max_bytes=None, refresh_time=0, compresslevel=6, workers=None,
+                 on_build=None):
+        self.cache_dir = cache_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.max_bytes = max_bytes
+        self.refresh_time = refresh_time
+        self.compresslevel = compresslevel
+        self.on_build = on_build
+        self._manifests = {}
+        self._indexes = {}
+        self._index_locks = collections.defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self.builds = 0
+        self.coalesced_builds = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def archive_path(self, digest):
+        return os.path.join(self.cache_dir, digest + '.zip')
+
+    def _manifest_path(self, name):
+        return os.path.join(self.cache_dir, name + '.manifest.json')
+
+    def load_manifest(self, name):
+        """
+        Returns the manifest of the directory `name`, or None if it was never built.
+        """
+        try:
+            version = os.stat(self._manifest_path(name)).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._manifests.get(name)
+            if cached is None or cached[0] != version:
+                try:
+                    with open(self._manifest_path(name), 'r') as f:
+                        manifest = json.load(f)
+                except (OSError, ValueError):
+                    return None
+                cached = self._manifests[name] = (version, manifest)
+            return cached[1]
+
+    def _save_manifest(self, name, manifest):
+        fd, tmp_path = tempfile.mkstemp(prefix=name + '.', suffix='.json.tmp', dir=self.cache_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path(name))
+        version = os.stat(self._manifest_path(name)).st_mtime_ns
+        with self._lock:
+            self._manifests[name] = (version, manifest)
+
+    def index(self, name, directory):
+        """
+        Returns the file index of `directory`: the path, size, mtime and
+        content hash of every file, as listed by the manifest, without
+        building the archive. Only files whose size or mtime differ from the
+        last index or archive build are read and hashed, none are compressed.
+        Its `version` is a digest of the listed paths, sizes and hashes.
+        """
+        with self._lock:
+            lock = self._index_locks[name]
+        # Concurrent callers reuse the hashes of the first one
+        with lock:
+            known = {}
+            for previous in (self.load_manifest(name), self._indexes.get(name)):
+                if previous is not None:
+                    known.update((entry['path'], entry) for entry in previous['files'])
+            files = []
+            digest = file_hash()
+            hashed = 0
+            for file_path, relative_path, st in scan_directory(directory):
+                entry = known.get(relative_path)
+                if entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+                    content_hash = entry['hash']
+                else:
+                    hasher = file_hash()
+                    try:
+                        with open(file_path, 'rb') as f:
+                            while True:
+                                data = f.read(HASH_READ_SIZE)
+                                if not data:
+                                    break
+                                hasher.update(data)
+                    except OSError:
+                        continue
+                    content_hash = hasher.hexdigest()
+                    hashed += 1
+                files.append({'path': relative_path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                              'hash': content_hash})
+                digest.update(f'{relative_path}\0{st.st_size}\0{content_hash}\0'.encode('utf-8'))
+            index = self._indexes[name] = {
+                'directory': name,
+                'version': digest.hexdigest(),
+                'checked': time.time(),
+                'files': files,
+            }
+        if hashed:
+            log.info('index %s: %d of %d files hashed', name, hashed, len(files))
+        return index
+
+    def has_archive(self, name):
+        """
+        Checks whether an archive of `name` was built and is still in the cache.
+        It may be out of date, `get` refreshes it incrementally.
+        """
+        manifest = self.load_manifest(name)
+        return manifest is not None and os.path.isfile(self.archive_path(manifest['archive']))
+
+    def is_building(self, name):
+        """
+        Checks whether the archive of `name` is being refreshed.
+        """
+        with self._flights_lock:
+            return name in self._flights
+
+    def refresh_async(self, name, directory, should_compress=None):
+        """
+        Refreshes the archive of `name` in a background thread.
+        """
+        thread = threading.Thread(target=self.refresh, args=(name, directory, should_compress),
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    def invalidate(self, name):
+        """
+        Forces the next `get` for directory `name` to rescan it for changes.
+        """
+        manifest = self.load_manifest(name)
+        if manifest is not None:
+            manifest['checked'] = 0
+
+    def is_fresh(self, name, scanned=None):
+        """
+        Checks whether the cached archive of `name` matches the files on disk.
+        `scanned` is the result of `scan_directory`, if already available.
+        """
+        manifest = self.load_manifest(name)
+        if manifest is None or not os.path.isfile(self.archive_path(manifest['archive'])):
+            return False
+        if scanned is None:
+            return time.time() - manifest['checked'] < self.refresh_time
+        if len(scanned) != len(manifest['files']):
+            return False
+        for (file_path, relative_path, st), entry in zip(scanned, manifest['files']):
+            if (relative_path != entry['path'] or st.st_size != entry['size']
+                    or st.st_mtime_ns != entry['mtime_ns']):
+                return False
+        return True
+
+    def get(self, name, directory, should_compress=None):
+        """
+        Returns `(archive_path, manifest)` for `directory`, rebuilding the
+        archive incrementally if any of its files changed.
+        `should_compress` is a function returned by `compression_policy`.
+        """
+        if not self.is_fresh(name):
+            self.refresh(name, directory, should_compress)
+        manifest = self.load_manifest(name)
+        archive = self.archive_path(manifest['archive'])
+        self._touch(archive)
+        return archive, manifest
+
+    def refresh(self, name, directory, should_compress=None, cancel=None, progress=None):
+        """
+        Checks the archive of `name` against `directory` and rebuilds it if
+        needed. Returns True if the archive was built. `cancel` and
+        `progress` are passed on to `build`.
+        """
+        with self._flights_lock:
+            flight = self._flights.get(name)
+            leader = flight is None
+            if leader:
+                flight = self._flights[name] = _Flight()
+            else:
+                self.coalesced_builds += 1
+
+        if not leader:
+            flight.done.wait()
+            if isinstance(flight.error, BuildCancelled) and cancel is None:
+                # Another caller gave up on the build, but this one still needs it
+                return self.refresh(name, directory, should_compress)
+            if flight.error is not None:
+                raise flight.error
+            return False
+
+        try:
+            # Another process may be building the same archive
+            with file_lock(os.path.join(self.cache_dir, name + '.lock'), cancel) as locked:
+                if not locked:
+                    raise BuildCancelled(name)
+                scanned = scan_directory(directory)
+                if self.is_fresh(name, scanned):
+                    self.load_manifest(name)['checked'] = time.time()
+                    return False
+                self.build(name, scanned, should_compress, cancel, progress)
+                return True
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[name]
+            flight.done.set()
+
+    def build(self, name, scanned, should_compress=None, cancel=None, progress=None):
+        """
+        Builds the archive of `name` from `scanned` files into the cache.
+        Unchanged files are copied from the previous archive in compressed
+        form. Changed files are deflated in parallel by a pool of `workers`
+        threads and assembled in order; files that `should_compress` rejects
+        are stored as they are read. Returns the new manifest.
+
+        The build stops with `BuildCancelled` once the `cancel` event is set.
+        `progress(done, total)` is called with the number of files written,
+        at most every `PROGRESS_INTERVAL` seconds.
+        """
+        if should_compress is None:
+            should_compress = compression_policy()
+        start = time.perf_counter()
+        previous = self.load_manifest(name)
+        reusable = {}
+        source = None
+        if previous is not None:
+            try:
+                source = open(self.archive_path(previous['archive']), 'rb')
+                reusable = {entry['path']: entry for entry in previous['files']}
+            except OSError:
+                source = None
+
+        fd, tmp_path = tempfile.mkstemp(prefix=name + '.', suffix='.zip.tmp', dir=self.cache_dir)
+        writer = ZipStreamWriter(compresslevel=self.compresslevel)
+        files = []
+        digest = file_hash()
+        recompressed = 0
+        # Members queued for writing, bounded so that only a few compressed
+        # files are held in spool files at any time
+        window = collections.deque()
+        reported = time.monotonic()
+
+        def write_member(f, file_path, relative_path, st, entry, job):
+            if entry is not None:
+                chunks = writer.write_raw(
+                    source, entry['data_offset'], relative_path, entry['method'],
+                    (entry['date'], entry['time']), entry['crc'],
+                    entry['compress_size'], entry['size'], entry['external_attr'])
+                content_hash = entry['hash']
+            elif job is not None:
+                compressed = job.result()
+                chunks = writer.write_raw(
+                    compressed.data, 0, relative_path, ZIP_DEFLATED, compressed.date_time,
+                    compressed.crc, compressed.compress_size, compressed.file_size,
+                    compressed.external_attr)
+                content_hash = compressed.hash
+            else:
+                hasher = file_hash()
+                chunks = writer.write_file(file_path, relative_path, compress=False, hasher=hasher)
+            for chunk in chunks:
+                f.write(chunk)
+            if job is not None:
+                compressed.data.close()
+            elif entry is None:
+                content_hash = hasher.hexdigest()
+
+            member = writer.members[-1]
+            files.append({
+                'path': relative_path,
+                'size': member.file_size,
+                'mtime_ns': st.st_mtime_ns,
+                'hash': content_hash,
+                'crc': member.crc,
+                'method': member.method,
+                'date': member.date,
+                'time': member.time,
+                'external_attr': member.external_attr,
+                'compress_size': member.compress_size,
+                'data_offset': member.data_offset,
+            })
+            # Everything that determines the archive bytes, so equal digests
+            # mean byte-identical archives (used as the download ETag)
+            digest.update(f'{relative_path}\0{content_hash}\0{member.method}\0{member.compress_size}\0'
+                          f'{member.date}\0{member.time}\0{member.external_attr}\0'.encode('utf-8'))
+
+        try:
+            with os.fdopen(fd, 'wb') as f, ThreadPoolExecutor(self.workers) as pool:
+                try:
+                    for done, (file_path, relative_path, st) in enumerate(scanned):
+                        if cancel is not None and cancel.is_set():
+                            raise BuildCancelled(name)
+                        if progress is not None and time.monotonic() - reported > PROGRESS_INTERVAL:
+                            reported = time.monotonic()
+                            progress(max(0, done - len(window)), len(scanned))
+                        method = ZIP_DEFLATED if should_compress(relative_path) else ZIP_STORED
+                        entry = reusable.get(relative_path)
+                        job = None
+                        if (entry is None or entry['size'] != st.st_size
+                                or entry['mtime_ns'] != st.st_mtime_ns or entry['method'] != method):
+                            entry = None
+                            recompressed += 1
+                            if method == ZIP_DEFLATED:
+                                job = pool.submit(compress_file, file_path, self.compresslevel,
+                                                  file_hash(), spool_dir=self.cache_dir)
+                        window.append((file_path, relative_path, st, entry, job))
+                        while len(window) > 2 * self.workers:
+                            write_member(f, *window.popleft())
+                    while window:
+                        write_member(f, *window.popleft())
+                    for chunk in writer.close():
+                        f.write(chunk)
+                finally:
+                    for *_, job in window:
+                        if job is not None and not job.cancel() and job.exception() is None:
+                            job.result().data.close()
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            if source is not None:
+                source.close()
+
+        manifest = {
+            'directory': name,
+            'archive': digest.hexdigest(),
+            'size': writer.offset,
+            'last_modified': max((entry['mtime_ns'] for entry in files), default=0) / 1e9,
+            'built': time.time(),
+            'checked': time.time(),
+            'recompressed': recompressed,
+            'files': files,
+        }
+        os.replace(tmp_path, self.archive_path(manifest['archive']))
+        self._save_manifest(name, manifest)
+        self.builds += 1
+        seconds = time.perf_counter() - start
+        log.info('archive %s: %d of %d files compressed in %.2f s', name, recompressed, len(files), seconds)
+        if self.on_build is not None:
+            self.on_build(name, seconds, manifest)
+        self.evict(keep=manifest['archive'])
+        return manifest
+
+    def _touch(self, archive):
+        # The access time orders archives for LRU eviction
+        try:
+            os.utime(archive, (time.time(), os.path.getmtime(archive)))
+        except OSError:
+            pass
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used archives until the cache fits `max_bytes`.
+        Returns the number of removed archives.
+        """
+        if not self.max_bytes:
+            return 0
+        archives = []
+        for file in os.listdir(self.cache_dir):
+            if file.endswith('.zip'):
+                file_path = os.path.join(self.cache_dir, file)
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                archives.append((st.st_atime, st.st_size, file_path, file[:-len('.zip')]))
+        total = sum(size for _, size, _, _ in archives)
+        removed = 0
+        for _, size, file_path, digest in sorted(archives):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            try:
+                os.remove(file_path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,216 @@
+import os
+import gzip
+import base64
+import hashlib
+import argparse
+import tempfile
+import threading
+import mimetypes
+import urllib.request
+
+try:
+    import brotli
+except ImportError: # Optional dependency, gzip variants only
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+FINGERPRINT_SIZE = 10
+# Served compressed (the other static files are already compressed)
+COMPRESS_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+COMPRESS_MIMETYPES = {'text/html', 'text/plain', 'text/css', 'application/json', 'application/javascript'}
+# One year, the longest lifetime clients are required to honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Third-party client assets committed to `static` (downloaded once by
+# `python -m netfshare.assets`), with the Subresource Integrity hashes of the
+# released files
+VENDOR_ASSETS = {
+    'socket.io.js': (
+        'https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.0.1/socket.io.js',
+        'sha512-q/dWJ3kcmjBLU4Qc47E4A9kTB4m3wuTY7vkFJDTZKjTs8jhyGQnaUrxa0Ytd0ssMZhbNua9hE+E7Qv1j+DyZwA==',
+    ),
+}
+
+
+def accepted_encodings(accept_encoding):
+    """
+    Returns the content codings accepted by the `Accept-Encoding` header, without q=0 ones.
+    """
+    encodings = set()
+    for item in (accept_encoding or '').split(','):
+        coding, _sep, params = item.strip().partition(';')
+        if coding and params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            encodings.add(coding.lower())
+    return encodings
+
+
+class Asset:
+    """
+    A static file with its fingerprinted name and precompressed variants.
+    """
+    __slots__ = ('name', 'path', 'fingerprinted', 'mimetype', 'variants')
+
+    def __init__(self, name, path, digest):
+        self.name = name
+        self.path = path
+        root, ext = os.path.splitext(name)
+        self.fingerprinted = f'{root}.{digest[:FINGERPRINT_SIZE]}{ext}'
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        # {content coding: file path}, filled in by `AssetPipeline.build`
+        self.variants = {}
+
+
+class AssetPipeline:
+    """
+    Serves the files of `static_dir` under content-fingerprinted names, so
+    they can be cached by clients forever.
+
+    Text assets are compressed once per version (gzip, and brotli if the
+    `brotli` package is installed) into `cache_dir`, and the variant best
+    matching the client's `Accept-Encoding` is sent. Fingerprints are
+    computed on first use; `build` writes the compressed variants and can
+    run in the background, as identity files are served meanwhile.
+    """
+    def __init__(self, static_dir, cache_dir):
+        self.static_dir = static_dir
+        self.cache_dir = cache_dir
+        self._assets = None
+        self._by_fingerprint = None
+        self._lock = threading.Lock()
+
+    def _index(self):
+        with self._lock:
+            if self._assets is None:
+                assets = {}
+                for root, dirs, files in os.walk(self.static_dir):
+                    for file in files:
+                        path = os.path.join(root, file)
+                        name = os.path.relpath(path, self.static_dir).replace(os.sep, '/')
+                        with open(path, 'rb') as f:
+                            digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+                        assets[name] = Asset(name, path, digest)
+                self._by_fingerprint = {asset.fingerprinted: asset for asset in assets.values()}
+                self._assets = assets
+            return self._assets
+
+    def __contains__(self, name):
+        return name in self._index()
+
+    def fingerprinted(self, name):
+        """
+        Returns the fingerprinted name of the static file `name`.
+        """
+        return self._index()[name].fingerprinted
+
+    def find(self, fingerprinted):
+        """
+        Returns the `Asset` served as `fingerprinted`, or None.
+        """
+        self._index()
+        return self._by_fingerprint.get(fingerprinted)
+
+    def build(self):
+        """
+        Writes the missing compressed variants of the text assets.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        codings = [('gzip', '.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+        if brotli is not None:
+            codings.insert(0, ('br', '.br', lambda data: brotli.compress(data, quality=11)))
+        for asset in list(self._index().values()):
+            if os.path.splitext(asset.name)[1] not in COMPRESS_EXTENSIONS:
+                continue
+            data = None
+            for coding, suffix, compress in codings:
+                path = os.path.join(self.cache_dir, asset.fingerprinted.replace('/', '_') + suffix)
+                if not os.path.isfile(path):
+                    if data is None:
+                        with open(asset.path, 'rb') as f:
+                            data = f.read()
+                    fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(compress(data))
+                    os.replace(tmp_path, path)
+                asset.variants[coding] = path
+
+    def select(self, asset, accept_encoding):
+        """
+        Returns `(file_path, content_coding)` of the variant of `asset` to send.
+        """
+        accepted = accepted_encodings(accept_encoding)
+        for coding in ('br', 'gzip'):
+            if coding in asset.variants and coding in accepted:
+                return asset.variants[coding], coding
+        return asset.path, None
+
+
+def compress_response(response, accept_encoding, min_size=1024, level=6):
+    """
+    Gzips the body of a buffered text `response` in place, if the client
+    accepts it and the body is larger than `min_size` bytes.
+    """
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES
+            or 'gzip' not in accepted_encodings(accept_encoding)):
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+    response.set_data(gzip.compress(data, level))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # The compressed body is not byte-identical to the one of the strong ETag
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def matches_integrity(data, integrity):
+    """
+    Checks `data` against a Subresource Integrity hash (`sha512-...`).
+    """
+    algorithm, expected = integrity.split('-', 1)
+    return base64.b64encode(hashlib.new(algorithm, data).digest()).decode('ascii') == expected
+
+
+def unvendored(static_dir=STATIC_DIR):
+    """
+    Returns the names of the `VENDOR_ASSETS` missing from `static_dir`, or
+    not matching their integrity hashes.
+    """
+    names = []
+    for name, (url, integrity) in VENDOR_ASSETS.items():
+        try:
+            with open(os.path.join(static_dir, name), 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = None
+        if data is None or not matches_integrity(data, integrity):
+            names.append(name)
+    return names
+
+
+def vendor(static_dir=STATIC_DIR):
+    """
+    Downloads the `VENDOR_ASSETS` missing from `static_dir` and checks them
+    against their integrity hashes.
+    """
+    for name, (url, integrity) in VENDOR_ASSETS.items():
+        path = os.path.join(static_dir, name)
+        if os.path.isfile(path):
+            continue
+        with urllib.request.urlopen(url, timeout=60) as response:
+            data = response.read()
+        if not matches_integrity(data, integrity):
+            raise RuntimeError(f'{url} does not match its integrity hash.')
+        with open(path, 'wb') as f:
+            f.write(data)
+        print(f'{name}: {len(data)} bytes from {url}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m netfshare.assets',
+                                     description='Vendor the third-party client assets into the package.')
+    parser.parse_args()
+    vendor()
@@ -0,0 +1,229 @@
+import time
+import threading
+import collections
+
+SLICE_SIZE = 64 * 1024
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. `rate` is in bytes per second, `burst` is the
+    bucket capacity in seconds of traffic.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'lock')
+
+    def __init__(self, rate, burst=0.5):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = rate * burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, size, rate=None):
+        """
+        Takes `size` tokens, going into debt if needed, and returns the number
+        of seconds to wait before sending. `rate` overrides the bucket rate.
+        """
+        rate = self.rate if rate is None else rate
+        if not rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(rate * self.burst, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            self.tokens -= size
+            return -self.tokens / rate if self.tokens < 0 else 0
+
+
+class FairSlots:
+    """
+    Counting semaphore that admits waiters in arrival order.
+    A `limit` of 0 means unlimited.
+    """
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.active = 0
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            ticket = object()
+            self._queue.append(ticket)
+            while self._queue[0] is not ticket or (self.limit and self.active >= self.limit):
+                self._cond.wait()
+            self._queue.popleft()
+            self.active += 1
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    @property
+    def waiting(self):
+        return len(self._queue)
+
+
+class TransferScheduler:
+    """
+    Shapes the traffic of all downloads and uploads.
+
+    Every transfer draws from a global token bucket (`global_rate`, bytes/s)
+    and from a bucket of its client. Active clients get a fair share of the
+    global rate, further capped by `client_rate`. At most `directory_limit`
+    transfers per directory run at the same time; further transfers wait
+    in arrival order. Rates and limits of 0 mean unlimited.
+
+    Transferred bytes are counted per client and direction in `transferred`.
+    """
+    def __init__(self, global_rate=0, client_rate=0, directory_limit=0):
+        self.global_bucket = TokenBucket(global_rate)
+        self.client_rate = client_rate
+        self.directory_limit = directory_limit
+        self._clients = {}
+        self._transfers = collections.Counter()
+        self._directories = {}
+        self._lock = threading.Lock()
+        self.transferred = collections.Counter()
+
+    def configure(self, global_rate=None, client_rate=None, directory_limit=None):
+        if global_rate is not None:
+            self.global_bucket.rate = global_rate
+        if client_rate is not None:
+            self.client_rate = client_rate
+        if directory_limit is not None:
+            self.directory_limit = directory_limit
+            with self._lock:
+                for slots in self._directories.values():
+                    slots.limit = directory_limit
+            for slots in list(self._directories.values()):
+                with slots._cond:
+                    slots._cond.notify_all()
+
+    @property
+    def limited(self):
+        """
+        False if no rate or concurrency limit is set.
+        """
+        return bool(self.global_bucket.rate or self.client_rate or self.directory_limit)
+
+    @property
+    def active_transfers(self):
+        return sum(self._transfers.values())
+
+    def status(self):
+        """
+        Returns `{directory: (active, waiting)}` transfers.
+        """
+        return {path: (slots.active, slots.waiting) for path, slots in self._directories.items()
+                if slots.active or slots.waiting}
+
+    def _client_rate(self):
+        # Fair share of the global rate between clients with active transfers
+        rates = [r for r in (self.client_rate,) if r]
+        if self.global_bucket.rate:
+            rates.append(self.global_bucket.rate / max(1, len(self._transfers)))
+        return min(rates) if rates else 0
+
+    def _start(self, client_id, directory):
+        with self._lock:
+            self._transfers[client_id] += 1
+            if client_id not in self._clients:
+                self._clients[client_id] = TokenBucket(0)
+            slots = self._directories.get(directory)
+            if slots is None:
+                slots = self._directories[directory] = FairSlots(self.directory_limit)
+        slots.acquire()
+        return self._clients[client_id], slots
+
+    def _finish(self, client_id, slots):
+        slots.release()
+        with self._lock:
+            self._transfers[client_id] -= 1
+            if not self._transfers[client_id]:
+                del self._transfers[client_id]
+                self._clients.pop(client_id, None)
+
+    def record(self, client_id, direction, size):
+        """
+        Counts `size` bytes transferred by `client_id` in `direction`
+        (`download` or `upload`).
+        """
+        with self._lock:
+            self.transferred[client_id, direction] += size
+
+    def throttle(self, bucket, size):
+        wait = max(self.global_bucket.reserve(size), bucket.reserve(size, self._client_rate()))
+        if wait:
+            time.sleep(wait)
+
+    def wrap(self, chunks, client_id, directory):
+        """
+        Yields the byte `chunks` of a download at the scheduled rate.
+        """
+        bucket, slots = self._start(client_id, directory)
+        sent = 0
+        try:
+            for chunk in chunks:
+                if not self.limited:
+                    sent += len(chunk)
+                    yield chunk
+                    continue
+                view = memoryview(chunk)
+                for start in range(0, len(view), SLICE_SIZE):
+                    piece = view[start:start + SLICE_SIZE]
+                    self.throttle(bucket, len(piece))
+                    sent += len(piece)
+                    yield bytes(piece)
+        finally:
+            self._finish(client_id, slots)
+            self.record(client_id, 'download', sent)
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def reader(self, stream, client_id, directory):
+        """
+        Returns a file-like wrapper of an upload `stream`, read at the
+        scheduled rate. Call its `close` when the upload is done.
+        """
+        return ThrottledReader(self, stream, client_id, directory)
+
+
+class ThrottledReader:
+    """
+    Readable stream of an upload, paced by a `TransferScheduler`.
+    """
+    def __init__(self, scheduler, stream, client_id, directory):
+        self.scheduler = scheduler
+        self.stream = stream
+        self.client_id = client_id
+        self._bucket, self._slots = scheduler._start(client_id, directory)
+        self._closed = False
+        self.received = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > SLICE_SIZE:
+            size = SLICE_SIZE
+        data = self.stream.read(size)
+        if data:
+            self.received += len(data)
+            self.scheduler.throttle(self._bucket, len(data))
+        return data
+
+    def readline(self, size=-1):
+        data = self.stream.readline(size if size and size > 0 else SLICE_SIZE)
+        if data:
+            self.received += len(data)
+            self.scheduler.throttle(self._bucket, len(data))
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.scheduler._finish(self.client_id, self._slots)
+            self.scheduler.record(self.client_id, 'upload', self.received)
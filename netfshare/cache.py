@@ -0,0 +1,167 @@
+import logging
+import datetime
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class ClientRecord:
+    """
+    Read-only snapshot of a `Client` row, served from memory on the page path.
+    """
+    __slots__ = ('id', 'address', 'selected_name', 'selected_id', 'socket_connected', 'last_seen')
+
+    def __init__(self, client, last_seen=None):
+        self.id = client.id
+        self.address = client.address
+        self.selected_name = client.selected_name
+        self.selected_id = client.selected_id
+        self.socket_connected = client.socket_connected
+        self.last_seen = last_seen or client.last_seen
+
+    @property
+    def active(self):
+        if (datetime.datetime.now() - self.last_seen).total_seconds() < 15:
+            return True
+        return bool(self.socket_connected)
+
+    def __repr__(self):
+        return f'Client: {self.address} (Name: {self.selected_name}, ID: {self.selected_id})'
+
+
+class MessageRecord:
+    """
+    Read-only snapshot of a `Message` row.
+    """
+    __slots__ = ('id', 'name', 'message', 'description', 'category')
+
+    def __init__(self, message):
+        self.id = message.id
+        self.name = message.name
+        self.message = message.message
+        self.description = message.description
+        self.category = message.category
+
+
+class AppCache:
+    """
+    In-memory cache of clients (by address), `ConfigBool` values and
+    `Message` rows, filled lazily from the database by the given loader
+    functions and invalidated by the views that write them.
+
+    Client activity (`last_seen`) is recorded in memory only and written to
+    the database in batches by `flush`, so rendering a page does not need
+    a write transaction.
+
+    `on_invalidate(kind, address)` is called for every invalidation with
+    `notify` (`kind` is `client`, `config` or `messages`), so that other
+    processes can drop their copies.
+    """
+    def __init__(self, load_client, load_configs, load_messages, on_invalidate=None):
+        self._load_client = load_client
+        self._load_configs = load_configs
+        self._load_messages = load_messages
+        self.on_invalidate = on_invalidate
+        self._clients = {}
+        self._configs = None
+        self._messages = None
+        self._last_seen = {}
+        self._lock = threading.Lock()
+
+    def client(self, address):
+        """
+        Returns the `ClientRecord` of `address`, or None for unknown clients.
+        """
+        record = self._clients.get(address)
+        if record is None:
+            client = self._load_client(address)
+            if client is None:
+                return None
+            record = ClientRecord(client, self._last_seen.get(client.id))
+            self._clients[address] = record
+        return record
+
+    def config(self, name, default=None):
+        """
+        Returns the value of the `ConfigBool` called `name`.
+        """
+        configs = self._configs
+        if configs is None:
+            configs = self._configs = self._load_configs()
+        return configs.get(name, default)
+
+    def messages(self):
+        """
+        Returns a list of `MessageRecord`s of all messages.
+        """
+        messages = self._messages
+        if messages is None:
+            messages = self._messages = [MessageRecord(m) for m in self._load_messages()]
+        return messages
+
+    def _notify(self, kind, address=None):
+        if self.on_invalidate is not None:
+            try:
+                self.on_invalidate(kind, address)
+            except Exception as e:
+                log.error('Invalidation of %s failed: %s', kind, e)
+
+    def invalidate_client(self, address=None, notify=True):
+        """
+        Drops the cached client of `address`, or all clients.
+        """
+        if address is None:
+            self._clients = {}
+        else:
+            self._clients.pop(address, None)
+        if notify:
+            self._notify('client', address)
+
+    def invalidate_config(self, notify=True):
+        self._configs = None
+        if notify:
+            self._notify('config')
+
+    def invalidate_messages(self, notify=True):
+        self._messages = None
+        if notify:
+            self._notify('messages')
+
+    def touch(self, record):
+        """
+        Marks the client `record` as seen now, to be written by the next `flush`.
+        """
+        now = datetime.datetime.now()
+        record.last_seen = now
+        with self._lock:
+            self._last_seen[record.id] = now
+
+    def take_last_seen(self):
+        """
+        Returns and clears the pending `{client_id: last_seen}` updates.
+        """
+        with self._lock:
+            pending, self._last_seen = self._last_seen, {}
+        return pending
+
+
+class PeriodicFlush(threading.Thread):
+    """
+    Daemon thread calling `flush` every `interval` seconds until stopped.
+    """
+    def __init__(self, flush, interval):
+        super().__init__(daemon=True, name='netfshare-flush')
+        self.flush = flush
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log.error('Flush failed: %s', e)
+
+    def stop(self):
+        self.stopped.set()
+        self.flush()
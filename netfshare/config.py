@@ -8,12 +8,77 @@ DEBUG = True
 SECRET_KEY = os.getenv('SECRET_KEY', 'default_for_dev') # load WSGI secret key from enironment variables
 WTF_CSRF_ENABLED = True
 PORT = 5000
+# Console output level: DEBUG, INFO, WARNING or ERROR
+LOG_LEVEL = 'INFO'
+
+# Server: `dev` (Werkzeug development server), `eventlet` or `gevent`.
+# Overridden by `--server` on the command line.
+SERVER_MODE = 'dev'
+# Maximum concurrent connections in the eventlet and gevent modes
+WORKER_CONNECTIONS = 1000
+KEEPALIVE = True
+# Worker processes serving the same port (eventlet and gevent modes),
+# overridden by `--processes` on the command line. Workers share state
+# through the STATE_BACKEND: `local` (single process), `sqlite` (a database
+# in `.netfshare`, used by default with several processes) or the URL of a
+# Redis-compatible server, e.g. `redis://localhost:6379/0`. Upload
+# admission (UPLOAD_LIMIT and below) is decided by each process on its own.
+PROCESSES = 1
+STATE_BACKEND = 'local'
+# Gzip HTML, JSON and text responses larger than COMPRESS_MIN_SIZE bytes
+COMPRESS_RESPONSES = True
+COMPRESS_MIN_SIZE = 1024
+# Block size of file responses (archives, static files) in bytes
+SEND_BLOCK_SIZE = 1024 * 1024
+# Let a front-end server (nginx, Apache) send files with X-Sendfile
+USE_X_SENDFILE = False
 
 # Database
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+# Seconds between writes of client activity (last seen) to the database
+LAST_SEEN_FLUSH_INTERVAL = 5
+# Milliseconds to wait for a database lock before failing
+SQLITE_BUSY_TIMEOUT = 5000
+# Downloads and uploads are recorded in batches of up to ACTIVITY_BATCH_SIZE
+# events, collected for ACTIVITY_FLUSH_INTERVAL seconds
+ACTIVITY_BATCH_SIZE = 200
+ACTIVITY_FLUSH_INTERVAL = 0.5
+
+# Entries per page when browsing read only directories
+BROWSE_PAGE_SIZE = 100
+# Clients, downloads and uploads per page of the session view
+SESSION_PAGE_SIZE = 100
+
+# Seconds a verified cached archive is served without rescanning its directory
+ARCHIVE_RECHECK_TIME = 2
+# Total size of cached archives in `.netfshare/archives` (bytes)
+ARCHIVE_CACHE_SIZE = 10 * 1024**3
+# Threads compressing archive members in parallel (None: one per CPU core)
+ARCHIVE_WORKERS = None
+# Build archives in the background as soon as a directory is shared or its
+# files change (WARM_DELAY seconds after the last change), WARM_WORKERS at a time
+ARCHIVE_WARMING = True
+WARM_WORKERS = 1
+WARM_DELAY = 2
+
+# Per directory archive compression: `auto` stores already compressed
+# media (STORE_EXTENSIONS) and deflates other files, `deflate` or `store`
+# apply to all files. Directories not listed use `auto`.
+DIRECTORY_COMPRESSION = {}
+STORE_EXTENSIONS = [
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp3', '.mp4', '.m4a', '.mkv', '.mov', '.avi', '.webm', '.ogg',
+    '.zip', '.gz', '.bz2', '.xz', '.7z', '.rar', '.zst',
+    '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.jar', '.apk',
+]
 
-# Served file refresh time
-REFRESH_TIME = 120
+# Stream zip archives to the client while they are generated, if no cached
+# archive is available yet, instead of waiting for the cached build
+STREAM_DOWNLOADS = True
+# Archives streamed at once by each worker process, each compressing its own
+# copy. Further downloads wait for the cached build, shared by all of them.
+STREAM_LIMIT = 4
+ZIP_COMPRESSLEVEL = 6
 
 SHARE_MODES = {
     0: 'Not shared',
@@ -23,8 +88,49 @@ SHARE_MODES = {
 
 EXCLUDE_DIRNAMES = ['.git', '.netfshare', '__pycache__', 'venv']
 
+# Watch the shared directory for changes: `auto` uses filesystem events if
+# the `watchdog` package is installed and polls otherwise, `polling` always
+# rescans every WATCH_INTERVAL seconds, `off` only scans on admin request
+WATCHER = 'auto'
+WATCH_INTERVAL = 10
+
+# Background client pings: seconds between rounds (0 disables pinging),
+# reply timeout and number of concurrent pings
+PING_INTERVAL = 10
+PING_TIMEOUT = 0.5
+PING_WORKERS = 64
+
+# Transfer scheduling defaults, adjustable in the admin view: total and
+# per client bandwidth of downloads and uploads (KiB/s, 0 for unlimited)
+# and concurrent transfers per directory (0 for unlimited)
+BANDWIDTH_LIMIT = 0
+CLIENT_BANDWIDTH_LIMIT = 0
+DIRECTORY_TRANSFER_LIMIT = 0
+
 # Maximum number of files to upload at once
 MAX_FILES = 10
+# Size of chunks in resumable uploads (bytes)
+UPLOAD_CHUNK_SIZE = 8 * 1024**2
+# Resumable uploads that receive no chunk for this long (seconds) are removed
+# with their files (0 to keep them)
+UPLOAD_SESSION_EXPIRY = 24 * 3600
+# Store uploaded files with identical content once, hard-linked into each
+# client's folder from `.netfshare/cas` (requires a filesystem with hard links)
+UPLOAD_DEDUPLICATION = False
+# Admission of uploads: concurrent uploads in total and per directory, and
+# size of a single upload (MB), 0 for unlimited. Uploads over the concurrency
+# limits wait in line for UPLOAD_QUEUE_TIMEOUT seconds, then clients are
+# asked to retry after UPLOAD_RETRY_AFTER seconds. Uploads that would leave
+# less than MIN_FREE_SPACE (MB) free on the disk are refused. With several
+# PROCESSES, the concurrency limits are split between the processes, and
+# each process only reserves disk space for its own uploads in progress:
+# raise MIN_FREE_SPACE to cover the uploads of the other processes.
+UPLOAD_LIMIT = 0
+DIRECTORY_UPLOAD_LIMIT = 0
+MAX_UPLOAD_SIZE = 0
+MIN_FREE_SPACE = 1024
+UPLOAD_QUEUE_TIMEOUT = 10
+UPLOAD_RETRY_AFTER = 10
 
 # Localization
 LANGUAGES = ['en', 'sl']
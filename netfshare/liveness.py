@@ -0,0 +1,99 @@
+import os
+import logging
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pythonping import ping
+
+log = logging.getLogger(__name__)
+PAYLOAD_SIZE = 16
+
+
+def ping_address(address, timeout):
+    """
+    Sends a single ICMP echo request to `address`.
+    Returns False if the host does not answer or can not be pinged.
+
+    Probes run concurrently and every one of them sees all echo replies, so
+    the reply must carry the random payload of this request, not only its
+    identifier.
+    """
+    payload = os.urandom(PAYLOAD_SIZE)
+    try:
+        return ping(address, count=1, timeout=timeout, payload=payload, size=PAYLOAD_SIZE,
+                    match=True).success()
+    except Exception:
+        # E.g. no permission to open raw sockets
+        return False
+
+
+class LivenessProber(threading.Thread):
+    """
+    Pings all clients concurrently every `interval` seconds in the background.
+
+    The latest result for every address is kept in memory (`snapshot`), so
+    views can show client liveness without waiting for the network.
+    `on_change` is called with `{address: alive}` of the clients whose state
+    changed in a probe round.
+    """
+    def __init__(self, list_addresses, on_change=None, interval=10, timeout=0.5, workers=64):
+        super().__init__(daemon=True, name='netfshare-liveness')
+        self.list_addresses = list_addresses
+        self.on_change = on_change
+        self.interval = interval
+        self.timeout = timeout
+        self.workers = workers
+        self._snapshot = {}
+        self._stopped = threading.Event()
+
+    @property
+    def snapshot(self):
+        """
+        `{address: (alive, last_alive)}` of the latest probe round.
+        """
+        return self._snapshot
+
+    def is_alive(self, address):
+        alive, _ = self._snapshot.get(address, (False, None))
+        return alive
+
+    def last_alive(self, address):
+        _, last_alive = self._snapshot.get(address, (False, None))
+        return last_alive
+
+    def probe(self):
+        """
+        Pings all addresses once and updates the snapshot.
+        """
+        addresses = list(set(self.list_addresses()))
+        if not addresses:
+            return {}
+        with ThreadPoolExecutor(min(self.workers, len(addresses))) as pool:
+            results = pool.map(lambda address: ping_address(address, self.timeout), addresses)
+            results = dict(zip(addresses, results))
+
+        now = datetime.datetime.now()
+        previous = self._snapshot
+        snapshot = {}
+        changed = {}
+        for address, alive in results.items():
+            _, last_alive = previous.get(address, (False, None))
+            snapshot[address] = (alive, now if alive else last_alive)
+            if address not in previous or previous[address][0] != alive:
+                changed[address] = alive
+        self._snapshot = snapshot
+        if changed and self.on_change is not None:
+            self.on_change(changed)
+        return changed
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.probe()
+            except Exception as e:
+                log.warning('Liveness probe failed: %s', e)
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
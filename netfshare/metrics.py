@@ -0,0 +1,201 @@
+import math
+import bisect
+import threading
+
+# Default histogram buckets (seconds)
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    """
+    Base of all metrics: a value for each combination of `labels` values.
+    """
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        """
+        Returns `(suffix, label values, extra labels, value)` of all samples.
+        """
+        with self._lock:
+            return [('', key, (), value) for key, value in self._values.items()]
+
+    def snapshot(self):
+        """
+        Returns `[{'labels': {...}, 'value': ...}]` for JSON output.
+        """
+        return [{'labels': dict(zip(self.labels, key)), 'value': value}
+                for suffix, key, extra, value in self.samples() if not suffix and not extra]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class CallbackMetric(Metric):
+    """
+    Metric read from `function` when collected. `function` returns a value,
+    or a `{label values tuple: value}` dict for labelled metrics.
+    """
+    def __init__(self, name, documentation, function, labels=(), type='gauge'):
+        super().__init__(name, documentation, labels)
+        self.function = function
+        self.type = type
+
+    def samples(self):
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [('', tuple(str(v) for v in key), (), value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            state[0][index] += 1
+            state[1] += 1
+            state[2] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            values = [(key, list(counts), count, total) for key, (counts, count, total) in self._values.items()]
+        for key, counts, count, total in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', key, (('le', _format_value(float(bound))),), cumulative))
+            samples.append(('_sum', key, (), total))
+            samples.append(('_count', key, (), count))
+        return samples
+
+    def quantile(self, q, counts, count):
+        """
+        Estimates the `q` quantile (0-1) from bucket `counts`.
+        """
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        lower = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if bound == math.inf:
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+            lower = bound
+        return lower
+
+    def snapshot(self):
+        with self._lock:
+            values = [(key, list(counts), count, total) for key, (counts, count, total) in self._values.items()]
+        return [{
+            'labels': dict(zip(self.labels, key)),
+            'count': count,
+            'sum': total,
+            'p50': self.quantile(0.5, counts, count),
+            'p99': self.quantile(0.99, counts, count),
+        } for key, counts, count, total in values]
+
+
+class Registry:
+    """
+    Collection of metrics, exposed in the Prometheus text format.
+    """
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=TIME_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def callback(self, name, documentation, function, labels=(), type='gauge'):
+        return self.register(CallbackMetric(name, documentation, function, labels, type))
+
+    def exposition(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for suffix, key, extra, value in metric.samples():
+                labels = _format_labels(metric.labels, key, extra)
+                lines.append(f'{metric.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """
+        Returns `{name: {'type', 'help', 'samples'}}` of all metrics.
+        """
+        return {metric.name: {'type': metric.type, 'help': metric.documentation,
+                              'samples': metric.snapshot()}
+                for metric in self.metrics}
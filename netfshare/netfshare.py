@@ -1,21 +1,52 @@
+import io
 import os
-import time
-import zipfile
+import csv
 import json
+import time
 import datetime
 import socket
-from functools import wraps
-from pythonping import ping
-
-from flask import (Flask, Blueprint, request, redirect, url_for, 
-                   send_file, flash, render_template, session)
+import atexit
+import logging
+import threading
+import contextlib
+from functools import wraps, lru_cache
+
+from flask import (Flask, Blueprint, request, redirect, url_for, abort,
+                   send_file, flash, render_template, session, Response, jsonify, g)
 from flask_sqlalchemy import SQLAlchemy
 from flask_babel import Babel, _
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room, emit
+from werkzeug.security import safe_join
+from werkzeug.exceptions import RequestEntityTooLarge
+from sqlalchemy import update, bindparam, event, func, inspect, text
+from sqlalchemy.orm import joinedload, selectinload
+
+from .server import SERVER_MODES, server_mode
+from .zipstream import (stream_directory, stream_files, compression_policy, iter_directory_files,
+                        STORE_EXTENSIONS, ZipStreamWriter)
+from .archive_cache import ArchiveCache
+from .uploads import UploadSessions, UploadError, ContentStore, save_stream
+from .cache import AppCache, PeriodicFlush
+from .activity import ActivityLogger, ActivityStore
+from .liveness import LivenessProber
+from .watcher import SharedTree, TreeWatcher
+from .bandwidth import TransferScheduler
+from .admission import UploadAdmission, AdmissionError
+from .metrics import Registry
+from .warmer import ArchiveWarmer
+from .push import ShareBroadcaster, mode_room
+from .state import open_backend, BackendManager, RedisBackend
+from .assets import AssetPipeline, STATIC_DIR, IMMUTABLE_MAX_AGE, compress_response, unvendored
 
 SHARED_DIRECTORY = os.getcwd()
 app = Flask(__name__)
-socketio = SocketIO(app)
+
+# Level-gated console output, set with `LOG_LEVEL` in the config
+log = logging.getLogger('netfshare')
+if not log.handlers:
+    log.addHandler(logging.StreamHandler())
+    log.propagate = False
+log.setLevel(logging.INFO)
 
 # Register this module as view Blueprint
 netfshare = Blueprint('netfshare', __name__)
@@ -23,13 +54,35 @@ netfshare = Blueprint('netfshare', __name__)
 
 # Config app
 local_config = os.path.join(SHARED_DIRECTORY, '.netfshare', 'config.json')
-print(f'Starting netfshare in {SHARED_DIRECTORY}...')
+log.info('Starting netfshare in %s...', SHARED_DIRECTORY)
 try:
-    print('config from local file: ', local_config)
+    log.info('config from local file: %s', local_config)
     app.config.from_file(local_config, load=json.load, text=False)
 except Exception as e:
-    print(f'Exception: {e}\nUsing default config.')
+    log.info('Exception: %s\nUsing default config.', e)
     app.config.from_object('netfshare.config')
+log.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+if 'REFRESH_TIME' in app.config:
+    log.warning('REFRESH_TIME is no longer used, ARCHIVE_RECHECK_TIME sets the seconds a cached archive '
+                'is served without rescanning its directory.')
+
+# Worker processes (`--processes`) share state through the `STATE_BACKEND`:
+# cache invalidations and Socket.IO broadcasts are passed between them
+worker_index = int(os.getenv('NETFSHARE_WORKER', 0))
+worker_count = int(os.getenv('NETFSHARE_WORKERS', 1))
+primary_worker = worker_index == 0
+state_setting = app.config.get('STATE_BACKEND', 'local')
+if worker_count > 1 and state_setting == 'local':
+    state_setting = 'sqlite'
+state_backend = open_backend(state_setting, os.path.join(SHARED_DIRECTORY, '.netfshare'))
+
+# Socket.IO on the async framework of the selected serving mode
+socketio_options = {}
+if isinstance(state_backend, RedisBackend):
+    socketio_options['message_queue'] = state_setting
+elif state_backend.shared:
+    socketio_options['client_manager'] = BackendManager(state_backend)
+socketio = SocketIO(app, async_mode=SERVER_MODES[server_mode(SHARED_DIRECTORY)], **socketio_options)
 
 
 # Localizazion setup
@@ -49,17 +102,111 @@ babel = Babel(app, locale_selector=get_locale)
 
 # Config database
 db_path = os.path.join(SHARED_DIRECTORY, '.netfshare', 'dir_config.db')
-print(os.path.dirname(db_path))
+log.debug('database: %s', db_path)
 os.makedirs(os.path.dirname(db_path), exist_ok=True)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
 
 db = SQLAlchemy(app)
 
+def configure_sqlite(dbapi_connection, connection_record):
+    """
+    Use the write-ahead log, so readers do not block the writer,
+    and wait for locks instead of failing with "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={int(app.config.get("SQLITE_BUSY_TIMEOUT", 5000))}')
+    cursor.close()
+
+# Instrumentation, exposed on `/metrics`
+metrics = Registry()
+request_seconds = metrics.histogram('netfshare_request_seconds',
+                                    'Time to handle a request, until the response body starts.',
+                                    ['endpoint', 'method', 'status'])
+request_queries = metrics.histogram('netfshare_request_sql_queries', 'SQL statements per request.',
+                                    ['endpoint'], buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+sql_seconds = metrics.histogram('netfshare_sql_query_seconds', 'SQL statement execution time.')
+archive_build_seconds = metrics.histogram('netfshare_archive_build_seconds', 'Archive build time.',
+                                          ['directory'])
+archive_build_bytes = metrics.counter('netfshare_archive_build_bytes_total', 'Bytes of built archives.',
+                                      ['directory'])
+archive_recompressed = metrics.counter('netfshare_archive_recompressed_files_total',
+                                       'Files compressed by archive builds.', ['directory'])
+socket_connections = metrics.gauge('netfshare_socket_connections', 'Connected Socket.IO clients.')
+_request_state = threading.local()
+
+def sql_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def sql_finished(conn, cursor, statement, parameters, context, executemany):
+    sql_seconds.observe(time.perf_counter() - conn.info['query_start'].pop())
+    _request_state.queries = getattr(_request_state, 'queries', 0) + 1
+
+with app.app_context():
+    event.listen(db.engine, 'connect', configure_sqlite)
+    event.listen(db.engine, 'before_cursor_execute', sql_started)
+    event.listen(db.engine, 'after_cursor_execute', sql_finished)
+
+def archive_built(name, seconds, manifest):
+    archive_build_seconds.observe(seconds, directory=name)
+    archive_build_bytes.inc(manifest['size'], directory=name)
+    archive_recompressed.inc(manifest['recompressed'], directory=name)
+
+# Archive cache for non-streamed downloads
+archive_cache = ArchiveCache(
+    os.path.join(SHARED_DIRECTORY, '.netfshare', 'archives'),
+    max_bytes=app.config.get('ARCHIVE_CACHE_SIZE', 10 * 1024**3),
+    refresh_time=app.config.get('ARCHIVE_RECHECK_TIME', 2),
+    compresslevel=app.config.get('ZIP_COMPRESSLEVEL', 6),
+    workers=app.config.get('ARCHIVE_WORKERS'),
+    on_build=archive_built,
+)
+# Each streamed archive is compressed on its own, further downloads of
+# uncached archives wait for the shared build instead (per worker process)
+download_streams = threading.BoundedSemaphore(max(1, app.config.get('STREAM_LIMIT', 4)))
+
+# Background builds of the archives of read only directories
+def warm_target(path):
+    info = shared_tree.get(path)
+    if info is None or info.mode != 1:
+        return None
+    return os.path.join(SHARED_DIRECTORY, path), directory_compression(path), info.size
+
+def archive_progress(path, state, done, total):
+    socketio.emit('archive_progress', {'directory': path, 'state': state, 'done': done, 'total': total},
+                  to='admin')
+    # Clients listing read only directories only see when archives become ready
+    if state in ('queued', 'ready'):
+        socketio.emit('archive_ready', {'directory': path, 'ready': state == 'ready'}, to=mode_room(1))
+
+archive_warmer = ArchiveWarmer(archive_cache, warm_target,
+                               workers=app.config.get('WARM_WORKERS', 1),
+                               delay=app.config.get('WARM_DELAY', 2),
+                               on_progress=archive_progress)
+# Only the first worker process builds archives in the background
+archive_warmer_enabled = app.config.get('ARCHIVE_WARMING', True) and primary_worker
+
+# Resumable chunked uploads
+upload_sessions = UploadSessions(
+    os.path.join(SHARED_DIRECTORY, '.netfshare', 'uploads'),
+    chunk_size=app.config.get('UPLOAD_CHUNK_SIZE', 8 * 1024**2),
+    shared=state_backend.shared,
+)
+
+# Fingerprinted, precompressed static files, cached by clients forever
+asset_pipeline = AssetPipeline(STATIC_DIR, os.path.join(SHARED_DIRECTORY, '.netfshare', 'assets'))
+
+# Optional deduplication of uploaded files by hard links
+content_store = None
+if app.config.get('UPLOAD_DEDUPLICATION', False):
+    content_store = ContentStore(os.path.join(SHARED_DIRECTORY, '.netfshare', 'cas'))
+
 # DB models
 class Directory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     mode = db.Column(db.Integer, default=0)
-    path = db.Column(db.String(64), nullable=True)
+    path = db.Column(db.String(64), nullable=True, index=True)
     # # Backref relationships to access directory from download and upload:
     downloads = db.relationship('Download', backref='directory')
     uploads = db.relationship('Upload', backref='directory')
@@ -73,7 +220,7 @@ class Directory(db.Model):
     
 class Client(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    address = db.Column(db.String(64), nullable=True)
+    address = db.Column(db.String(64), nullable=True, index=True)
     last_seen = db.Column(db.DateTime, default=datetime.datetime.now)
     selected_name = db.Column(db.String(64), nullable=True)
     selected_id = db.Column(db.String(64), nullable=True)
@@ -107,16 +254,34 @@ class Client(db.Model):
     
 class Download(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    client_id = db.Column(db.Integer, db.ForeignKey('client.id'))
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), index=True)
     directory_id = db.Column(db.Integer, db.ForeignKey('directory.id'))
     download_time = db.Column(db.DateTime, default=datetime.datetime.now)
 
 class Upload(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    client_id = db.Column(db.Integer, db.ForeignKey('client.id'))
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), index=True)
     directory_id = db.Column(db.Integer, db.ForeignKey('directory.id'))
-    upload_time = db.Column(db.DateTime, default=datetime.datetime.now)
+    upload_time = db.Column(db.DateTime, default=datetime.datetime.now, index=True)
     files_count = db.Column(db.Integer)
+    # Folder of the client in the directory, kept when the client is deleted
+    folder = db.Column(db.String(256))
+    files = db.relationship('UploadFile', backref='upload')
+
+class UploadFile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.Integer, db.ForeignKey('upload.id'), index=True)
+    path = db.Column(db.String(256))
+    size = db.Column(db.Integer)
+    hash = db.Column(db.String(64))
+    deduplicated = db.Column(db.Boolean, default=False)
+
+class Collection(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    directory_id = db.Column(db.Integer, db.ForeignKey('directory.id'), index=True)
+    # Uploads up to this time are included in the collection
+    collected_time = db.Column(db.DateTime, default=datetime.datetime.now)
+    uploads_count = db.Column(db.Integer)
 
 class ConfigBool(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -124,6 +289,12 @@ class ConfigBool(db.Model):
     value = db.Column(db.Boolean, default=False)
     description = db.Column(db.String(256), nullable=True)
 
+class ConfigInt(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=True, unique=True)
+    value = db.Column(db.Integer, default=0)
+    description = db.Column(db.String(256), nullable=True)
+
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=True, unique=True)
@@ -132,51 +303,274 @@ class Message(db.Model):
     category = db.Column(db.String(64), nullable=True)
 
 
+# In-memory index of the shared subdirectories, kept up to date by `tree_watcher`
+def shared_dir_changed(path):
+    """
+    Marks the cached archive of `path` stale as soon as its files change,
+    and queues its rebuild if the directory is shared.
+    """
+    archive_cache.invalidate(path)
+    info = shared_tree.get(path)
+    if info is not None and info.mode == 1 and archive_warmer_enabled:
+        archive_warmer.schedule(path)
+
+def directory_mode_changed(path, mode, notify=True):
+    """
+    Applies the new share `mode` of directory `path`, set in the DB, and
+    passes it on to the other processes if `notify`.
+    """
+    info = shared_tree.get(path)
+    previous_mode = info.mode if info is not None else 0
+    shared_tree.set_mode(path, mode)
+    # Build the archive as soon as a directory is shared
+    if archive_warmer_enabled and mode == 1 and previous_mode != 1:
+        archive_warmer.schedule(path, delay=0)
+    elif previous_mode == 1 and mode != 1:
+        archive_warmer.cancel(path)
+    if notify:
+        notify_workers('mode', path=path, mode=mode)
+
+def shared_dir_added(path):
+    with app.app_context():
+        add_shared_folders(scan=False)
+    share_broadcaster.directories()
+
+def shared_dir_removed(path):
+    archive_warmer.cancel(path)
+    share_broadcaster.directories()
+
+shared_tree = SharedTree(SHARED_DIRECTORY, exclude=app.config["EXCLUDE_DIRNAMES"],
+                         on_change=shared_dir_changed, on_removed=shared_dir_removed)
+
+# Push of directory list changes to the Socket.IO rooms of read only and upload only clients
+share_broadcaster = ShareBroadcaster(
+    emit=lambda event, data, room: socketio.emit(event, data, to=room),
+    listing=lambda: {mode: shared_tree.dirs(mode) for mode in (1, 2)},
+)
+
+
 # Scan the shared directory and add subdirectories to the DB
-def add_shared_folders():
+def add_shared_folders(scan=True):
     """
     Scans the shared directory and adds subdirectories to the DB.
     """
+    if scan:
+        # Without the watcher, this scan is the only one to notice changed files
+        shared_tree.scan(refresh_all=app.config.get('WATCHER', 'auto') == 'off')
+    known = {path for path, in db.session.query(Directory.path)}
     count_added = 0
-    for directory in os.listdir(SHARED_DIRECTORY):
-        if os.path.isdir(directory):
-            if not Directory.query.filter(Directory.path == directory).first():
-                db.session.add(Directory(directory))
-                count_added += 1
+    for directory in shared_tree.dirs():
+        if directory not in known:
+            db.session.add(Directory(directory))
+            count_added += 1
     db.session.commit()
+    shared_tree.set_modes({d.path: d.mode for d in Directory.query.all()})
     return count_added
 
-with app.app_context():
+def create_tables():
     db.create_all()
-    count_added_dirs = add_shared_folders()
-
-    # Initialize some default settings
-    if not ConfigBool.query.filter(ConfigBool.name == 'allow_multiple_uploads').first():
-        db.session.add(ConfigBool(
-            name = "allow_multiple_uploads",
-            # Read value from config.py, default to False
-            value = app.config.get('ALLOW_MULTIPLE_UPLOADS', False),
-            description = "Allow multiple user uploads to the same directory. Replaces existing files."
-        ))
+    # Columns added to tables of databases created by older versions
+    existing = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        columns = {column['name'] for column in existing.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                with db.engine.begin() as connection:
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} '
+                                            f'{column.type.compile(db.engine.dialect)}'))
+    # Indexes added to tables of databases created by older versions
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def seed_defaults():
+    """
+    Adds the default settings missing from the DB, in one transaction.
+    """
+    defaults = [
+        # Read values from config.py
+        ConfigBool(name="allow_multiple_uploads", value=app.config.get('ALLOW_MULTIPLE_UPLOADS', False),
+                   description="Allow multiple user uploads to the same directory. Replaces existing files."),
+        ConfigBool(name="require_name_id", value=app.config.get('REQUIRE_NAME_ID', True),
+                   description="Require clients to id by providing their name along with their ID."),
+        # Transfer scheduling limits, 0 for unlimited
+        ConfigInt(name='bandwidth_limit', value=app.config.get('BANDWIDTH_LIMIT', 0),
+                  description="Total bandwidth of all downloads and uploads (KiB/s)."),
+        ConfigInt(name='client_bandwidth_limit', value=app.config.get('CLIENT_BANDWIDTH_LIMIT', 0),
+                  description="Bandwidth of a single client (KiB/s)."),
+        ConfigInt(name='directory_transfer_limit', value=app.config.get('DIRECTORY_TRANSFER_LIMIT', 0),
+                  description="Concurrent transfers per directory, others wait in line."),
+        ConfigInt(name='upload_limit', value=app.config.get('UPLOAD_LIMIT', 0),
+                  description="Concurrent uploads, others wait in line or are asked to retry later."),
+        ConfigInt(name='directory_upload_limit', value=app.config.get('DIRECTORY_UPLOAD_LIMIT', 0),
+                  description="Concurrent uploads per directory."),
+        ConfigInt(name='max_upload_size', value=app.config.get('MAX_UPLOAD_SIZE', 0),
+                  description="Size of a single upload (MB)."),
+        Message(name="default_message", message='', description="Default message, visible to all users.",
+                category='info'),
+    ]
+    existing = set()
+    for model in (ConfigBool, ConfigInt, Message):
+        existing.update((model, name) for name, in db.session.query(model.name))
+    missing = [row for row in defaults if (type(row), row.name) not in existing]
+    if missing:
+        db.session.add_all(missing)
         db.session.commit()
 
-    if not ConfigBool.query.filter(ConfigBool.name == 'require_name_id').first():
-        db.session.add(ConfigBool(
-            name = "require_name_id",
-            # Read value from config.py, default to True
-            value = app.config.get('REQUIRE_NAME_ID', True),
-            description = "Require clients to id by providing their name along with their ID."
-        ))
-        db.session.commit()
 
-    if not Message.query.filter(Message.name == 'default_message').first():
-        db.session.add(Message(
-            name = "default_message",
-            message = '',
-            description = "Default message, visible to all users.",
-            category='info'
-        ))
+# Bandwidth and concurrency limits of all transfers
+transfer_scheduler = TransferScheduler()
+
+# Admission of uploads by size, free disk space and concurrency
+upload_admission = UploadAdmission(SHARED_DIRECTORY,
+                                   min_free=app.config.get('MIN_FREE_SPACE', 1024) * 1024**2,
+                                   queue_timeout=app.config.get('UPLOAD_QUEUE_TIMEOUT', 10),
+                                   retry_after=app.config.get('UPLOAD_RETRY_AFTER', 10))
+
+def configure_transfers():
+    limits = {config.name: config.value for config in ConfigInt.query.all()}
+    # Worker processes share the total bandwidth and upload slots equally
+    transfer_scheduler.configure(global_rate=limits.get('bandwidth_limit', 0) * 1024 / worker_count,
+                                 client_rate=limits.get('client_bandwidth_limit', 0) * 1024,
+                                 directory_limit=limits.get('directory_transfer_limit', 0))
+    upload_admission.configure(limit=-(-limits.get('upload_limit', 0) // worker_count),
+                               directory_limit=-(-limits.get('directory_upload_limit', 0) // worker_count),
+                               max_size=limits.get('max_upload_size', 0) * 1024**2)
+
+def transfer_totals():
+    with app.app_context():
+        names = {c.id: c.selected_id for c in Client.query.all()}
+    return {(client_id, names.get(client_id, ''), direction): size
+            for (client_id, direction), size in list(transfer_scheduler.transferred.items())}
+
+metrics.callback('netfshare_transfer_bytes_total', 'Bytes transferred per client.', transfer_totals,
+                 ['client', 'selected_id', 'direction'], type='counter')
+metrics.callback('netfshare_active_transfers', 'Downloads and uploads in progress.',
+                 lambda: transfer_scheduler.active_transfers)
+metrics.callback('netfshare_archive_builds_total', 'Archive builds.',
+                 lambda: archive_cache.builds, type='counter')
+metrics.callback('netfshare_archive_coalesced_builds_total',
+                 'Requests that waited for an archive build in progress.',
+                 lambda: archive_cache.coalesced_builds, type='counter')
+
+
+# In-memory cache of clients, configs and messages for the page path
+app_cache = AppCache(
+    load_client=lambda address: Client.query.filter(Client.address==address).first(),
+    load_configs=lambda: {config.name: config.value for config in ConfigBool.query.all()},
+    load_messages=lambda: Message.query.all(),
+    on_invalidate=lambda kind, address: notify_workers(kind, address=address),
+)
+
+def notify_workers(kind, **message):
+    """
+    Tells the other worker processes about a change of `kind`.
+    """
+    if state_backend.shared:
+        state_backend.notify('state', kind=kind, **message)
+
+def state_changed(message):
+    """
+    Applies a change made by another worker process.
+    """
+    kind = message['kind']
+    if kind == 'client':
+        app_cache.invalidate_client(message.get('address'), notify=False)
+    elif kind == 'config':
+        app_cache.invalidate_config(notify=False)
+    elif kind == 'messages':
+        app_cache.invalidate_messages(notify=False)
+    elif kind == 'activity':
+        for event_kind, client_id, directory, when, files_count in message['events']:
+            activity_store.add(event_kind, client_id, directory, datetime.datetime.fromisoformat(when),
+                               files_count)
+    elif kind == 'activity_reset':
+        activity_store.clear()
+    elif kind == 'limits':
+        with app.app_context():
+            configure_transfers()
+    elif kind == 'mode':
+        directory_mode_changed(message['path'], message['mode'], notify=False)
+        # Clients were updated by the process that made the change
+        share_broadcaster.sync()
+
+def flush_last_seen():
+    """
+    Writes client activity recorded in memory to the database, in one transaction.
+    """
+    pending = app_cache.take_last_seen()
+    if pending:
+        with app.app_context():
+            statement = (update(Client.__table__)
+                         .where(Client.__table__.c.id == bindparam('client_id'))
+                         .values(last_seen=bindparam('seen')))
+            db.session.execute(statement, [{'client_id': k, 'seen': v} for k, v in pending.items()])
+            db.session.commit()
+
+def write_activity(events):
+    """
+    Records a batch of download and upload events in one transaction.
+    """
+    with app.app_context():
+        paths = {e.directory for e in events}
+        directory_ids = {d.path: d.id for d in Directory.query.filter(Directory.path.in_(paths))}
+        for e in events:
+            if e.kind == 'download':
+                db.session.add(Download(client_id=e.client_id, directory_id=directory_ids.get(e.directory),
+                                        download_time=e.time))
+            else:
+                db.session.add(Upload(client_id=e.client_id, directory_id=directory_ids.get(e.directory),
+                                      upload_time=e.time, files_count=e.files_count, folder=e.folder,
+                                      files=[UploadFile(path=path, size=size, hash=hash, deduplicated=dedup)
+                                             for path, size, hash, dedup in e.files]))
         db.session.commit()
+    notify_workers('activity', events=[(e.kind, e.client_id, e.directory, e.time.isoformat(), e.files_count)
+                                       for e in events])
+
+def load_activity():
+    """
+    Fills the activity store from the DB, with one query per event kind.
+    """
+    activity_store.clear()
+    for kind, model, time_column, files_count in [
+        ('download', Download, Download.download_time, None),
+        ('upload', Upload, Upload.upload_time, Upload.files_count),
+    ]:
+        rows = (db.session.query(model.client_id, Directory.path, time_column, files_count)
+                .outerjoin(Directory, model.directory_id == Directory.id)
+                .order_by(model.id))
+        for client_id, path, when, count in rows:
+            activity_store.add(kind, client_id, path, when, count)
+
+# Session activity for the admin views, recorded in memory as it happens
+activity_store = ActivityStore()
+
+activity_log = ActivityLogger(write_activity,
+                              batch_size=app.config.get('ACTIVITY_BATCH_SIZE', 200),
+                              interval=app.config.get('ACTIVITY_FLUSH_INTERVAL', 0.5),
+                              store=activity_store)
+
+def client_addresses():
+    with app.app_context():
+        return [address for address, in db.session.query(Client.address)]
+
+def broadcast_liveness(changes):
+    socketio.emit('liveness', changes, to='admin')
+
+liveness_prober = LivenessProber(client_addresses, on_change=broadcast_liveness,
+                                 interval=app.config.get('PING_INTERVAL', 10),
+                                 timeout=app.config.get('PING_TIMEOUT', 0.5),
+                                 workers=app.config.get('PING_WORKERS', 64))
+
+tree_watcher = TreeWatcher(shared_tree, interval=app.config.get('WATCH_INTERVAL', 10),
+                           polling=app.config.get('WATCHER', 'auto') == 'polling')
+
+last_seen_flush = PeriodicFlush(flush_last_seen, app.config.get('LAST_SEEN_FLUSH_INTERVAL', 5))
+
+# Removal of abandoned upload sessions and their files
+upload_session_expiry = app.config.get('UPLOAD_SESSION_EXPIRY', 24 * 3600)
+upload_session_cleanup = PeriodicFlush(lambda: upload_sessions.expire(upload_session_expiry),
+                                       min(upload_session_expiry, 3600) or 3600)
 
 
 # Command line output
@@ -187,14 +581,27 @@ bcolors = {
     "ENDC": '\033[0m',
     "BOLD": '\033[1m',
 }
-host_ips = [ip for ip in socket.gethostbyname_ex(socket.gethostname())[2] if not ip.startswith("127.")]
 port = int(app.config.get("PORT", 5000))
 
-print()
-print(f'{bcolors["OKGREEN"]}File sever running at: {bcolors["ENDC"]}')
-for ip in host_ips:
-    print(f'\t{bcolors["OKBLUE"]}http://{ip}:{port}{bcolors["ENDC"]}')
-print()
+@lru_cache(maxsize=None)
+def host_addresses():
+    """
+    Returns the network addresses of this machine, resolved once.
+    Name resolution can take seconds when DNS is misconfigured.
+    """
+    try:
+        addresses = socket.gethostbyname_ex(socket.gethostname())[2]
+    except OSError as e:
+        log.warning('Host addresses not found: %s', e)
+        return []
+    return [ip for ip in addresses if not ip.startswith("127.")]
+
+def announce():
+    log.info('')
+    log.info(f'{bcolors["OKGREEN"]}File sever running at: {bcolors["ENDC"]}')
+    for ip in host_addresses():
+        log.info(f'\t{bcolors["OKBLUE"]}http://{ip}:{port}{bcolors["ENDC"]}')
+    log.info('')
 
 
 # Helper functions
@@ -203,9 +610,152 @@ def available_dirs(mode):
     Returns a list of all directories that are available for the given mode.
     Excludes directories that are in the exclude_dirnames list.
     """
-    all_dirs = [dir for dir in os.listdir(SHARED_DIRECTORY) if os.path.basename(dir) not in app.config["EXCLUDE_DIRNAMES"]]
-    matching_mode_paths = [dir.path for dir in Directory.query.filter(Directory.mode==mode).all()]
-    return [_ for _ in all_dirs if _ in matching_mode_paths]
+    return shared_tree.dirs(mode)
+
+def shared_path(path, subpath='', mode=1):
+    """
+    Returns the filesystem path of `subpath` inside the shared directory
+    `path`, if `path` is shared with the given `mode`. Returns None otherwise,
+    and for any `subpath` leaving the directory through `..` or symlinks.
+    """
+    info = shared_tree.get(path)
+    if info is None or info.mode != mode:
+        return None
+    directory = os.path.join(SHARED_DIRECTORY, path)
+    full_path = safe_join(directory, subpath) if subpath else directory
+    if full_path is None:
+        return None
+    real_directory = os.path.realpath(directory)
+    real_path = os.path.realpath(full_path)
+    if real_path != real_directory and not real_path.startswith(real_directory + os.sep):
+        return None
+    return full_path
+
+def directory_compression(path):
+    """
+    Returns the archive compression policy for the shared directory `path`,
+    as set in the `DIRECTORY_COMPRESSION` config.
+    """
+    mode = app.config.get('DIRECTORY_COMPRESSION', {}).get(path, 'auto')
+    return compression_policy(mode, app.config.get('STORE_EXTENSIONS', STORE_EXTENSIONS))
+
+def index_statistics():
+    """
+    Computes the statistics of the shared subdirectories indexed at startup,
+    then checks the archives of all read only directories.
+    """
+    for path in shared_tree.dirs():
+        shared_tree.refresh(path, notify=False)
+    if archive_warmer_enabled:
+        for path in shared_tree.dirs(1):
+            archive_warmer.schedule(path, delay=0)
+
+
+# Startup, deferred until the server is about to bind (or the first request)
+startup_seconds = metrics.gauge('netfshare_startup_seconds', 'Duration of the startup phases.', ['phase'])
+started = False
+_startup_lock = threading.Lock()
+
+@contextlib.contextmanager
+def startup_phase(timings, name):
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+    startup_seconds.set(timings[name], phase=name)
+
+def startup():
+    """
+    Sets up the database, indexes the shared directory and starts the
+    background workers, once. The shared directory is listed while the
+    database is set up; host discovery and directory statistics finish in
+    the background, after the server is up.
+    """
+    global started
+    with _startup_lock:
+        if started:
+            return
+        # Pages work without the vendored assets, but are not updated live
+        missing = unvendored(asset_pipeline.static_dir)
+        if missing:
+            log.error('%s missing from %s, pages are not updated live. '
+                      'Vendor it with `python -m netfshare.assets`.', ', '.join(missing), asset_pipeline.static_dir)
+        timings = {}
+        with startup_phase(timings, 'total'):
+            if primary_worker:
+                threading.Thread(target=announce, daemon=True, name='netfshare-announce').start()
+            scan = threading.Thread(target=shared_tree.scan, kwargs={'stats': False}, name='netfshare-scan')
+            scan.start()
+            with app.app_context():
+                with startup_phase(timings, 'database'):
+                    create_tables()
+                    seed_defaults()
+                    configure_transfers()
+                    load_activity()
+                with startup_phase(timings, 'scan'):
+                    scan.join()
+                    add_shared_folders(scan=False)
+            share_broadcaster.directories()
+            # New subdirectories found by the watcher are added to the DB right away
+            shared_tree.on_added = shared_dir_added
+
+            with startup_phase(timings, 'background'):
+                activity_log.start()
+                atexit.register(activity_log.stop)
+                last_seen_flush.start()
+                atexit.register(last_seen_flush.stop)
+                if upload_session_expiry and primary_worker:
+                    upload_session_cleanup.start()
+                if liveness_prober.interval and primary_worker:
+                    liveness_prober.start()
+                if state_backend.shared:
+                    state_backend.subscribe('state', state_changed)
+                if archive_warmer_enabled:
+                    archive_warmer.start()
+                    atexit.register(archive_warmer.stop)
+                threading.Thread(target=index_statistics, daemon=True, name='netfshare-statistics').start()
+                threading.Thread(target=asset_pipeline.build, daemon=True, name='netfshare-assets').start()
+                if app.config.get('WATCHER', 'auto') != 'off':
+                    tree_watcher.start()
+        started = True
+    log.info('Started in %.3f s (%s)', timings['total'],
+             ', '.join(f'{name} {seconds:.3f} s' for name, seconds in timings.items() if name != 'total'))
+    if worker_count > 1:
+        log.info('Worker %d of %d ready (state backend: %s)', worker_index + 1, worker_count, state_setting)
+
+# Parts of the upload form besides its files, with room to spare
+UPLOAD_FORM_FIELDS = 4
+
+def upload_target(path, client):
+    """
+    Returns the directory the `client`'s uploads to `path` are saved into.
+    """
+    if app_cache.config('require_name_id'):
+        upload_name = client.selected_name.replace(' ', '_') + '_' + client.selected_id
+    else:
+        upload_name = client.selected_id
+    return os.path.join(SHARED_DIRECTORY, path, upload_name.strip())
+
+def scheduled(response, path):
+    """
+    Sends the body of a download `response` from directory `path` through
+    the transfer scheduler, at the rate share of the requesting client.
+    Without limits, files are passed to the server's `wsgi.file_wrapper`
+    as they are, read in SEND_BLOCK_SIZE blocks, and counted by their length.
+    """
+    if response.status_code in (200, 206):
+        client = app_cache.client(request.remote_addr)
+        if not transfer_scheduler.limited and response.content_length is not None:
+            transfer_scheduler.record(client.id, 'download', response.content_length)
+        else:
+            response.response = transfer_scheduler.wrap(response.response, client.id, path)
+    return response
+
+def store_upload(file_path, digest):
+    """
+    Adds an uploaded file to the content store, if deduplication is enabled.
+    Returns True if the file was deduplicated.
+    """
+    return content_store is not None and content_store.add(file_path, digest)
 
 def check_admin(request):
     is_admin = False
@@ -217,8 +767,8 @@ def check_admin(request):
 def id_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        client = Client.query.filter(Client.address==request.remote_addr).first()
-        print('client: ', client)
+        client = app_cache.client(request.remote_addr)
+        log.debug('client: %s', client)
         if client is None:
             flash(_('No user ID set.'), 'warning')
             return redirect(url_for('identify'))
@@ -232,44 +782,96 @@ def admin_required(f):
         if not admin:
             message = _('Admin access required. Redirecting to index...')
             flash(message, 'danger')
-            print(message)
+            log.info(message)
             return redirect('/')
         return f(*args, **kwargs)
     return decorated_function
 
 
+# Request timing
+@app.before_request
+def start_timer():
+    if not started:
+        startup()
+    g.start_time = time.perf_counter()
+    _request_state.queries = 0
+
+@app.after_request
+def record_request(response):
+    if 'start_time' in g:
+        endpoint = request.endpoint or 'none'
+        request_seconds.observe(time.perf_counter() - g.start_time, endpoint=endpoint,
+                                method=request.method, status=response.status_code)
+        request_queries.observe(getattr(_request_state, 'queries', 0), endpoint=endpoint)
+    return response
+
+@app.after_request
+def compress_text(response):
+    if app.config.get('COMPRESS_RESPONSES', True):
+        compress_response(response, request.headers.get('Accept-Encoding'),
+                          min_size=app.config.get('COMPRESS_MIN_SIZE', 1024))
+    return response
+
+
 # Context processor to inject data into templates
 @app.context_processor
 def inject_client():
     context = {}
     context['admin'] = check_admin(request)
     
-    client = Client.query.filter(Client.address==request.remote_addr).first()
+    client = app_cache.client(request.remote_addr)
     context['client'] = client
     if client is not None:
-        client.active = True
-        client.last_seen = datetime.datetime.now()
-        db.session.commit()
+        app_cache.touch(client)
     return context
 
 @app.context_processor
 def inject_config():
     context = {}
-    messages = Message.query.all()
-    context['permanent_messages'] = messages
+    context['permanent_messages'] = app_cache.messages()
     context['supported_languages'] = app.config['LANGUAGES']
-    context['require_name_id'] = ConfigBool.query.filter(ConfigBool.name=='require_name_id').first().value
+    context['require_name_id'] = app_cache.config('require_name_id')
+    # Long-polling needs every request of a client on the same process
+    context['socket_transports'] = ['websocket'] if state_backend.shared else None
     return context
 
+@app.context_processor
+def inject_assets():
+    def asset_url(filename):
+        """
+        URL of a static file, cached by clients until it changes.
+        """
+        return url_for('asset', filename=asset_pipeline.fingerprinted(filename))
+    return {'asset_url': asset_url, 'vendored': lambda filename: filename in asset_pipeline}
+
 
 # Views
+@app.route("/assets/<path:filename>")
+def asset(filename):
+    """
+    Static file under its fingerprinted name, in the best compressed variant.
+    """
+    found = asset_pipeline.find(filename)
+    if found is None:
+        abort(404)
+    file_path, coding = asset_pipeline.select(found, request.headers.get('Accept-Encoding'))
+    response = send_file(file_path, mimetype=found.mimetype, conditional=True, etag=found.fingerprinted,
+                         max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    if coding is not None:
+        response.headers['Content-Encoding'] = coding
+    return response
+
+
 @app.route("/id", methods=["GET", "POST"])
 def identify():
     """
     View to identify the user on first access.
     """
     # Client database query
-    client = Client.query.filter(Client.address==request.remote_addr).first()
+    client = app_cache.client(request.remote_addr)
     if client is not None:
         return redirect('/')
     
@@ -280,7 +882,7 @@ def identify():
             client.selected_id = id
 
             # handle name if required
-            if ConfigBool.query.filter(ConfigBool.name=='require_name_id').first().value:
+            if app_cache.config('require_name_id'):
                 name = request.form.get('name')
                 if name:
                     client.selected_name = name
@@ -290,6 +892,7 @@ def identify():
 
             db.session.add(client)
             db.session.commit()
+            app_cache.invalidate_client(request.remote_addr)
             return redirect('/')
         else:
             flash(_('Please input your ID number.'), 'error')
@@ -300,18 +903,42 @@ def identify():
 # SocketIO connect and disconnect events
 @socketio.on('connect')
 def handle_connect():
+    socket_connections.inc()
+    if check_admin(request):
+        join_room('admin')
     client = Client.query.filter(Client.address==request.remote_addr).first()
     if client:
         client.socket_connected = True
         db.session.commit()
+        app_cache.invalidate_client(client.address)
 
 
+def message_data(message):
+    return {'id': message.id, 'message': message.message or '', 'category': message.category}
+
+@socketio.on('subscribe')
+def handle_subscribe(modes):
+    """
+    Joins the rooms of the share `modes` listed on the client's page and
+    sends their current directories and the messages, also on reconnects.
+    """
+    if app_cache.client(request.remote_addr) is None:
+        return
+    for mode in modes if isinstance(modes, list) else []:
+        if mode in (1, 2):
+            join_room(mode_room(mode))
+            emit('directories', share_broadcaster.state(mode))
+    for message in app_cache.messages():
+        emit('share_message', message_data(message))
+
 @socketio.on('disconnect')
 def handle_disconnect():
+    socket_connections.dec()
     client = Client.query.filter(Client.address==request.remote_addr).first()
     if client:
         client.socket_connected = False
         db.session.commit()
+        app_cache.invalidate_client(client.address)
 
 @app.route("/", methods=["GET", "POST"])
 @id_required
@@ -326,7 +953,8 @@ def list_dirs():
     return render_template(
         'list_dirs.html',
         read_only_dirs=read_only_dirs, 
-        upload_only_dirs=upload_only_dirs
+        upload_only_dirs=upload_only_dirs,
+        preparing=archive_warmer.status(),
         )
 
 
@@ -337,39 +965,242 @@ def download(path):
     Download read_only directory.
     Package the directory as a zip file and serves it.
     """
-    if not os.path.isdir(os.path.join(SHARED_DIRECTORY, path)):
-        print(path, ' not a directory')
+    directory = shared_path(path)
+    if directory is None or not os.path.isdir(directory):
+        log.debug('%s not a directory', path)
         flash(_('%(path)s is not a shared directory.', path=path), 'warning')
         return redirect(url_for('list_dirs'))
+    
+    # Stream the archive right away if there is nothing cached yet, and build
+    # the cached copy meanwhile (unless already building in the background).
+    # Past STREAM_LIMIT concurrent streams, downloads wait for that build.
+    # Cached archives support conditional and range (resumed) requests.
+    archive_warmer.note_demand(path)
+    stream = (app.config.get('STREAM_DOWNLOADS', True) and not archive_cache.has_archive(path)
+              and not any(h in request.headers for h in ('Range', 'If-Range', 'If-None-Match', 'If-Match'))
+              and download_streams.acquire(blocking=False))
+    if stream:
+        if not archive_cache.is_building(path):
+            archive_cache.refresh_async(path, os.path.join(SHARED_DIRECTORY, path),
+                                        directory_compression(path))
     else:
-        zip_file = os.path.join(SHARED_DIRECTORY, '.netfshare', path + '.zip')
-        refresh_file = False
-        if os.path.isfile(zip_file):
-            if os.path.getmtime(zip_file) < os.path.getmtime(os.path.join(SHARED_DIRECTORY, path)):
-                refresh_file = True
-                print('files changed')
-            elif os.path.getmtime(zip_file)-time.time() > app.config['REFRESH_TIME']:
-                print('file expired')
-                refresh_file = True
-
-        if not os.path.isfile(zip_file) or refresh_file:
-            print(f'generating zip file {zip_file}...')
-            with zipfile.ZipFile(zip_file, 'w') as zipf:
-                for root, dirs, files in os.walk(os.path.join(SHARED_DIRECTORY, path)):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        relative_path = os.path.relpath(file_path, os.path.join(SHARED_DIRECTORY, path))                                
-                        zipf.write(file_path, relative_path)
-
-        # Record download
-        client = Client.query.filter(Client.address==request.remote_addr).first()
-        download = Download(client_id=client.id, directory_id=Directory.query.filter(Directory.path==path).first().id)
-        download.download_time = datetime.datetime.now()
-        db.session.add(download)
-        db.session.commit()
+        zip_file, manifest = archive_cache.get(path, os.path.join(SHARED_DIRECTORY, path),
+                                               directory_compression(path))
+
+    if stream:
+        # Send archive members as they are compressed, no archive copy on disk
+        archive = stream_directory(os.path.join(SHARED_DIRECTORY, path),
+                                   compresslevel=app.config.get('ZIP_COMPRESSLEVEL', 6),
+                                   should_compress=directory_compression(path))
+        response = Response(archive, mimetype='application/zip', headers={
+            'Content-Disposition': f'attachment; filename="{path}.zip"',
+            'X-Accel-Buffering': 'no',
+            'Accept-Ranges': 'none',
+        })
+        response.call_on_close(download_streams.release)
+    elif request.if_match and manifest['archive'] not in request.if_match:
+        # The client requires a previous version of the archive
+        abort(412)
+    else:
+        response = send_file(zip_file, as_attachment=True, download_name=path + '.zip',
+                             etag=manifest['archive'], last_modified=manifest.get('last_modified'),
+                             conditional=True, max_age=0)
 
-        return send_file(zip_file, as_attachment=True)
+    # Record download, but not revalidations or resumed transfers
+    resumed = response.status_code == 206 and request.range.ranges[0][0] != 0
+    if response.status_code != 304 and not resumed:
+        client = app_cache.client(request.remote_addr)
+        activity_log.log('download', client.id, path)
 
+    return scheduled(response, path)
+
+
+@app.route("/manifest/<path>")
+@id_required
+def manifest(path):
+    """
+    List the files of a read_only directory with their sizes, mtimes and
+    content hashes, from the file index of its archive. Used by
+    `python -m netfshare sync` to fetch only new and changed files.
+    """
+    directory = shared_path(path)
+    if directory is None or not os.path.isdir(directory):
+        return jsonify(error=f'{path} is not a shared directory.'), 404
+
+    # Checked against the files on disk, even before the watcher notices
+    # changes. Only changed files are hashed, the archive is built meanwhile.
+    archive_warmer.note_demand(path)
+    index = archive_cache.index(path, directory)
+    if not archive_cache.is_building(path) and not archive_cache.is_fresh(path):
+        archive_cache.refresh_async(path, directory, directory_compression(path))
+    response = jsonify(directory=path, version=index['version'], files=index['files'])
+    response.set_etag(index['version'])
+    response.make_conditional(request)
+
+    # A sync counts as one download of the directory, its files are not recorded
+    if response.status_code != 304:
+        client = app_cache.client(request.remote_addr)
+        activity_log.log('download', client.id, path)
+    return response
+
+
+@app.route("/browse/<path>/")
+@app.route("/browse/<path>/<path:subpath>")
+@id_required
+def browse(path, subpath=''):
+    """
+    List the contents of a read_only directory, one page at a time.
+    """
+    directory = shared_path(path, subpath)
+    if directory is None or not os.path.isdir(directory):
+        flash(_('%(path)s is not a shared directory.', path=path), 'warning')
+        return redirect(url_for('list_dirs'))
+
+    # Entries at this level, from the cached file index of the directory
+    prefix = subpath.strip('/') + '/' if subpath.strip('/') else ''
+    subdirs = {}
+    files = []
+    for relative_path, size, mtime in shared_tree.files(path):
+        if not relative_path.startswith(prefix):
+            continue
+        name, _sep, rest = relative_path[len(prefix):].partition('/')
+        if rest:
+            subdirs[name] = subdirs.get(name, 0) + size
+        else:
+            files.append((name, relative_path, size, mtime))
+    entries = ([(name, prefix + name, size, None, True) for name, size in sorted(subdirs.items())]
+               + [(name, relative_path, size, mtime, False) for name, relative_path, size, mtime in files])
+
+    page_size = app.config.get('BROWSE_PAGE_SIZE', 100)
+    pages = max(1, -(-len(entries) // page_size))
+    page = min(max(request.args.get('page', 1, type=int), 1), pages)
+    return render_template('browse.html', path=path, subpath=prefix.rstrip('/'),
+                           entries=entries[(page - 1) * page_size:page * page_size],
+                           page=page, pages=pages)
+
+
+@app.route("/file/<path>/<path:subpath>")
+@id_required
+def download_file(path, subpath):
+    """
+    Download a single file from a read_only directory.
+    Supports conditional and range requests.
+    """
+    file_path = shared_path(path, subpath)
+    if file_path is None or not os.path.isfile(file_path):
+        flash(_('%(path)s is not a shared directory.', path=path), 'warning')
+        return redirect(url_for('list_dirs'))
+
+    # Sent through the server's `wsgi.file_wrapper` in SEND_BLOCK_SIZE blocks,
+    # or by the front-end server with USE_X_SENDFILE
+    response = send_file(file_path, as_attachment=True, conditional=True, max_age=0)
+    if response.status_code == 200 and 'X-Netfshare-Sync' not in request.headers:
+        client = app_cache.client(request.remote_addr)
+        activity_log.log('download', client.id, path)
+    return scheduled(response, path)
+
+
+@app.route("/download/<path>/selection", methods=["POST"])
+@id_required
+def download_selection(path):
+    """
+    Download the selected files and directories of a read_only directory
+    as a zip file, generated on the fly.
+    """
+    directory = shared_path(path)
+    if directory is None or not os.path.isdir(directory):
+        flash(_('%(path)s is not a shared directory.', path=path), 'warning')
+        return redirect(url_for('list_dirs'))
+
+    selected = set()
+    for relative_path in request.form.getlist('file'):
+        if shared_path(path, relative_path) is None:
+            flash(_('%(path)s is not a shared directory.', path=relative_path), 'warning')
+            return redirect(url_for('browse', path=path))
+        selected.add(relative_path.strip('/'))
+    if not selected:
+        return redirect(url_for('browse', path=path))
+
+    # Selected files, and all files in selected directories
+    files = [(os.path.join(directory, relative_path), relative_path)
+             for relative_path, size, mtime in shared_tree.files(path)
+             if relative_path in selected or any(relative_path.startswith(s + '/') for s in selected)]
+
+    client = app_cache.client(request.remote_addr)
+    activity_log.log('download', client.id, path)
+    archive = stream_files(files, compresslevel=app.config.get('ZIP_COMPRESSLEVEL', 6),
+                           should_compress=directory_compression(path))
+    return scheduled(Response(archive, mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename="{path}.zip"',
+        'X-Accel-Buffering': 'no',
+        'Accept-Ranges': 'none',
+    }), path)
+
+
+def upload_refused(path, error):
+    """
+    Answers an upload form refused with the `UploadError` `error`: as JSON
+    for scripted clients, and with a message on the upload page otherwise.
+    """
+    if request.accept_mimetypes.best == 'application/json':
+        raise error
+    flash(error.message, 'warning')
+    return redirect(url_for('upload_dir', path=path))
+
+def receive_upload(path):
+    """
+    Saves the files of an admitted upload form to the client's folder in `path`.
+    """
+    client = app_cache.client(request.remote_addr)
+    target_path = upload_target(path, client)
+    allow_multiple = app_cache.config('allow_multiple_uploads')
+
+    # Stop parsing the body once it holds far more files than allowed, with
+    # room for the other fields of the form (the CSRF token)
+    request.max_form_parts = app.config['MAX_FILES'] + UPLOAD_FORM_FIELDS
+
+    # Receive the request body at the scheduled rate
+    stream = transfer_scheduler.reader(request.environ['wsgi.input'], client.id, path)
+    request.environ['wsgi.input'] = stream
+    try:
+        uploaded_files = request.files.getlist('file')
+    except RequestEntityTooLarge:
+        uploaded_files = None
+    finally:
+        stream.close()
+
+    if uploaded_files is None or len(uploaded_files) > app.config['MAX_FILES']:
+        message = _('Too many files. Max. %(num_files)d files per upload.', num_files=app.config['MAX_FILES'])
+        return upload_refused(path, UploadError(message, 413))
+
+    if os.path.exists(target_path):
+        if not allow_multiple:
+            flash(_('An upload with the same ID already exists.'), 'warning')
+            return redirect(url_for('upload_dir', path=path))
+        else:
+            flash(_('An upload with the same ID already exists. Files with matching names were overwritten.'), 'warning')
+
+    saved_files = []
+    for file in uploaded_files:
+        if file:
+            dirname = os.path.dirname(file.filename)
+            save_dir = os.path.join(target_path, dirname)
+            filename = os.path.basename(file.filename)
+            # Handle nested subdirectories
+            file_path = os.path.join(save_dir, filename)
+            size, digest = save_stream(file.stream, file_path)
+            saved_files.append((file.filename, size, digest, store_upload(file_path, digest)))
+
+    # Record upload
+    activity_log.log('upload', client.id, path, files_count=len(uploaded_files), files=saved_files,
+                     folder=os.path.basename(target_path))
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(files_count=len(uploaded_files),
+                       files=[{'name': name, 'size': size, 'hash': digest}
+                              for name, size, digest, _dedup in saved_files])
+    flash(_('%(num_files)d files successfully uploaded.', num_files=len(uploaded_files)), 'success')
+    return redirect(url_for('upload_dir', path=path))
 
 
 @app.route("/upload/<path>", methods=["GET", "POST"])
@@ -379,53 +1210,125 @@ def upload_dir(path):
     Select a file to upload to the selected (`path`) directory
     on the server.
     """
-    if request.method == 'POST':
-        target_path = os.path.join(SHARED_DIRECTORY, path)
-        client = Client.query.filter(Client.address==request.remote_addr).first()
-        
-        if ConfigBool.query.filter(ConfigBool.name=='require_name_id').first().value:
-            upload_name = client.selected_name.replace(' ', '_') + '_' + client.selected_id
-        else:
-            upload_name = client.selected_id
-        
-        allow_multiple = ConfigBool.query.filter(ConfigBool.name=='allow_multiple_uploads').first().value
+    directory = shared_path(path, mode=2)
+    if directory is None or not os.path.isdir(directory):
+        if request.accept_mimetypes.best == 'application/json':
+            raise UploadError(f'{path} is not an upload directory.', 404)
+        flash(_('%(path)s is not a shared directory.', path=path), 'warning')
+        return redirect(url_for('list_dirs'))
 
-        target_path = os.path.join(target_path, upload_name.strip())
-        uploaded_files = request.files.getlist('file') 
+    if request.method == 'POST':
+        # Admit the upload by its declared size, before reading the body
+        if request.content_length is None:
+            return upload_refused(path, UploadError(_('The size of the upload is unknown, please try again.'), 411))
+        try:
+            admission = upload_admission.admit(path, request.content_length)
+        except AdmissionError as e:
+            return upload_refused(path, e)
+        with admission:
+            return receive_upload(path)
+
+    # Files uploaded by this client, with hashes to verify them against
+    client = app_cache.client(request.remote_addr)
+    activity_log.flush()
+    uploaded = (UploadFile.query.join(Upload).join(Directory)
+                .filter(Upload.client_id == client.id, Directory.path == path)
+                .order_by(Upload.upload_time.desc()).all())
+    latest = {}
+    for file in uploaded:
+        latest.setdefault(file.path, file)
+    return render_template('upload.html', path=path,
+                           chunk_size=app.config.get('UPLOAD_CHUNK_SIZE', 8 * 1024**2),
+                           uploaded_files=sorted(latest.values(), key=lambda f: f.path))
+
+
+# Chunked, resumable upload API
+@app.errorhandler(UploadError)
+def handle_upload_error(e):
+    response = jsonify(error=e.message)
+    if getattr(e, 'retry_after', None):
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response, e.status
+
+@app.route("/upload/<path>/session", methods=["POST"])
+@id_required
+def upload_session_create(path):
+    """
+    Start a chunked upload of the files listed in the JSON body
+    (`{"files": [{"name": ..., "size": ...}, ...]}`) to `path`.
+    """
+    directory = shared_path(path, mode=2)
+    if directory is None or not os.path.isdir(directory):
+        raise UploadError(f'{path} is not an upload directory.', 404)
+    files = (request.get_json(silent=True) or {}).get('files') or []
+    if not files:
+        raise UploadError('No files selected.')
+    if len(files) > app.config['MAX_FILES']:
+        raise UploadError(_('Too many files. Max. %(num_files)d files per upload.', num_files=app.config['MAX_FILES']))
+
+    client = app_cache.client(request.remote_addr)
+    target_path = upload_target(path, client)
+    allow_multiple = app_cache.config('allow_multiple_uploads')
+    if os.path.exists(target_path) and not allow_multiple:
+        raise UploadError(_('An upload with the same ID already exists.'), 409)
+
+    # Files are preallocated, so free disk space is only reserved while creating them
+    try:
+        total_size = sum(int(file.get('size', 0)) for file in files)
+    except (AttributeError, TypeError, ValueError):
+        raise UploadError('Each file requires a name and a size.')
+    with upload_admission.admit(path, total_size, slot=False):
+        upload_session = upload_sessions.create(client.id, path, target_path, files)
+    return jsonify(upload_sessions.status(upload_session)), 201
+
+@app.route("/upload/session/<session_id>")
+@id_required
+def upload_session_status(session_id):
+    """
+    Report the chunks of an upload session that are still missing.
+    """
+    client = app_cache.client(request.remote_addr)
+    return jsonify(upload_sessions.status(upload_sessions.get(session_id, client.id)))
 
-        if len(uploaded_files) > app.config['MAX_FILES']:
-            flash(_('Too many files. Max. %(num_files)d files per upload.', num_files=app.config['MAX_FILES']), 'warning')
-            return redirect(url_for('upload_dir', path=path))
-        
-        if os.path.exists(target_path):
-            if not allow_multiple:
-                flash(_('An upload with the same ID already exists.'), 'warning')
-                return redirect(url_for('upload_dir', path=path))
-            else:
-                flash(_('An upload with the same ID already exists. Files with matching names were overwritten.'), 'warning')
-        
-        for file in uploaded_files:
-            if file:
-                dirname = os.path.dirname(file.filename)
-                save_dir = os.path.join(target_path, dirname)
-                filename = os.path.basename(file.filename)
-                # Handle nested subdirectories
-                file_path = os.path.join(save_dir, filename)
-                os.makedirs(save_dir, exist_ok=True)
-                file.save(file_path)
-
-        # Record upload
-        client = Client.query.filter(Client.address==request.remote_addr).first()
-        upload = Upload(client_id=client.id, directory_id=Directory.query.filter(Directory.path==path).first().id)
-        upload.upload_time = datetime.datetime.now()
-        upload.files_count = len(uploaded_files)
-        db.session.add(upload)
-        db.session.commit()
+@app.route("/upload/session/<session_id>/<int:index>/<int:chunk>", methods=["PUT"])
+@id_required
+def upload_session_chunk(session_id, index, chunk):
+    """
+    Store one chunk of a file, sent as the raw request body.
+    """
+    client = app_cache.client(request.remote_addr)
+    if request.content_length is None:
+        raise UploadError('Content-Length required.', 411)
+    upload_session = upload_sessions.get(session_id, client.id)
+    with upload_admission.admit(upload_session['directory'], 0):
+        stream = transfer_scheduler.reader(request.stream, client.id, upload_session['directory'])
+        try:
+            written = upload_sessions.write_chunk(session_id, client.id, index, chunk,
+                                                  stream, request.content_length)
+        finally:
+            stream.close()
+    return jsonify(written=written)
+
+@app.route("/upload/session/<session_id>/finish", methods=["POST"])
+@id_required
+def upload_session_finish(session_id):
+    """
+    Complete an upload session once all chunks are stored and record the upload.
+    """
+    client = app_cache.client(request.remote_addr)
+    upload_session = upload_sessions.finish(session_id, client.id)
+    saved_files = [(file['name'], file['size'], file['hash'], store_upload(file['path'], file['hash']))
+                   for file in upload_session['files']]
 
-        flash(_('%(num_files)d files successfully uploaded.', num_files=len(uploaded_files)), 'success')
-        return redirect(url_for('upload_dir', path=path))
+    # Record upload
+    files_count = len(upload_session['files'])
+    activity_log.log('upload', client.id, upload_session['directory'], files_count=files_count,
+                     files=saved_files, folder=os.path.basename(upload_session['target_path']))
 
-    return render_template('upload.html', path=path)
+    flash(_('%(num_files)d files successfully uploaded.', num_files=files_count), 'success')
+    return jsonify(files_count=files_count,
+                   files=[{'name': name, 'size': size, 'hash': digest}
+                          for name, size, digest, _dedup in saved_files])
 
 
 @app.route("/copy_config")
@@ -438,7 +1341,17 @@ def copy_config():
     if check_admin(request):
         config_copy_keys = [
             'DEBUG', 'SECRET_KEY', 'WTF_CSRF_ENABLED', 'SQLALCHEMY_DATABASE_URI', 
-            'REFRESH_TIME', 'SHARE_MODES', 'EXCLUDE_DIRNAMES', 'MAX_FILES', 'LANGUAGES', 'PORT',
+            'ARCHIVE_RECHECK_TIME', 'SHARE_MODES', 'EXCLUDE_DIRNAMES', 'MAX_FILES', 'LANGUAGES', 'PORT',
+            'STREAM_DOWNLOADS', 'STREAM_LIMIT', 'ZIP_COMPRESSLEVEL', 'ARCHIVE_CACHE_SIZE', 'ARCHIVE_WORKERS',
+            'STORE_EXTENSIONS', 'DIRECTORY_COMPRESSION', 'UPLOAD_CHUNK_SIZE',
+            'SERVER_MODE', 'WORKER_CONNECTIONS', 'KEEPALIVE', 'SEND_BLOCK_SIZE', 'USE_X_SENDFILE',
+            'LAST_SEEN_FLUSH_INTERVAL', 'SQLITE_BUSY_TIMEOUT', 'ACTIVITY_BATCH_SIZE', 'ACTIVITY_FLUSH_INTERVAL',
+            'PING_INTERVAL', 'PING_TIMEOUT', 'PING_WORKERS', 'WATCHER', 'WATCH_INTERVAL',
+            'BROWSE_PAGE_SIZE', 'BANDWIDTH_LIMIT', 'CLIENT_BANDWIDTH_LIMIT', 'DIRECTORY_TRANSFER_LIMIT',
+            'UPLOAD_DEDUPLICATION', 'LOG_LEVEL', 'ARCHIVE_WARMING', 'WARM_WORKERS', 'WARM_DELAY',
+            'PROCESSES', 'STATE_BACKEND', 'SESSION_PAGE_SIZE', 'COMPRESS_RESPONSES', 'COMPRESS_MIN_SIZE',
+            'UPLOAD_LIMIT', 'DIRECTORY_UPLOAD_LIMIT', 'MAX_UPLOAD_SIZE', 'MIN_FREE_SPACE', 'UPLOAD_QUEUE_TIMEOUT',
+            'UPLOAD_RETRY_AFTER', 'UPLOAD_SESSION_EXPIRY',
         ]
         config_items = [(k, app.config[k]) for k in config_copy_keys if k in app.config.keys()]
         with open(local_config, 'w') as f:
@@ -459,8 +1372,10 @@ def admin_view():
     # Admin check and management forms
     context = {}
     # Populate shared dir management forms
-    manage_dirs = [dir for dir in Directory.query.all() if dir.path in os.listdir(SHARED_DIRECTORY)]
+    directories = {str(dir.id): dir for dir in Directory.query.all()}
+    manage_dirs = [dir for dir in directories.values() if dir.path in shared_tree]
     context['manage_dirs'] = manage_dirs
+    context['shared_tree'] = shared_tree
 
     # Populate `messages`
     message = Message.query.filter(Message.name=='default_message').first()
@@ -469,6 +1384,17 @@ def admin_view():
     # Populate `configs`
     configs = ConfigBool.query.all()
     context['configs'] = configs
+    limits = {str(limit.id): limit for limit in ConfigInt.query.all()}
+    context['limits'] = limits.values()
+    context['transfer_scheduler'] = transfer_scheduler
+    context['upload_admission'] = upload_admission
+
+    # Archive cache and upload deduplication statistics
+    context['archive_cache'] = archive_cache
+    context['content_store'] = content_store
+    archive_states = {path: 'ready' for path in shared_tree.dirs(1) if archive_cache.has_archive(path)}
+    archive_states.update(archive_warmer.status())
+    context['archive_states'] = archive_states
 
     # Validate and update share mode
     if request.method == 'POST':
@@ -476,17 +1402,23 @@ def admin_view():
         for name, value in request.form.items():
             
             # handle dir modes
-            if name in [str(d.id) for d in Directory.query.all()]:
+            if name in directories:
                 if value in [str(k) for k in app.config["SHARE_MODES"].keys()]:
-                    dir = Directory.query.filter(Directory.id == int(name)).first()
-                    dir.mode = int(value)
+                    dir = directories[name]
+                    previous_mode, dir.mode = dir.mode, int(value)
                     db.session.commit()
+                    if dir.mode != previous_mode:
+                        directory_mode_changed(dir.path, dir.mode)
 
             # handle messages and configs
             elif name == 'default_message':
+                changed = (message.message or '') != value
                 message.message = value
                 db.session.commit()
-                print(f'Setting {message.name} to "{value}".')
+                app_cache.invalidate_messages()
+                if changed:
+                    socketio.emit('share_message', message_data(message))
+                log.info('Setting %s to "%s".', message.name, value)
 
             elif 'config' in name:
                 config_id = int(name.split('_')[-1])
@@ -494,8 +1426,19 @@ def admin_view():
                 config = ConfigBool.query.filter(ConfigBool.id==config_id).first()
                 config.value = config_value
                 db.session.commit()
-                print(f'setting {config.name} to {config_value}')
+                app_cache.invalidate_config()
+                log.info('setting %s to %s', config.name, config_value)
+
+            elif name.startswith('limit_'):
+                limit = limits.get(name.split('_')[-1])
+                if limit is not None and value.strip().isdigit() and int(value) != limit.value:
+                    limit.value = int(value)
+                    db.session.commit()
+                    configure_transfers()
+                    notify_workers('limits')
+                    log.info('setting %s to %s', limit.name, limit.value)
 
+        share_broadcaster.directories()
         return redirect(url_for('admin_view'))
     
     return render_template(
@@ -514,23 +1457,174 @@ def manage_session():
     uploads and downlaods).
     """
     if check_admin(request):
-        clients = Client.query.all()
-        downloads = Download.query.all()
-        uploads = Upload.query.all()
-
-        # ping client to update last_seen
+        flush_last_seen()
+        page_size = app.config.get('SESSION_PAGE_SIZE', 100)
+        counts = {
+            'clients': db.session.query(func.count(Client.id)).scalar(),
+            'downloads': activity_store.count('download'),
+            'uploads': activity_store.count('upload'),
+        }
+        pages = {name: max(1, -(-count // page_size)) for name, count in counts.items()}
+        page = {name: min(max(request.args.get(name, 1, type=int), 1), pages[name]) for name in counts}
+
+        clients = (db.session.query(Client.id, Client.address, Client.selected_name, Client.selected_id,
+                                    Client.last_seen, Client.socket_connected)
+                   .order_by(Client.id)
+                   .limit(page_size).offset((page['clients'] - 1) * page_size)
+                   .all())
+        downloads = activity_store.page('download', page['downloads'], page_size)
+        uploads = activity_store.page('upload', page['uploads'], page_size)
+
+        # Names of the clients listed on this page, in one query
+        listed_ids = {record.client_id for record in downloads + uploads} - {client.id for client in clients}
+        names = {client.id: client for client in clients}
+        if listed_ids:
+            names.update((client.id, client) for client in
+                         db.session.query(Client.id, Client.selected_name, Client.selected_id)
+                         .filter(Client.id.in_(listed_ids)))
+
+        # Client liveness from the latest background ping round
+        now = datetime.datetime.now()
+        liveness = {}
         for client in clients:
-            response = ping(client.address, count=1, timeout=0.1)
-            if response.success() or client.socket_connected:
-                client.last_seen = datetime.datetime.now()
-            db.session.commit()
+            last_alive = liveness_prober.last_alive(client.address)
+            active = ((now - client.last_seen).total_seconds() < 15 or client.socket_connected
+                      or liveness_prober.is_alive(client.address))
+            liveness[client.id] = {
+                'active': active,
+                'last_seen': max(client.last_seen, last_alive) if last_alive else client.last_seen,
+            }
 
         return render_template('manage_session.html',
-                               clients=clients, downloads=downloads, uploads=uploads)
+                               clients=clients, downloads=downloads, uploads=uploads,
+                               names=names, liveness=liveness,
+                               client_totals=activity_store.clients,
+                               directory_totals=activity_store.directory_totals(),
+                               counts=counts, pages=pages, page=page, page_size=page_size)
     else:
         return redirect(url_for('list_dirs'))
 
 
+@app.route("/collect/<path>")
+@admin_required
+def collect_uploads(path):
+    """
+    Stream the uploads to an upload_only directory as one zip archive, one
+    folder per client, with an `index.csv` of folders, files and hashes.
+    The student folders on disk are collected, upload records only annotate
+    the index, so files of deleted clients or a reset session are kept.
+    With `?new=1`, only uploads since the last complete collection are included.
+    """
+    directory = Directory.query.filter(Directory.path == path, Directory.mode == 2).first()
+    if directory is None:
+        flash(f'{path} is not an upload_only directory.', 'warning')
+        return redirect(url_for('admin_view'))
+
+    activity_log.flush()
+    collected_time = datetime.datetime.now()
+    query = (Upload.query.filter(Upload.directory_id == directory.id, Upload.upload_time <= collected_time)
+             .options(joinedload(Upload.client), selectinload(Upload.files))
+             .order_by(Upload.upload_time))
+    since = None
+    if request.args.get('new', type=int):
+        since = (db.session.query(func.max(Collection.collected_time))
+                 .filter(Collection.directory_id == directory.id).scalar())
+        if since is not None:
+            query = query.filter(Upload.upload_time > since)
+    uploads = query.all()
+
+    # Latest upload of each file, repeated uploads replace files with the same name
+    records = {}
+    for upload in uploads:
+        folder = upload.folder
+        if folder is None and upload.client is not None:
+            # Recorded before uploads kept their folder
+            folder = os.path.basename(upload_target(path, upload.client))
+        if folder is None:
+            continue
+        name, client_id = ('', '') if upload.client is None else (upload.client.selected_name or '',
+                                                                  upload.client.selected_id)
+        for file in upload.files:
+            records[(folder, file.path.replace(os.sep, '/'))] = (name, client_id, upload.upload_time,
+                                                                 file.size, file.hash or '')
+
+    # Files of the student folders on disk, changed since the last collection
+    upload_dir = os.path.join(SHARED_DIRECTORY, path)
+    files = []
+    for folder in sorted(os.listdir(upload_dir)):
+        if folder.startswith('.') or not os.path.isdir(os.path.join(upload_dir, folder)):
+            continue
+        for file_path, relative_path in iter_directory_files(os.path.join(upload_dir, folder)):
+            relative_path = relative_path.replace(os.sep, '/')
+            if os.path.basename(relative_path).startswith('.upload-'):
+                # Uploads in progress
+                continue
+            record = records.pop((folder, relative_path), None)
+            if since is not None and record is None:
+                try:
+                    if os.path.getmtime(file_path) <= since.timestamp():
+                        continue
+                except OSError:
+                    continue
+            files.append((folder, relative_path, file_path, record))
+    # Recorded files removed from the disk are listed as missing
+    files.extend((folder, relative_path, None, record) for (folder, relative_path), record in records.items())
+    directory_id, uploads_count = directory.id, len(uploads)
+
+    def generate():
+        writer = ZipStreamWriter(compresslevel=app.config.get('ZIP_COMPRESSLEVEL', 6))
+        should_compress = directory_compression(path)
+        index = io.StringIO()
+        rows = csv.writer(index)
+        rows.writerow(['folder', 'name', 'id', 'upload_time', 'file', 'size', 'hash', 'status'])
+        for folder, relative_path, file_path, record in files:
+            name, client_id, upload_time, size, digest = record or ('', '', None, '', '')
+            status = 'ok' if record is not None else 'unrecorded'
+            if file_path is None or not os.path.isfile(file_path):
+                status = 'missing'
+            else:
+                yield from writer.write_file(file_path, f'{folder}/{relative_path}',
+                                             compress=should_compress(relative_path))
+            rows.writerow([folder, name, client_id,
+                           upload_time.strftime('%Y-%m-%d %H:%M:%S') if upload_time else '',
+                           relative_path, size, digest, status])
+        yield from writer.write_bytes(index.getvalue().encode('utf-8'), 'index.csv')
+        yield from writer.close()
+        # Only complete collections count as collected
+        with app.app_context():
+            db.session.add(Collection(directory_id=directory_id, collected_time=collected_time,
+                                      uploads_count=uploads_count))
+            db.session.commit()
+        log.info('collected %d uploads (%d files) of %s', uploads_count, len(files), path)
+
+    suffix = '-new' if since is not None else ''
+    name = f'{path}-{collected_time.strftime("%Y%m%d-%H%M%S")}{suffix}.zip'
+    return Response(generate(), mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename="{name}"',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+@app.route("/metrics")
+@admin_required
+def metrics_view():
+    """
+    Server metrics in the Prometheus text format, or as JSON with `?format=json`.
+    """
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.snapshot())
+    return Response(metrics.exposition(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route("/dashboard")
+@admin_required
+def dashboard():
+    """
+    Live view of the server metrics.
+    """
+    return render_template('dashboard.html')
+
+
 @app.route("/reset_session")
 @admin_required
 def reset_session():
@@ -538,12 +1632,17 @@ def reset_session():
     Resets the current session by deleting the list of clients,
     uploads and downlooads.
     """
-    print('reset_session, admin: ', check_admin(request))
+    log.debug('reset_session, admin: %s', check_admin(request))
     if check_admin(request):
+        activity_log.flush()
         nd_client = Client.query.delete()
         nd_download = Download.query.delete()
+        UploadFile.query.delete()
         nd_upload = Upload.query.delete()
         db.session.commit()
+        app_cache.invalidate_client()
+        activity_store.clear()
+        notify_workers('activity_reset')
         flash(f'Session reset. Deleted {nd_client} client, {nd_download} download and {nd_upload} upload records.', 'success')
         return redirect(url_for('manage_session'))
     else:
@@ -558,8 +1657,10 @@ def delete_client(client_id):
     client = Client.query.filter(Client.id==client_id).first()
     selected_id = client.selected_id
     if client:
+        address = client.address
         db.session.delete(client)
         db.session.commit()
+        app_cache.invalidate_client(address)
         flash(f'Client {selected_id} deleted.', 'success')
     return redirect(url_for('manage_session'))
     
@@ -571,6 +1672,9 @@ def scan_shared_dir():
     View to scan the shared directory and add subdirectories to the DB.
     """
     count_added = add_shared_folders()
+    share_broadcaster.directories()
+    if content_store is not None:
+        content_store.prune()
     flash(f'Shared directory scanned and added {count_added} folders to the database.', 'success')
     return redirect(url_for('admin_view'))
     
@@ -582,10 +1686,10 @@ def set_language(language):
     """
     if language in app.config['LANGUAGES']:
         session['language'] = language.strip()
-        print('setting language to: ', session['language'])
+        log.debug('setting language to: %s', session['language'])
     return redirect(request.referrer or '/')
 
 
 if __name__ == "__main__":
     port = int(app.config.get("PORT", 5000))
-    app.run(port=port, host='0.0.0.0')
\ No newline at end of file
+    socketio.run(app, port=port, host='0.0.0.0', allow_unsafe_werkzeug=True)
\ No newline at end of file
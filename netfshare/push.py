@@ -0,0 +1,53 @@
+import threading
+
+
+def mode_room(mode):
+    """
+    Returns the name of the Socket.IO room of clients listing share `mode`.
+    """
+    return f'mode{mode}'
+
+
+class ShareBroadcaster:
+    """
+    Pushes changes of the shared directory lists to connected clients.
+
+    `listing()` returns `{mode: [directory names]}` of the broadcast share
+    modes. `directories()` compares it to the previously broadcast lists
+    and calls `emit(event, data, room)` with a `directories` event of the
+    added and removed names for each share mode that changed, to the room
+    of that mode. `state(mode)` is the full list, sent when a client joins.
+    """
+    def __init__(self, emit, listing):
+        self.emit = emit
+        self.listing = listing
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def state(self, mode):
+        return {'mode': mode, 'directories': self.listing().get(mode, [])}
+
+    def sync(self):
+        """
+        Takes the current lists as broadcast, after a change that another
+        process already broadcast.
+        """
+        with self._lock:
+            self._last = self.listing()
+
+    def directories(self):
+        """
+        Broadcasts the changes since the last call. Returns the changed modes.
+        """
+        with self._lock:
+            current = self.listing()
+            changes = []
+            for mode in sorted(current.keys() | self._last.keys()):
+                before, after = set(self._last.get(mode, ())), set(current.get(mode, ()))
+                if before != after:
+                    changes.append({'mode': mode, 'added': sorted(after - before),
+                                    'removed': sorted(before - after)})
+            self._last = current
+        for change in changes:
+            self.emit('directories', change, mode_room(change['mode']))
+        return [change['mode'] for change in changes]
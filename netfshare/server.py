@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import socket
+import signal
+import logging
+import importlib.util
+
+from werkzeug.wsgi import FileWrapper
+
+log = logging.getLogger(__name__)
+
+# Serving modes and the Socket.IO async mode they run on
+SERVER_MODES = {
+    'dev': 'threading',
+    'eventlet': 'eventlet',
+    'gevent': 'gevent',
+}
+
+
+def local_setting(name, default=None, shared_directory=None):
+    """
+    Returns the setting `name` from the local config file in `.netfshare`,
+    for settings needed before the app is imported.
+    """
+    local_config = os.path.join(shared_directory or os.getcwd(), '.netfshare', 'config.json')
+    try:
+        with open(local_config, 'r') as f:
+            return json.load(f).get(name, default)
+    except (OSError, ValueError):
+        return default
+
+
+def server_mode(shared_directory=None):
+    """
+    Returns the selected serving mode: the `NETFSHARE_SERVER` environment
+    variable (set from the command line), or `SERVER_MODE` from the local
+    config file in `.netfshare`, defaulting to the development server.
+    """
+    mode = os.getenv('NETFSHARE_SERVER') or local_setting('SERVER_MODE', shared_directory=shared_directory)
+    mode = mode or 'dev'
+    if mode not in SERVER_MODES:
+        raise ValueError(f'Unknown server mode {mode}, use one of {", ".join(SERVER_MODES)}.')
+    return mode
+
+
+def prepare(mode):
+    """
+    Patches the standard library for cooperative I/O. Must run before the
+    app (and anything that imports `threading` or `socket`) is imported.
+    """
+    os.environ['NETFSHARE_SERVER'] = mode
+    if mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+
+def check_worker_mode(mode):
+    """
+    Raises RuntimeError if worker processes cannot serve WebSocket
+    connections in the server `mode`, the only transport their clients use.
+    Does not import the server, so it can run before `prepare`.
+    """
+    if mode == 'gevent' and importlib.util.find_spec('geventwebsocket') is None:
+        raise RuntimeError('Worker processes in the gevent mode require the `gevent-websocket` package '
+                           '(pip install netfshare[gevent]).')
+
+
+def fork_workers(count, host='0.0.0.0', port=5000):
+    """
+    Listens on `host`:`port` and forks `count` worker processes serving it.
+    Returns `(index, listener, ready)` in each worker, which calls `ready()`
+    once the app is loaded. The parent supervises the workers, restarting
+    those that exit, and never returns.
+
+    Where supported, every worker listens on its own `SO_REUSEPORT` socket,
+    so the kernel spreads connections evenly between them. The first worker
+    starts alone, so that it creates and fills the database before the
+    others load the app. Must run before `prepare`.
+    """
+    reuse_port = hasattr(socket, 'SO_REUSEPORT')
+    if reuse_port:
+        # Fail early if the port is taken
+        socket.create_server((host, port), reuse_port=True).close()
+        listener = None
+    else:
+        listener = socket.create_server((host, port), backlog=2048)
+    os.environ['NETFSHARE_WORKERS'] = str(count)
+    workers = {}
+
+    def spawn(index, wait):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            os.environ['NETFSHARE_WORKER'] = str(index)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+
+            def ready():
+                os.write(write_fd, b'1')
+                os.close(write_fd)
+            return ready
+        os.close(write_fd)
+        if wait:
+            os.read(read_fd, 1)
+        os.close(read_fd)
+        workers[pid] = index
+        return None
+
+    def worker(index, ready):
+        if listener is not None:
+            return index, listener, ready
+        return index, socket.create_server((host, port), backlog=2048, reuse_port=True), ready
+
+    for index in range(count):
+        ready = spawn(index, wait=index == 0)
+        if ready is not None:
+            return worker(index, ready)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    log.info('Serving with %d worker processes', count)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = workers.pop(pid, None)
+        if index is None or stopping:
+            continue
+        log.warning('Worker %d exited (status %d), restarting', index + 1, status)
+        time.sleep(1)
+        ready = spawn(index, wait=False)
+        if ready is not None:
+            return worker(index, ready)
+    os._exit(0)
+
+
+class FileWrapperMiddleware:
+    """
+    Provides `wsgi.file_wrapper` to servers that lack one, so that file
+    responses are sent in large blocks instead of Werkzeug's 8 KiB default.
+    Files are still read and written through user space, not with sendfile;
+    USE_X_SENDFILE hands them to a front-end server instead.
+    """
+    def __init__(self, wsgi_app, block_size=1024 * 1024):
+        self.wsgi_app = wsgi_app
+        self.block_size = block_size
+
+    def __call__(self, environ, start_response):
+        if 'wsgi.file_wrapper' not in environ:
+            environ['wsgi.file_wrapper'] = lambda file, block_size=None: FileWrapper(
+                file, block_size or self.block_size)
+        return self.wsgi_app(environ, start_response)
+
+
+def run(app, socketio, mode, host='0.0.0.0', port=5000, workers=None, keepalive=True, listener=None):
+    """
+    Serves `app` and its Socket.IO endpoint with the server for `mode`.
+
+    `workers` caps the number of concurrently handled connections (green
+    threads in the eventlet and gevent modes). `keepalive` enables HTTP
+    keep-alive; eventlet also accepts an idle timeout in seconds.
+    `listener` is a socket shared with other worker processes.
+    """
+    if listener is not None:
+        serve_listener(app, mode, listener, workers, keepalive)
+        return
+    if mode == 'dev':
+        socketio.run(app, host=host, port=port, allow_unsafe_werkzeug=True)
+        return
+
+    app.debug = False
+    app.wsgi_app = FileWrapperMiddleware(app.wsgi_app, app.config.get('SEND_BLOCK_SIZE', 1024 * 1024))
+    options = {'debug': False, 'use_reloader': False, 'log_output': False}
+    if mode == 'eventlet':
+        options['keepalive'] = keepalive
+        if workers:
+            options['max_size'] = workers
+    elif mode == 'gevent':
+        if workers:
+            options['spawn'] = workers
+    log.info('Serving with %s (%s concurrent connections)', mode, workers or 'default')
+    socketio.run(app, host=host, port=port, **options)
+
+
+def serve_listener(app, mode, listener, workers=None, keepalive=True):
+    # Serves on the socket inherited from `fork_workers`, wrapped in the
+    # cooperative socket class patched in by `prepare`
+    listener = socket.socket(listener.family, listener.type, fileno=listener.detach())
+    app.debug = False
+    app.wsgi_app = FileWrapperMiddleware(app.wsgi_app, app.config.get('SEND_BLOCK_SIZE', 1024 * 1024))
+    if mode == 'eventlet':
+        import eventlet.wsgi
+        options = {'max_size': workers} if workers else {}
+        eventlet.wsgi.server(listener, app, log_output=False, debug=False, keepalive=keepalive, **options)
+    elif mode == 'gevent':
+        from gevent import pywsgi
+        check_worker_mode(mode)
+        from geventwebsocket.handler import WebSocketHandler
+        options = {'spawn': workers} if workers else {}
+        pywsgi.WSGIServer(listener, app, log=None, handler_class=WebSocketHandler, **options).serve_forever()
+    else:
+        raise ValueError('Worker processes require the eventlet or gevent server mode.')
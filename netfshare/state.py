@@ -0,0 +1,228 @@
+import os
+import abc
+import json
+import time
+import queue
+import socket
+import sqlite3
+import logging
+import threading
+import contextlib
+import collections
+
+from socketio import PubSubManager
+
+try:
+    import fcntl
+except ImportError:
+    # No locking between processes, which are only forked on POSIX systems
+    fcntl = None
+
+# Seconds between polls of the SQLite backend for new messages
+POLL_INTERVAL = 0.2
+# Seconds messages are kept in the SQLite backend
+RETENTION = 300
+
+log = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def file_lock(path, cancel=None, poll_interval=0.05):
+    """
+    Holds an exclusive lock on the file `path`, shared by all processes.
+    Waits by polling, so cooperative (eventlet, gevent) servers keep serving
+    meanwhile. Yields False if the `cancel` event was set while waiting.
+    """
+    if fcntl is None:
+        yield True
+        return
+    with open(path, 'a') as f:
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if cancel is not None and cancel.is_set():
+                    yield False
+                    return
+                time.sleep(poll_interval)
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class StateBackend(abc.ABC):
+    """
+    Publish/subscribe channel between the processes serving one shared
+    directory. Messages are JSON-serializable dicts.
+
+    `shared` is False for the backend of a single process.
+    """
+    shared = True
+
+    def __init__(self):
+        self.origin = f'{socket.gethostname()}:{os.getpid()}'
+
+    @abc.abstractmethod
+    def publish(self, channel, message):
+        """
+        Sends `message` to the listeners of `channel`.
+        """
+
+    @abc.abstractmethod
+    def listen(self, channel):
+        """
+        Yields the messages published on `channel` from now on, blocking
+        until the next one arrives.
+        """
+
+    def notify(self, channel, **message):
+        """
+        Publishes `message` to the other processes on `channel`.
+        """
+        self.publish(channel, dict(message, origin=self.origin))
+
+    def subscribe(self, channel, handler):
+        """
+        Calls `handler(message)` from a background thread for every message
+        sent to `channel` by other processes with `notify`.
+        """
+        def run():
+            for message in self.listen(channel):
+                if message.get('origin') == self.origin:
+                    continue
+                try:
+                    handler(message)
+                except Exception as e:
+                    log.error('State message %s failed: %s', message, e)
+
+        thread = threading.Thread(target=run, daemon=True, name=f'netfshare-state-{channel}')
+        thread.start()
+        return thread
+
+
+class LocalBackend(StateBackend):
+    """
+    Backend of a single process: messages are passed in memory.
+    """
+    shared = False
+
+    def __init__(self):
+        super().__init__()
+        self._queues = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            queues = list(self._queues[channel])
+        for q in queues:
+            q.put(message)
+
+    def listen(self, channel):
+        q = queue.Queue()
+        with self._lock:
+            self._queues[channel].append(q)
+        while True:
+            yield q.get()
+
+
+class SQLiteBackend(StateBackend):
+    """
+    Backend of processes on one machine, passing messages through a table
+    of a SQLite database in WAL mode at `path`. Listeners poll it every
+    `poll_interval` seconds; messages are removed after `retention` seconds.
+    """
+    def __init__(self, path, poll_interval=POLL_INTERVAL, retention=RETENTION):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._pruned = 0
+        with contextlib.closing(self._connect()) as db:
+            db.execute('CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                       'channel TEXT NOT NULL, message TEXT NOT NULL, created REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel, id)')
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def publish(self, channel, message):
+        now = time.time()
+        with contextlib.closing(self._connect()) as db:
+            db.execute('INSERT INTO messages (channel, message, created) VALUES (?, ?, ?)',
+                       (channel, json.dumps(message), now))
+            if now - self._pruned > self.retention:
+                self._pruned = now
+                db.execute('DELETE FROM messages WHERE created < ?', (now - self.retention,))
+
+    def listen(self, channel):
+        db = self._connect()
+        last, = db.execute('SELECT COALESCE(MAX(id), 0) FROM messages').fetchone()
+        while True:
+            rows = db.execute('SELECT id, message FROM messages WHERE channel = ? AND id > ? ORDER BY id',
+                              (channel, last)).fetchall()
+            for last, message in rows:
+                yield json.loads(message)
+            if not rows:
+                time.sleep(self.poll_interval)
+
+
+class RedisBackend(StateBackend):
+    """
+    Backend of processes on one or more machines, using the pub/sub
+    channels of a Redis-compatible server at `url`.
+    """
+    def __init__(self, url):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('A Redis state backend requires the `redis` package (pip install redis).')
+        self.redis = redis.Redis.from_url(url)
+
+    def publish(self, channel, message):
+        self.redis.publish(f'netfshare:{channel}', json.dumps(message))
+
+    def listen(self, channel):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(f'netfshare:{channel}')
+        for item in pubsub.listen():
+            if item['type'] == 'message':
+                yield json.loads(item['data'])
+
+
+def open_backend(setting, state_dir):
+    """
+    Returns the backend for the `STATE_BACKEND` setting: `local`, `sqlite`
+    (a database in `state_dir`) or the URL of a Redis server.
+    """
+    if setting == 'local':
+        return LocalBackend()
+    if setting == 'sqlite':
+        os.makedirs(state_dir, exist_ok=True)
+        return SQLiteBackend(os.path.join(state_dir, 'state.db'))
+    if setting.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(setting)
+    raise ValueError(f'Unknown state backend {setting}, use `local`, `sqlite` or a redis:// URL.')
+
+
+class BackendManager(PubSubManager):
+    """
+    Socket.IO client manager passing broadcasts between processes through
+    a `StateBackend`, for backends without a Socket.IO message queue.
+    """
+    name = 'netfshare'
+
+    def __init__(self, backend, channel='socketio', write_only=False, logger=None):
+        self.backend = backend
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _publish(self, data):
+        self.backend.publish(self.channel, data)
+
+    def _listen(self):
+        yield from self.backend.listen(self.channel)
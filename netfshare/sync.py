@@ -0,0 +1,242 @@
+import os
+import json
+import argparse
+import tempfile
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from .archive_cache import file_hash
+
+# Local record of the synced files, kept in the target directory
+STATE_FILE = '.netfshare-sync.json'
+COPY_SIZE = 256 * 1024
+
+
+class SyncError(Exception):
+    pass
+
+
+def parse_url(url):
+    """
+    Returns `(base_url, directory)` of the URL of a shared directory, e.g.
+    `http://192.168.1.10:5000/download/lecture1` or `192.168.1.10:5000/lecture1`.
+    """
+    if '://' not in url:
+        url = 'http://' + url
+    parsed = urllib.parse.urlsplit(url)
+    segments = [s for s in parsed.path.split('/') if s]
+    if parsed.scheme not in ('http', 'https') or not segments:
+        raise SyncError(f'{url} is not the URL of a shared directory.')
+    return f'{parsed.scheme}://{parsed.netloc}', urllib.parse.unquote(segments[-1])
+
+
+def local_path(target, relative_path):
+    """
+    Returns the path of `relative_path` (from the server) in `target`,
+    refusing paths that leave it.
+    """
+    parts = relative_path.split('/')
+    if relative_path.startswith('/') or any(part in ('', '.', '..') for part in parts):
+        raise SyncError(f'Invalid file path {relative_path} in the manifest.')
+    return os.path.join(target, *parts)
+
+
+def hash_file(path):
+    hasher = file_hash()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(COPY_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+class SyncClient:
+    """
+    Keeps a local copy of a shared read only directory up to date.
+
+    The server's manifest lists the content hash of every file; files whose
+    local copy has a different hash are fetched by `workers` threads, each
+    over its own keep-alive connection. Local files whose size and mtime
+    match the last sync are not hashed again.
+    """
+    def __init__(self, base_url, client_id=None, name=None, workers=4, timeout=60):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.https = parsed.scheme == 'https'
+        self.netloc = parsed.netloc
+        self.client_id = client_id
+        self.name = name
+        self.workers = workers
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self._local.conn = conn_class(self.netloc, timeout=self.timeout)
+        return conn
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Sends a request over the connection of the calling thread and
+        returns the response, reconnecting once if the server closed it.
+        """
+        headers = dict(headers or {})
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                return conn.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def identify(self):
+        if not self.client_id:
+            raise SyncError('This machine is not identified with the server, pass --id (and --name).')
+        body = urllib.parse.urlencode({'id': self.client_id, 'name': self.name or ''})
+        response = self.request('POST', '/id', body,
+                                {'Content-Type': 'application/x-www-form-urlencoded'})
+        response.read()
+
+    def manifest(self, directory):
+        path = '/manifest/' + urllib.parse.quote(directory)
+        for attempt in range(2):
+            response = self.request('GET', path, headers={'Accept': 'application/json'})
+            body = response.read()
+            if response.status == 302 and not attempt:
+                # Not identified yet, redirected to the identification page
+                self.identify()
+                continue
+            if response.status != 200:
+                try:
+                    message = json.loads(body)['error']
+                except (ValueError, KeyError):
+                    message = f'HTTP {response.status}'
+                raise SyncError(f'Manifest of {directory} not available: {message}')
+            return json.loads(body)
+        raise SyncError('Identification with the server failed, check --id and --name.')
+
+    def fetch(self, directory, entry, target):
+        """
+        Downloads the file of the manifest `entry` into `target`, replacing
+        the local copy once complete and verified.
+        """
+        path = local_path(target, entry['path'])
+        url = f'/file/{urllib.parse.quote(directory)}/{urllib.parse.quote(entry["path"])}'
+        response = self.request('GET', url, headers={'X-Netfshare-Sync': '1'})
+        if response.status != 200:
+            response.read()
+            raise SyncError(f'{entry["path"]}: HTTP {response.status}')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        hasher = file_hash()
+        fd, tmp_path = tempfile.mkstemp(prefix='.netfshare-', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    data = response.read(COPY_SIZE)
+                    if not data:
+                        break
+                    hasher.update(data)
+                    f.write(data)
+            if hasher.hexdigest() != entry['hash']:
+                raise SyncError(f'{entry["path"]} changed on the server during the download, sync again.')
+            os.utime(tmp_path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return entry['size']
+
+    def sync(self, directory, target, delete=False, progress=print):
+        """
+        Brings `target` up to date with the shared `directory`. Returns
+        `(fetched files, fetched bytes, unchanged files, deleted files)`.
+        """
+        os.makedirs(target, exist_ok=True)
+        state_path = os.path.join(target, STATE_FILE)
+        try:
+            with open(state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+
+        remote = self.manifest(directory)['files']
+        synced = {}
+        missing = []
+        for entry in remote:
+            path = local_path(target, entry['path'])
+            try:
+                st = os.stat(path)
+            except OSError:
+                missing.append(entry)
+                continue
+            known = state.get(entry['path'])
+            if known and known['size'] == st.st_size and known['mtime_ns'] == st.st_mtime_ns:
+                local_hash = known['hash']
+            elif st.st_size == entry['size']:
+                local_hash = hash_file(path)
+            else:
+                local_hash = None
+            if local_hash == entry['hash']:
+                synced[entry['path']] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': local_hash}
+            else:
+                missing.append(entry)
+
+        fetched_bytes = 0
+        errors = []
+        with ThreadPoolExecutor(self.workers) as pool:
+            jobs = [(entry, pool.submit(self.fetch, directory, entry, target)) for entry in missing]
+            for entry, job in jobs:
+                try:
+                    fetched_bytes += job.result()
+                except (SyncError, OSError, http.client.HTTPException) as e:
+                    errors.append(str(e))
+                    continue
+                st = os.stat(local_path(target, entry['path']))
+                synced[entry['path']] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': entry['hash']}
+                if progress is not None:
+                    progress(f'  {entry["path"]}')
+
+        deleted = 0
+        if delete:
+            for relative_path in set(state) - {entry['path'] for entry in remote}:
+                try:
+                    os.remove(local_path(target, relative_path))
+                    deleted += 1
+                except OSError:
+                    pass
+
+        with open(state_path, 'w') as f:
+            json.dump(synced, f)
+        if errors:
+            raise SyncError('Some files were not synced:\n' + '\n'.join(errors))
+        return len(missing), fetched_bytes, len(remote) - len(missing), deleted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='netfshare sync',
+                                     description='Download only new and changed files of a shared directory.')
+    parser.add_argument('url', help='URL of the shared directory, e.g. http://192.168.1.10:5000/download/lecture1')
+    parser.add_argument('dir', help='local copy of the directory')
+    parser.add_argument('--id', default=None, help='your ID, if this machine is not identified yet')
+    parser.add_argument('--name', default=None, help='your name, if required by the server')
+    parser.add_argument('--workers', type=int, default=4, help='files downloaded in parallel')
+    parser.add_argument('--delete', action='store_true',
+                        help='delete local files that were synced before and removed on the server')
+    args = parser.parse_args(argv)
+
+    try:
+        base_url, directory = parse_url(args.url)
+        client = SyncClient(base_url, client_id=args.id, name=args.name, workers=args.workers)
+        fetched, size, unchanged, deleted = client.sync(directory, args.dir, delete=args.delete)
+    except (SyncError, OSError, http.client.HTTPException) as e:
+        parser.exit(1, f'netfshare sync: {e}\n')
+    print(f'{fetched} files fetched ({size} bytes), {unchanged} unchanged, {deleted} deleted.')
@@ -0,0 +1,457 @@
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+
+from werkzeug.security import safe_join
+
+from .archive_cache import file_hash
+from .state import file_lock
+
+COPY_SIZE = 256 * 1024
+
+
+class UploadError(Exception):
+    """
+    Raised when an upload session request can not be fulfilled.
+    """
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def preallocate(file_path, size):
+    """
+    Creates (or resizes) `file_path` to `size` bytes, reserving the disk
+    blocks up front where the platform supports it. A larger existing file
+    is cut to `size`. Hard-linked (deduplicated) files are replaced, not
+    written through.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    try:
+        if os.stat(file_path).st_nlink > 1:
+            os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except OSError:
+                pass
+    finally:
+        os.close(fd)
+
+
+def remove_empty_dirs(directory, root):
+    """
+    Removes `directory` and its parents up to (not including) `root`, while they are empty.
+    """
+    root = os.path.abspath(root)
+    directory = os.path.abspath(directory)
+    while directory.startswith(root + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+        directory = os.path.dirname(directory)
+
+
+def save_stream(stream, file_path):
+    """
+    Copies the binary `stream` to `file_path`, hashing the data on the way.
+    The file is written next to its target and moved into place, so an
+    existing (possibly hard-linked) file is replaced, not overwritten.
+    Returns `(size, hash)`.
+    """
+    directory = os.path.dirname(file_path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+    hasher = file_hash()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                data = stream.read(COPY_SIZE)
+                if not data:
+                    break
+                hasher.update(data)
+                f.write(data)
+                size += len(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return size, hasher.hexdigest()
+
+
+def hash_file(file_path, hasher=None, offset=0):
+    """
+    Updates `hasher` (a new one by default) with the contents of `file_path`
+    from `offset` on and returns it.
+    """
+    hasher = hasher or file_hash()
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            data = f.read(COPY_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+    return hasher
+
+
+class ContentStore:
+    """
+    Content-addressed store of uploaded files in `store_dir`.
+
+    Every stored file is hard-linked into the store under its content hash.
+    Uploads with content that is already stored are replaced by a hard link
+    to the stored copy, so identical files uploaded by many clients keep
+    their place in each client's folder but take the disk space once.
+    Deduplication is skipped on filesystems without hard links.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.deduplicated = 0
+        self.saved_bytes = 0
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def object_path(self, digest):
+        return os.path.join(self.store_dir, digest[:2], digest)
+
+    def add(self, file_path, digest):
+        """
+        Stores the uploaded `file_path` with content hash `digest`.
+        Returns True if it was replaced by a link to identical content.
+        """
+        object_path = self.object_path(digest)
+        try:
+            st = os.stat(file_path)
+            try:
+                stored = os.stat(object_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.link(file_path, object_path)
+                return False
+            if os.path.samestat(st, stored) or st.st_size != stored.st_size:
+                return False
+            tmp_path = os.path.join(os.path.dirname(file_path), f'.dedup-{uuid.uuid4().hex}')
+            os.link(object_path, tmp_path)
+            os.replace(tmp_path, file_path)
+        except OSError:
+            return False
+        self.deduplicated += 1
+        self.saved_bytes += st.st_size
+        return True
+
+    def prune(self):
+        """
+        Removes stored content that is no longer linked from any upload.
+        Returns the number of removed files.
+        """
+        removed = 0
+        for root, dirs, files in os.walk(self.store_dir):
+            for file in files:
+                object_path = os.path.join(root, file)
+                try:
+                    if os.stat(object_path).st_nlink == 1:
+                        os.remove(object_path)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+
+
+class UploadSessions:
+    """
+    Resumable, chunked uploads.
+
+    A session is created for a set of files with known sizes. Each file is
+    preallocated next to its final location and filled with fixed-size
+    chunks, written in place straight from the request stream, then moved
+    into place when the session is finished, so a previous upload of the
+    same file is kept until the new one is complete. Received chunks are
+    recorded in `state_dir`, so an interrupted upload can be resumed from the
+    chunks that are missing, losing at most the chunk in transit.
+
+    Files are hashed while their chunks stream in, in order. Chunks that
+    arrive ahead of the hash are hashed from disk once the gap is filled,
+    and files of resumed sessions are hashed from disk when finished.
+
+    With `shared`, sessions are used by several processes: they are reloaded
+    from `state_dir` on every request and received chunks are recorded
+    under a lock file.
+
+    Sessions that received no chunk for a while are abandoned; `expire`
+    removes them along with their partial files.
+    """
+    def __init__(self, state_dir, chunk_size, shared=False):
+        self.state_dir = state_dir
+        self.chunk_size = chunk_size
+        self.shared = shared
+        self._sessions = {}
+        # `(session_id, index)`: [hasher, next chunk to hash, chunk being hashed while received]
+        self._hashers = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def _state_path(self, session_id):
+        return os.path.join(self.state_dir, session_id + '.json')
+
+    def _save(self, session):
+        tmp_path = self._state_path(session['id']) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(session, f)
+        os.replace(tmp_path, self._state_path(session['id']))
+
+    def create(self, client_id, directory, target_path, files):
+        """
+        Starts a session uploading `files` (a list of `{'name', 'size'}`
+        dicts with paths relative to `target_path`). Returns the session.
+        """
+        session_id = uuid.uuid4().hex
+        session_files = []
+        for index, file in enumerate(files):
+            try:
+                name = str(file['name']).replace('\\', '/')
+                size = int(file['size'])
+            except (KeyError, TypeError, ValueError):
+                raise UploadError('Each file requires a name and a size.')
+            file_path = safe_join(target_path, name)
+            if file_path is None or size < 0 or not os.path.basename(name):
+                raise UploadError(f'Invalid file: {name}')
+            session_files.append({
+                'name': name,
+                'size': size,
+                'path': file_path,
+                # Partial file, hidden in the client's folder until finished
+                'tmp_path': os.path.join(os.path.dirname(file_path), f'.upload-{session_id}-{index}'),
+                'chunks': -(-size // self.chunk_size),
+                'received': [],
+            })
+
+        for file in session_files:
+            preallocate(file['tmp_path'], file['size'])
+
+        session = {
+            'id': session_id,
+            'client_id': client_id,
+            'directory': directory,
+            'target_path': target_path,
+            'chunk_size': self.chunk_size,
+            'created': time.time(),
+            'files': session_files,
+        }
+        with self._lock:
+            self._sessions[session['id']] = (session, threading.Lock())
+        self._save(session)
+        return session
+
+    def _load(self, session_id):
+        try:
+            with open(self._state_path(session_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _get(self, session_id):
+        if not session_id.isalnum():
+            raise UploadError('Unknown upload session.', 404)
+        with self._lock:
+            if session_id not in self._sessions or self.shared:
+                session = self._load(session_id)
+                if session is None:
+                    raise UploadError('Unknown upload session.', 404)
+                lock = self._sessions[session_id][1] if session_id in self._sessions else threading.Lock()
+                self._sessions[session_id] = (session, lock)
+            return self._sessions[session_id]
+
+    def _record(self, session, index, chunk):
+        # Called with the session lock held
+        if not self.shared:
+            if chunk not in session['files'][index]['received']:
+                session['files'][index]['received'].append(chunk)
+            self._save(session)
+            return
+        # Merge the chunks received by other processes meanwhile
+        with file_lock(self._state_path(session['id']) + '.lock'):
+            stored = self._load(session['id']) or session
+            for file, stored_file in zip(session['files'], stored['files']):
+                file['received'] = sorted(set(file['received']) | set(stored_file['received']))
+            if chunk not in session['files'][index]['received']:
+                session['files'][index]['received'].append(chunk)
+            self._save(session)
+
+    def get(self, session_id, client_id):
+        """
+        Returns the session `session_id` owned by `client_id`.
+        """
+        session, _ = self._get(session_id)
+        if session['client_id'] != client_id:
+            raise UploadError('Unknown upload session.', 404)
+        return session
+
+    def write_chunk(self, session_id, client_id, index, chunk, stream, length):
+        """
+        Writes chunk number `chunk` of file `index` from the binary `stream`
+        of `length` bytes, directly into the preallocated partial file.
+        Returns the number of bytes written.
+        """
+        session, lock = self._get(session_id)
+        if session['client_id'] != client_id:
+            raise UploadError('Unknown upload session.', 404)
+        try:
+            file = session['files'][index]
+        except IndexError:
+            raise UploadError('Invalid file index.')
+        if not 0 <= chunk < file['chunks']:
+            raise UploadError('Invalid chunk index.')
+        offset = chunk * session['chunk_size']
+        expected = min(session['chunk_size'], file['size'] - offset)
+        if length != expected:
+            raise UploadError(f'Chunk must be {expected} bytes.')
+
+        # Hash the chunk as it is received, if it is the next one in order
+        key = (session_id, index)
+        with lock:
+            state = self._hashers.get(key)
+            if state is None and not file['received']:
+                state = self._hashers[key] = [file_hash(), 0, None]
+            hasher = None
+            if state is not None and state[1] == chunk and state[2] is None:
+                state[2] = chunk
+                hasher = state[0]
+
+        fd = os.open(file['tmp_path'], os.O_WRONLY)
+        try:
+            written = 0
+            while written < length:
+                data = stream.read(min(COPY_SIZE, length - written))
+                if not data:
+                    raise UploadError('Incomplete chunk.')
+                os.pwrite(fd, data, offset + written)
+                if hasher is not None:
+                    hasher.update(data)
+                written += len(data)
+        except BaseException:
+            if hasher is not None:
+                # The hash is incomplete, hash the file from disk when finished
+                with lock:
+                    self._hashers.pop(key, None)
+            raise
+        finally:
+            os.close(fd)
+
+        with lock:
+            self._record(session, index, chunk)
+            if hasher is not None:
+                state[1] += 1
+                state[2] = None
+                self._catch_up(session, index, state)
+        return written
+
+    def _catch_up(self, session, index, state):
+        # Hash chunks that were received ahead of the hash
+        file = session['files'][index]
+        received = set(file['received'])
+        while state[1] in received:
+            offset = state[1] * session['chunk_size']
+            with open(file['tmp_path'], 'rb') as f:
+                f.seek(offset)
+                remaining = min(session['chunk_size'], file['size'] - offset)
+                while remaining > 0:
+                    data = f.read(min(COPY_SIZE, remaining))
+                    if not data:
+                        break
+                    state[0].update(data)
+                    remaining -= len(data)
+            state[1] += 1
+
+    def status(self, session):
+        """
+        Returns the resume state of `session`: for every file, the chunks
+        still missing and the number of bytes already stored.
+        """
+        files = []
+        for file in session['files']:
+            received = set(file['received'])
+            stored = sum(min(session['chunk_size'], file['size'] - c * session['chunk_size'])
+                         for c in received)
+            files.append({
+                'name': file['name'],
+                'size': file['size'],
+                'received_bytes': stored,
+                'missing': [c for c in range(file['chunks']) if c not in received],
+            })
+        return {'id': session['id'], 'chunk_size': session['chunk_size'], 'files': files}
+
+    def _remove(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            for key in [key for key in self._hashers if key[0] == session_id]:
+                del self._hashers[key]
+        for path in (self._state_path(session_id), self._state_path(session_id) + '.lock'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def expire(self, max_age):
+        """
+        Removes the sessions that received no chunk in `max_age` seconds,
+        and their partial files. Returns the number of removed sessions.
+        """
+        expired = 0
+        now = time.time()
+        for entry in os.scandir(self.state_dir):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                # The state is saved whenever a chunk is received
+                if now - entry.stat().st_mtime < max_age:
+                    continue
+            except OSError:
+                continue
+            session_id = entry.name[:-len('.json')]
+            session = self._load(session_id)
+            if session is not None:
+                # Previous uploads of the same files are left in place
+                for file in session['files']:
+                    try:
+                        os.remove(file['tmp_path'])
+                    except OSError:
+                        pass
+                    remove_empty_dirs(os.path.dirname(file['path']), os.path.dirname(session['target_path']))
+            self._remove(session_id)
+            expired += 1
+        return expired
+
+    def finish(self, session_id, client_id):
+        """
+        Closes a complete session, moving its files into place, and returns
+        it with the content `hash` of each file.
+        """
+        session = self.get(session_id, client_id)
+        for file in session['files']:
+            if len(set(file['received'])) < file['chunks']:
+                raise UploadError(f'Upload of {file["name"]} is incomplete.', 409)
+        for index, file in enumerate(session['files']):
+            state = self._hashers.pop((session_id, index), None)
+            if state is not None and state[1] >= file['chunks']:
+                file['hash'] = state[0].hexdigest()
+            else:
+                file['hash'] = hash_file(file['tmp_path']).hexdigest()
+        for file in session['files']:
+            os.replace(file['tmp_path'], file['path'])
+        self._remove(session_id)
+        return session
@@ -0,0 +1,166 @@
+import math
+import time
+import logging
+import threading
+
+from .archive_cache import BuildCancelled
+
+log = logging.getLogger(__name__)
+
+
+class ArchiveWarmer:
+    """
+    Builds archives of shared directories in the background, before they
+    are downloaded.
+
+    Directories are queued with `schedule` (when shared, or when their
+    contents change) and built by a pool of `workers` threads through the
+    archive cache's single-flight `refresh`, so downloads arriving during a
+    build wait for it instead of starting their own. The next directory is
+    the one with the most recent downloads (`note_demand`, decaying with
+    `half_life` seconds), then the smallest, so most directories become
+    ready quickly. `cancel` drops a queued directory and stops its build.
+
+    `resolve(name)` returns `(directory, should_compress, size)` of a
+    directory that should be warmed, or None. `on_progress(name, state,
+    done, total)` reports `queued`, `building`, `ready`, `cancelled` and
+    `failed` states and build progress in files.
+    """
+    def __init__(self, cache, resolve, workers=1, delay=2, half_life=600, on_progress=None):
+        self.cache = cache
+        self.resolve = resolve
+        self.workers = workers
+        self.delay = delay
+        self.half_life = half_life
+        self.on_progress = on_progress
+        self._pending = {}
+        self._running = {}
+        self._demand = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True, name=f'netfshare-warmer-{i}')
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            for cancel in self._running.values():
+                cancel.set()
+            self._cond.notify_all()
+
+    def _report(self, name, state, done=0, total=0):
+        if self.on_progress is not None:
+            try:
+                self.on_progress(name, state, done, total)
+            except Exception as e:
+                log.warning('Archive progress report failed: %s', e)
+
+    def schedule(self, name, delay=None):
+        """
+        Queues the archive of `name` to be built in `delay` seconds (the
+        `delay` given to the warmer by default), so bursts of changes
+        result in a single build.
+        """
+        ready_at = time.monotonic() + (self.delay if delay is None else delay)
+        with self._cond:
+            self._pending[name] = ready_at
+            self._cond.notify_all()
+        self._report(name, 'queued')
+
+    def cancel(self, name):
+        """
+        Drops `name` from the queue and stops its build in progress.
+        """
+        with self._cond:
+            queued = self._pending.pop(name, None) is not None
+            cancel = self._running.get(name)
+            if cancel is not None:
+                cancel.set()
+        if queued and cancel is None:
+            self._report(name, 'cancelled')
+
+    def note_demand(self, name):
+        """
+        Records a download request for `name`, raising its priority.
+        """
+        now = time.monotonic()
+        with self._cond:
+            self._demand[name] = self._current_demand(name, now) + 1, now
+
+    def _current_demand(self, name, now):
+        demand, since = self._demand.get(name, (0, now))
+        return demand * math.pow(0.5, (now - since) / self.half_life)
+
+    def status(self):
+        """
+        Returns `{name: 'queued' | 'building'}` of directories being warmed.
+        """
+        with self._cond:
+            status = {name: 'queued' for name in self._pending}
+            status.update({name: 'building' for name in self._running})
+        return status
+
+    def _next(self):
+        # Called with the lock held. Returns the ready directory with the
+        # highest priority, or the seconds until the next one is ready.
+        now = time.monotonic()
+        ready = [name for name, ready_at in self._pending.items()
+                 if ready_at <= now and name not in self._running]
+        if not ready:
+            waiting = [ready_at for name, ready_at in self._pending.items() if name not in self._running]
+            return None, (min(waiting) - now if waiting else None)
+        candidates = []
+        for name in ready:
+            try:
+                target = self.resolve(name)
+            except Exception as e:
+                log.error('archive %s: %s', name, e)
+                target = None
+            if target is None:
+                del self._pending[name]
+                continue
+            candidates.append((-self._current_demand(name, now), target[2], name, target))
+        if not candidates:
+            return None, 0
+        _, _, name, target = min(candidates)
+        del self._pending[name]
+        return (name, target), None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    job, timeout = self._next()
+                    if job is not None:
+                        break
+                    self._cond.wait(timeout)
+                name, (directory, should_compress, size) = job
+                cancel = self._running[name] = threading.Event()
+            self._build(name, directory, should_compress, cancel)
+            with self._cond:
+                del self._running[name]
+                self._cond.notify_all()
+
+    def _build(self, name, directory, should_compress, cancel):
+        self._report(name, 'building')
+        try:
+            self.cache.refresh(name, directory, should_compress, cancel=cancel,
+                               progress=lambda done, total: self._report(name, 'building', done, total))
+        except BuildCancelled:
+            log.info('archive %s: build cancelled', name)
+            self._report(name, 'cancelled')
+            return
+        except Exception as e:
+            log.error('archive %s: build failed: %s', name, e)
+            self._report(name, 'failed')
+            return
+        manifest = self.cache.load_manifest(name)
+        files = len(manifest['files']) if manifest else 0
+        self._report(name, 'ready', files, files)
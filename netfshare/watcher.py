@@ -0,0 +1,257 @@
+import os
+import logging
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError: # Optional dependency, fall back to polling
+    Observer = None
+    FileSystemEventHandler = object
+
+log = logging.getLogger(__name__)
+
+
+class DirectoryInfo:
+    """
+    Index entry of a shared subdirectory.
+    """
+    __slots__ = ('path', 'mode', 'size', 'file_count', 'latest_mtime', 'files')
+
+    def __init__(self, path, mode=0):
+        self.path = path
+        self.mode = mode
+        self.size = 0
+        self.file_count = 0
+        self.latest_mtime = 0
+        self.files = None
+
+    def __repr__(self):
+        return f'DirectoryInfo: {self.path} (mode {self.mode}, {self.file_count} files, {self.size} bytes)'
+
+
+def directory_stats(directory):
+    """
+    Returns `(size, file_count, latest_mtime)` of all files below `directory`.
+    """
+    size = file_count = 0
+    latest_mtime = 0
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            try:
+                st = os.stat(os.path.join(root, file))
+            except OSError:
+                continue
+            size += st.st_size
+            file_count += 1
+            latest_mtime = max(latest_mtime, st.st_mtime)
+    return size, file_count, latest_mtime
+
+
+class SharedTree:
+    """
+    In-memory index of the subdirectories of the shared directory `root`,
+    with their share modes and contents statistics.
+
+    The index is kept up to date by a `TreeWatcher`, so listing views do
+    not touch the filesystem. `on_change(path)` is called for every
+    subdirectory whose contents changed (`on_added` / `on_removed` when
+    subdirectories appear or disappear).
+    """
+    def __init__(self, root, exclude=(), on_change=None, on_added=None, on_removed=None):
+        self.root = root
+        self.exclude = set(exclude)
+        self.on_change = on_change
+        self.on_added = on_added
+        self.on_removed = on_removed
+        self._dirs = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, path):
+        return path in self._dirs
+
+    def get(self, path):
+        return self._dirs.get(path)
+
+    def dirs(self, mode=None):
+        """
+        Returns the sorted names of indexed subdirectories with share `mode`.
+        """
+        return sorted(d.path for d in list(self._dirs.values()) if mode is None or d.mode == mode)
+
+    def set_mode(self, path, mode):
+        info = self._dirs.get(path)
+        if info is not None:
+            info.mode = mode
+
+    def set_modes(self, modes):
+        """
+        Sets share modes from a `{path: mode}` dict.
+        """
+        for path, mode in modes.items():
+            self.set_mode(path, mode)
+
+    def files(self, name):
+        """
+        Returns the sorted list of `(relative_path, size, mtime)` of all files
+        in subdirectory `name`, listed once and cached until its contents change.
+        """
+        info = self._dirs.get(name)
+        if info is None:
+            return []
+        files = info.files
+        if files is None:
+            directory = os.path.join(self.root, name)
+            files = []
+            for root, dirs, filenames in os.walk(directory):
+                for file in filenames:
+                    file_path = os.path.join(root, file)
+                    try:
+                        st = os.stat(file_path)
+                    except OSError:
+                        continue
+                    files.append((os.path.relpath(file_path, directory).replace(os.sep, '/'),
+                                  st.st_size, st.st_mtime))
+            files.sort()
+            info.files = files
+        return files
+
+    def subdirectory_of(self, file_path):
+        """
+        Returns `(name, relative_path)` of the top-level subdirectory `name`
+        containing `file_path`, or None for excluded paths and paths outside
+        of `root`.
+        """
+        relative_path = os.path.relpath(file_path, self.root)
+        if relative_path == os.curdir or relative_path.startswith(os.pardir):
+            return None
+        name = relative_path.split(os.sep)[0]
+        if name in self.exclude:
+            return None
+        return name, relative_path
+
+    def scan(self, refresh_all=True, stats=True):
+        """
+        Synchronizes the index with the subdirectories on disk and computes
+        the statistics of new subdirectories, or of all of them if `refresh_all`.
+        Without `stats`, only the subdirectory names are indexed and their
+        statistics are left to `refresh`.
+        """
+        try:
+            names = {entry.name for entry in os.scandir(self.root)
+                     if entry.is_dir() and entry.name not in self.exclude}
+        except OSError:
+            return
+        with self._lock:
+            added = names - self._dirs.keys()
+            removed = self._dirs.keys() - names
+            for name in added:
+                self._dirs[name] = DirectoryInfo(name)
+            for name in removed:
+                del self._dirs[name]
+        for name in removed:
+            if self.on_removed is not None:
+                self.on_removed(name)
+        for name in added:
+            if self.on_added is not None:
+                self.on_added(name)
+        if not stats:
+            return
+        for name in (names if refresh_all else added):
+            self.refresh(name, notify=name not in added)
+
+    def refresh(self, name, notify=True):
+        """
+        Recomputes the statistics of subdirectory `name`.
+        Returns True if its contents changed.
+        """
+        info = self._dirs.get(name)
+        if info is None:
+            return False
+        stats = directory_stats(os.path.join(self.root, name))
+        changed = stats != (info.size, info.file_count, info.latest_mtime)
+        info.size, info.file_count, info.latest_mtime = stats
+        if changed:
+            info.files = None
+        if changed and notify and self.on_change is not None:
+            self.on_change(name)
+        return changed
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        for path in (event.src_path, getattr(event, 'dest_path', None)):
+            if path:
+                self.watcher.mark_dirty(os.fsdecode(path))
+
+
+class TreeWatcher(threading.Thread):
+    """
+    Keeps a `SharedTree` up to date, after an initial `SharedTree.scan`.
+
+    With `watchdog` installed, filesystem events (inotify on Linux) mark
+    subdirectories dirty and only those are rescanned, `debounce` seconds
+    after the first event. Without it (or with `polling=True`) the whole tree
+    is rescanned every `interval` seconds.
+    """
+    def __init__(self, tree, interval=10, debounce=0.5, polling=False):
+        super().__init__(daemon=True, name='netfshare-watcher')
+        self.tree = tree
+        self.interval = interval
+        self.debounce = debounce
+        self.polling = polling or Observer is None
+        self._dirty = set()
+        self._rescan_root = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._observer = None
+
+    def mark_dirty(self, path):
+        found = self.tree.subdirectory_of(path)
+        if found is None:
+            return
+        name, relative_path = found
+        with self._lock:
+            if relative_path == name or name not in self.tree:
+                # A top-level entry was added, removed or renamed
+                self._rescan_root = True
+            else:
+                self._dirty.add(name)
+        self._wake.set()
+
+    def run(self):
+        if not self.polling:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_EventHandler(self), self.tree.root, recursive=True)
+                self._observer.start()
+            except Exception as e:
+                log.warning('Filesystem events not available (%s), polling every %s s.', e, self.interval)
+                self.polling = True
+
+        while not self._stopped.is_set():
+            if self.polling:
+                self._stopped.wait(self.interval)
+                self.tree.scan()
+                continue
+
+            self._wake.wait()
+            self._stopped.wait(self.debounce)
+            self._wake.clear()
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                rescan_root, self._rescan_root = self._rescan_root, False
+            if rescan_root:
+                self.tree.scan(refresh_all=False)
+            for name in dirty:
+                self.tree.refresh(name)
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
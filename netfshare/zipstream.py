@@ -0,0 +1,365 @@
+import os
+import stat
+import struct
+import time
+import zlib
+import tempfile
+
+# ZIP format constants
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+ZIP_MAX_VALUE = 0xFFFFFFFF
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_VERSION_DEFAULT = 20
+_VERSION_ZIP64 = 45
+_VERSION_MADE_BY = (3 << 8) | _VERSION_ZIP64 # UNIX
+
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+_CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+_END_RECORD = struct.Struct('<4s4H2LH')
+_END_RECORD64 = struct.Struct('<4sQ2H2L4Q')
+_END_LOCATOR64 = struct.Struct('<4sLQL')
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 1024 * 1024
+
+# Already compressed media, stored without deflating in `auto` compression mode
+STORE_EXTENSIONS = (
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp3', '.mp4', '.m4a', '.mkv', '.mov', '.avi', '.webm', '.ogg',
+    '.zip', '.gz', '.bz2', '.xz', '.7z', '.rar', '.zst',
+    '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.jar', '.apk',
+)
+
+
+def dos_date_time(timestamp):
+    """
+    Converts a POSIX timestamp to a (date, time) pair in MS-DOS format.
+    """
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:
+        return (1 << 5) | 1, 0 # 1980-01-01
+    dos_date = (t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    dos_time = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    return dos_date, dos_time
+
+
+class ZipMember:
+    """
+    Metadata of a single archive member, as written to the central directory.
+    """
+    __slots__ = ('name', 'method', 'date', 'time', 'crc', 'compress_size',
+                 'file_size', 'header_offset', 'data_offset', 'external_attr',
+                 'flags', 'zip64')
+
+    def __init__(self, name, method, date_time, external_attr=0):
+        self.name = name.replace(os.sep, '/')
+        self.method = method
+        self.date, self.time = date_time
+        self.external_attr = external_attr
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+        self.header_offset = 0
+        self.data_offset = 0
+        self.flags = _FLAG_UTF8
+        self.zip64 = False
+
+    def __repr__(self):
+        return f'ZipMember: {self.name} ({self.compress_size}/{self.file_size} bytes)'
+
+
+def compression_policy(mode='auto', store_extensions=STORE_EXTENSIONS):
+    """
+    Returns a function that decides whether a member at a relative path should be
+    deflated (True) or stored (False).
+
+    `mode` is one of `auto` (store files with `store_extensions`, deflate the
+    rest), `deflate` (deflate everything) or `store` (store everything).
+    """
+    if mode == 'store':
+        return lambda relative_path: False
+    if mode == 'deflate':
+        return lambda relative_path: True
+    extensions = tuple(e.lower() for e in store_extensions)
+    return lambda relative_path: not relative_path.lower().endswith(extensions)
+
+
+class CompressedFile:
+    """
+    A file compressed ahead of being written to an archive with
+    `ZipStreamWriter.write_raw`. The compressed data is held in `data`,
+    a spooled temporary file.
+    """
+    __slots__ = ('data', 'crc', 'file_size', 'compress_size', 'date_time',
+                 'external_attr', 'hash')
+
+    def __init__(self, data, crc, file_size, compress_size, date_time, external_attr, hash=None):
+        self.data = data
+        self.crc = crc
+        self.file_size = file_size
+        self.compress_size = compress_size
+        self.date_time = date_time
+        self.external_attr = external_attr
+        self.hash = hash
+
+
+def compress_file(file_path, compresslevel=6, hasher=None, chunk_size=CHUNK_SIZE, spool_dir=None):
+    """
+    Deflates the file at `file_path` into a `CompressedFile`.
+    Small results are kept in memory, larger ones spill over to `spool_dir`.
+    zlib releases the GIL while compressing, so this can run in worker threads.
+    """
+    st = os.stat(file_path)
+    data = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, dir=spool_dir)
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    crc = file_size = compress_size = 0
+    try:
+        with open(file_path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                if hasher is not None:
+                    hasher.update(chunk)
+                file_size += len(chunk)
+                chunk = compressor.compress(chunk)
+                compress_size += len(chunk)
+                data.write(chunk)
+        chunk = compressor.flush()
+        compress_size += len(chunk)
+        data.write(chunk)
+    except BaseException:
+        data.close()
+        raise
+    return CompressedFile(data, crc, file_size, compress_size, dos_date_time(st.st_mtime),
+                          (st.st_mode & 0xFFFF) << 16,
+                          hasher.hexdigest() if hasher is not None else None)
+
+
+class ZipStreamWriter:
+    """
+    Writes a ZIP archive as a sequence of byte chunks, without seeking.
+
+    Members of unknown compressed size are written with trailing data
+    descriptors, so the output can be sent to the client while it is being
+    produced. ZIP64 records are used whenever sizes, offsets or the member
+    count exceed the limits of the classic format.
+    """
+    def __init__(self, compresslevel=6, chunk_size=CHUNK_SIZE):
+        self.compresslevel = compresslevel
+        self.chunk_size = chunk_size
+        self.members = []
+        self.offset = 0
+
+    def _local_header(self, member):
+        name = member.name.encode('utf-8')
+        extra = b''
+        if member.zip64:
+            extra = struct.pack('<2H2Q', 1, 16, member.file_size, member.compress_size)
+            compress_size = file_size = ZIP_MAX_VALUE
+            version = _VERSION_ZIP64
+        else:
+            compress_size, file_size = member.compress_size, member.file_size
+            version = _VERSION_DEFAULT
+        header = _LOCAL_HEADER.pack(
+            b'PK\x03\x04', version, member.flags, member.method,
+            member.time, member.date, member.crc, compress_size, file_size,
+            len(name), len(extra))
+        return header + name + extra
+
+    def _data_descriptor(self, member):
+        if member.zip64:
+            return struct.pack('<4sL2Q', b'PK\x07\x08', member.crc,
+                               member.compress_size, member.file_size)
+        return struct.pack('<4s3L', b'PK\x07\x08', member.crc,
+                           member.compress_size, member.file_size)
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def write_file(self, file_path, arcname, compress=True, hasher=None):
+        """
+        Yields the archive bytes of a file read from `file_path`, stored as
+        `arcname`. The file is read and compressed `chunk_size` bytes at a time.
+        If given, `hasher` is updated with the uncompressed file content.
+        """
+        st = os.stat(file_path)
+        method = ZIP_DEFLATED if compress else ZIP_STORED
+        member = ZipMember(arcname, method, dos_date_time(st.st_mtime),
+                           (st.st_mode & 0xFFFF) << 16)
+        member.flags |= _FLAG_DATA_DESCRIPTOR
+        member.zip64 = st.st_size * 1.05 > ZIP64_LIMIT
+        member.header_offset = self.offset
+        yield self._emit(self._local_header(member))
+        member.data_offset = self.offset
+
+        crc = 0
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15) if compress else None
+        with open(file_path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                if hasher is not None:
+                    hasher.update(chunk)
+                member.file_size += len(chunk)
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                    if not chunk:
+                        continue
+                member.compress_size += len(chunk)
+                yield self._emit(chunk)
+        if compressor is not None:
+            tail = compressor.flush()
+            member.compress_size += len(tail)
+            yield self._emit(tail)
+        member.crc = crc
+
+        if not member.zip64 and max(member.file_size, member.compress_size) > ZIP64_LIMIT:
+            # The file grew while being read.
+            raise RuntimeError(f'{file_path} exceeded the ZIP64 limit while streaming.')
+        yield self._emit(self._data_descriptor(member))
+        self.members.append(member)
+
+    def write_bytes(self, data, arcname, compress=True, timestamp=None):
+        """
+        Yields the archive bytes of an in-memory file `data`, stored as
+        `arcname` with the modification time `timestamp` (default now).
+        """
+        method = ZIP_DEFLATED if compress else ZIP_STORED
+        member = ZipMember(arcname, method, dos_date_time(time.time() if timestamp is None else timestamp),
+                           0o100644 << 16)
+        member.crc = zlib.crc32(data)
+        member.file_size = len(data)
+        if compress:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+            data = compressor.compress(data) + compressor.flush()
+        member.compress_size = len(data)
+        member.zip64 = max(member.file_size, member.compress_size) > ZIP64_LIMIT
+        member.header_offset = self.offset
+        yield self._emit(self._local_header(member))
+        member.data_offset = self.offset
+        yield self._emit(data)
+        self.members.append(member)
+
+    def write_raw(self, source, data_offset, arcname, method, date_time, crc,
+                  compress_size, file_size, external_attr=0):
+        """
+        Yields the archive bytes of an already compressed member, copied from
+        the open binary file `source` starting at `data_offset`.
+        Used to reuse members of a previously built archive without
+        recompressing them.
+        """
+        member = ZipMember(arcname, method, date_time, external_attr)
+        member.crc = crc
+        member.compress_size = compress_size
+        member.file_size = file_size
+        member.zip64 = max(file_size, compress_size) > ZIP64_LIMIT
+        member.header_offset = self.offset
+        yield self._emit(self._local_header(member))
+        member.data_offset = self.offset
+
+        source.seek(data_offset)
+        remaining = compress_size
+        while remaining > 0:
+            chunk = source.read(min(self.chunk_size, remaining))
+            if not chunk:
+                raise EOFError(f'Source archive truncated while copying {arcname}.')
+            remaining -= len(chunk)
+            yield self._emit(chunk)
+        self.members.append(member)
+
+    def close(self):
+        """
+        Yields the central directory and end of archive records.
+        """
+        central_dir_offset = self.offset
+        for member in self.members:
+            yield self._emit(self._central_header(member))
+        central_dir_size = self.offset - central_dir_offset
+
+        count = len(self.members)
+        if (count >= ZIP_FILECOUNT_LIMIT or central_dir_offset > ZIP64_LIMIT
+                or central_dir_size > ZIP64_LIMIT):
+            end64_offset = self.offset
+            yield self._emit(_END_RECORD64.pack(
+                b'PK\x06\x06', _END_RECORD64.size - 12, _VERSION_MADE_BY, _VERSION_ZIP64,
+                0, 0, count, count, central_dir_size, central_dir_offset))
+            yield self._emit(_END_LOCATOR64.pack(b'PK\x06\x07', 0, end64_offset, 1))
+            count = min(count, ZIP_FILECOUNT_LIMIT)
+            central_dir_offset = min(central_dir_offset, ZIP_MAX_VALUE)
+            central_dir_size = min(central_dir_size, ZIP_MAX_VALUE)
+        yield self._emit(_END_RECORD.pack(
+            b'PK\x05\x06', 0, 0, count, count, central_dir_size, central_dir_offset, 0))
+
+    def _central_header(self, member):
+        name = member.name.encode('utf-8')
+        extra_values = []
+        file_size, compress_size, header_offset = member.file_size, member.compress_size, member.header_offset
+        if member.zip64 or file_size > ZIP64_LIMIT:
+            extra_values.append(file_size)
+            file_size = ZIP_MAX_VALUE
+        if member.zip64 or compress_size > ZIP64_LIMIT:
+            extra_values.append(compress_size)
+            compress_size = ZIP_MAX_VALUE
+        if header_offset > ZIP64_LIMIT:
+            extra_values.append(header_offset)
+            header_offset = ZIP_MAX_VALUE
+        extra = b''
+        version = _VERSION_DEFAULT
+        if extra_values:
+            extra = struct.pack(f'<2H{len(extra_values)}Q', 1, 8 * len(extra_values), *extra_values)
+            version = _VERSION_ZIP64
+        header = _CENTRAL_HEADER.pack(
+            b'PK\x01\x02', _VERSION_MADE_BY, version, member.flags, member.method,
+            member.time, member.date, member.crc, compress_size, file_size,
+            len(name), len(extra), 0, 0, 0, member.external_attr, header_offset)
+        return header + name + extra
+
+
+def iter_directory_files(directory):
+    """
+    Yields `(file_path, relative_path)` pairs for all regular files below
+    `directory`, in a stable (sorted) order.
+    """
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            try:
+                if not stat.S_ISREG(os.stat(file_path).st_mode):
+                    continue
+            except OSError:
+                continue
+            yield file_path, os.path.relpath(file_path, directory)
+
+
+def stream_files(files, compresslevel=6, chunk_size=CHUNK_SIZE, should_compress=None):
+    """
+    Generates a ZIP archive of `files`, an iterable of `(file_path, arcname)`
+    pairs, on the fly. Memory use is bounded by `chunk_size`, regardless of
+    the size of the files. `should_compress` is a function returned by
+    `compression_policy`.
+    """
+    if should_compress is None:
+        should_compress = compression_policy()
+    writer = ZipStreamWriter(compresslevel=compresslevel, chunk_size=chunk_size)
+    for file_path, arcname in files:
+        yield from writer.write_file(file_path, arcname, compress=should_compress(arcname))
+    yield from writer.close()
+
+
+def stream_directory(directory, compresslevel=6, chunk_size=CHUNK_SIZE, should_compress=None):
+    """
+    Generates a ZIP archive of `directory` on the fly.
+    """
+    yield from stream_files(iter_directory_files(directory), compresslevel=compresslevel,
+                            chunk_size=chunk_size, should_compress=should_compress)
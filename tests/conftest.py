@@ -0,0 +1,59 @@
+import os
+import importlib
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def shared_dir(tmp_path_factory):
+    """
+    The shared directory of the app under test, with two read only and
+    one upload only subdirectory.
+    """
+    shared = tmp_path_factory.mktemp('shared')
+    (shared / 'lecture').mkdir()
+    (shared / 'lecture' / 'notes.txt').write_bytes(b'notes ' * 2000)
+    (shared / 'lecture' / 'data.bin').write_bytes(os.urandom(64 * 1024))
+    (shared / 'slides').mkdir()
+    for i in range(5):
+        (shared / 'slides' / f'slide{i}.txt').write_bytes(b'slide %d ' % i * 1000)
+    (shared / 'homework').mkdir()
+    return shared
+
+
+@pytest.fixture(scope='session')
+def nfs(shared_dir):
+    """
+    The `netfshare.netfshare` module, serving `shared_dir` (the app is set
+    up on import from the working directory), started without the
+    background workers that need the network or a clock.
+    """
+    cwd = os.getcwd()
+    os.chdir(shared_dir)
+    try:
+        module = importlib.import_module('netfshare.netfshare')
+    finally:
+        os.chdir(cwd)
+    module.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, WATCHER='off')
+    module.liveness_prober.interval = 0
+    module.archive_warmer_enabled = False
+    module.startup()
+    with module.app.app_context():
+        for path, mode in (('lecture', 1), ('slides', 1), ('homework', 2)):
+            directory = module.Directory.query.filter_by(path=path).one()
+            directory.mode = mode
+            module.db.session.commit()
+            module.directory_mode_changed(path, mode, notify=False)
+    yield module
+    module.activity_log.stop()
+
+
+@pytest.fixture
+def client(nfs):
+    """
+    A test client, identified with the server.
+    """
+    client = nfs.app.test_client()
+    client.post('/id', data={'id': '1234', 'name': 'Test Student'})
+    return client
+
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from netfshare.admission import UploadAdmission, AdmissionError
+
+
+@pytest.fixture
+def admission(tmp_path):
+    return UploadAdmission(str(tmp_path), queue_timeout=10, retry_after=7)
+
+
+def waiting_for(admission, count):
+    with admission._cond:
+        return admission._cond.wait_for(lambda: admission.waiting == count, timeout=10)
+
+
+def test_size_and_disk_space(admission):
+    admission.configure(max_size=1024)
+    with pytest.raises(AdmissionError) as error:
+        admission.admit('a', 2048)
+    assert error.value.status == 413
+
+    admission.configure(max_size=0)
+    admission.min_free = admission.free_space() - 100
+    with admission.admit('a', 50):
+        # The space of the upload in progress is reserved
+        with pytest.raises(AdmissionError) as error:
+            admission.admit('b', 60)
+        assert error.value.status == 507
+    assert admission.reserved == 0
+    assert dict(admission.rejected) == {'size': 1, 'disk': 1}
+
+
+def test_busy(admission):
+    admission.configure(limit=1)
+    admission.queue_timeout = 0.1
+    with admission.admit('a', 0):
+        with pytest.raises(AdmissionError) as error:
+            admission.admit('b', 0)
+    assert error.value.status == 503
+    assert error.value.retry_after == 7
+    assert admission.active == 0
+
+
+def test_waiting_in_order(admission):
+    admission.configure(limit=1)
+    first = admission.admit('a', 0)
+    order = []
+    threads = []
+    for name in ('b', 'c'):
+        thread = threading.Thread(target=lambda name=name: order.append(admission.admit(name, 0).directory))
+        thread.start()
+        threads.append(thread)
+        assert waiting_for(admission, len(threads))
+    first.release()
+    threads[0].join(10)
+    assert order == ['b']
+    admission.configure(limit=2)
+    threads[1].join(10)
+    assert order == ['b', 'c']
+
+
+def test_busy_directory_does_not_block_others(admission):
+    admission.configure(limit=3, directory_limit=1)
+    busy = admission.admit('a', 0)
+    waiting = threading.Thread(target=lambda: admission.admit('a', 0).release())
+    waiting.start()
+    assert waiting_for(admission, 1)
+
+    # Admitted right away, ahead of the upload waiting for directory `a`
+    with admission.admit('b', 0, wait=False):
+        assert admission.status() == {'a': 1, 'b': 1}
+    busy.release()
+    waiting.join(10)
+    assert not waiting.is_alive()
+    assert admission.active == 0
@@ -0,0 +1,18 @@
+import pytest
+
+from netfshare.assets import VENDOR_ASSETS, unvendored
+
+
+def test_pages_load_socketio_from_the_package(nfs, client):
+    page = client.get('/').get_data(as_text=True)
+    assert VENDOR_ASSETS['socket.io.js'][0] not in page
+    if 'socket.io.js' in unvendored():
+        pytest.skip('socket.io.js is not vendored, run `python -m netfshare.assets`')
+
+    fingerprinted = nfs.asset_pipeline.fingerprinted('socket.io.js')
+    assert f'<script src="/assets/{fingerprinted}">' in page
+    response = client.get(f'/assets/{fingerprinted}', headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert response.cache_control.immutable
+    with open(nfs.asset_pipeline.find(fingerprinted).path, 'rb') as f:
+        assert response.get_data() == f.read()
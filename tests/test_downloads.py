@@ -0,0 +1,203 @@
+import io
+import os
+import time
+import zipfile
+import threading
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wsgi import FileWrapper
+
+from netfshare.archive_cache import file_hash
+
+
+def full_archive(client):
+    response = client.get('/download/lecture')
+    assert response.status_code == 200
+    return response.get_data(), response.headers['ETag']
+
+
+def test_resume_archive_download(nfs, client):
+    nfs.archive_cache.get('lecture', os.path.join(nfs.SHARED_DIRECTORY, 'lecture'))
+    data, etag = full_archive(client)
+    assert zipfile.ZipFile(io.BytesIO(data)).namelist()
+
+    # Continue an interrupted download after its first part
+    prefix = data[:len(data) // 3]
+    response = client.get('/download/lecture', headers={'Range': f'bytes={len(prefix)}-', 'If-Range': etag})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes {len(prefix)}-{len(data) - 1}/{len(data)}'
+    assert prefix + response.get_data() == data
+
+
+def test_resume_after_archive_changed(nfs, client, shared_dir):
+    nfs.archive_cache.get('lecture', os.path.join(nfs.SHARED_DIRECTORY, 'lecture'))
+    data, etag = full_archive(client)
+
+    (shared_dir / 'lecture' / 'notes.txt').write_bytes(b'changed notes ' * 1000)
+    nfs.archive_cache.invalidate('lecture')
+
+    # The partial copy is of the previous archive, the whole new one is sent instead
+    response = client.get('/download/lecture', headers={'Range': f'bytes={len(data) // 2}-', 'If-Range': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    new_data = response.get_data()
+    assert zipfile.ZipFile(io.BytesIO(new_data)).read('notes.txt') == b'changed notes ' * 1000
+
+    # Clients that require the previous version get 412
+    response = client.get('/download/lecture', headers={'Range': f'bytes={len(data) // 2}-', 'If-Match': etag})
+    assert response.status_code == 412
+
+
+def test_revalidate_archive(nfs, client):
+    nfs.archive_cache.get('lecture', os.path.join(nfs.SHARED_DIRECTORY, 'lecture'))
+    data, etag = full_archive(client)
+    response = client.get('/download/lecture', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_unlimited_file_download_is_not_wrapped(nfs, client):
+    client_id = nfs.app_cache.client('127.0.0.1').id
+    sent = nfs.transfer_scheduler.transferred[client_id, 'download']
+    environ = EnvironBuilder('/file/lecture/data.bin', environ_base={'REMOTE_ADDR': '127.0.0.1'}).get_environ()
+    environ['wsgi.file_wrapper'] = FileWrapper
+    app_iter = nfs.app(environ, lambda status, headers: None)
+    try:
+        # Passed to the server's file wrapper as it is
+        assert isinstance(app_iter, FileWrapper)
+    finally:
+        app_iter.close()
+    assert nfs.transfer_scheduler.transferred[client_id, 'download'] == sent + 64 * 1024
+
+
+def test_limited_file_download(nfs, client):
+    client_id = nfs.app_cache.client('127.0.0.1').id
+    sent = nfs.transfer_scheduler.transferred[client_id, 'download']
+    nfs.transfer_scheduler.configure(directory_limit=2)
+    try:
+        response = client.get('/file/lecture/data.bin')
+        assert len(response.get_data()) == 64 * 1024
+    finally:
+        nfs.transfer_scheduler.configure(directory_limit=0)
+    assert nfs.transfer_scheduler.transferred[client_id, 'download'] == sent + 64 * 1024
+
+
+def test_download_during_build(nfs, client, shared_dir, monkeypatch):
+    directory = os.path.join(nfs.SHARED_DIRECTORY, 'slides')
+    building, release = threading.Event(), threading.Event()
+    build = nfs.archive_cache.build
+
+    def slow_build(*args, **kwargs):
+        building.set()
+        release.wait(10)
+        return build(*args, **kwargs)
+
+    monkeypatch.setattr(nfs.archive_cache, 'build', slow_build)
+    builder = nfs.archive_cache.refresh_async('slides', directory)
+    assert building.wait(5)
+    try:
+        # Streamed right away, without waiting for the build
+        started = time.monotonic()
+        response = client.get('/download/slides')
+        data = response.get_data()
+        assert time.monotonic() - started < 5
+        assert response.status_code == 200
+        assert response.headers['Accept-Ranges'] == 'none'
+        assert 'ETag' not in response.headers
+        assert len(zipfile.ZipFile(io.BytesIO(data)).namelist()) == 5
+        assert nfs.archive_cache.is_building('slides')
+    finally:
+        release.set()
+        builder.join()
+
+    # Resumed downloads wait for a build in progress and get the cached archive
+    (shared_dir / 'slides' / 'slide0.txt').write_bytes(b'new slide')
+    nfs.archive_cache.invalidate('slides')
+    building.clear()
+    release.clear()
+    builder = nfs.archive_cache.refresh_async('slides', directory)
+    assert building.wait(5)
+    threading.Timer(0.2, release.set).start()
+    response = client.get('/download/slides', headers={'Range': 'bytes=0-'})
+    builder.join()
+    assert response.status_code == 206
+    assert response.headers['ETag'] == '"%s"' % nfs.archive_cache.load_manifest('slides')['archive']
+    assert zipfile.ZipFile(io.BytesIO(response.get_data())).read('slide0.txt') == b'new slide'
+
+
+def test_stream_limit(nfs, client, shared_dir, monkeypatch):
+    directory = os.path.join(nfs.SHARED_DIRECTORY, 'slides')
+    (shared_dir / 'slides' / 'slide1.txt').write_bytes(b'limited')
+    # Nothing cached, as before the first download
+    os.remove(nfs.archive_cache._manifest_path('slides'))
+    building, release = threading.Event(), threading.Event()
+    build = nfs.archive_cache.build
+
+    def slow_build(*args, **kwargs):
+        building.set()
+        release.wait(10)
+        return build(*args, **kwargs)
+
+    monkeypatch.setattr(nfs.archive_cache, 'build', slow_build)
+    monkeypatch.setattr(nfs, 'download_streams', threading.BoundedSemaphore(1))
+    builder = nfs.archive_cache.refresh_async('slides', directory)
+    assert building.wait(5)
+    try:
+        streamed = client.get('/download/slides')
+        assert 'ETag' not in streamed.headers
+        assert not nfs.download_streams.acquire(blocking=False)
+
+        # Past the limit, the download waits for the build in progress
+        threading.Timer(0.2, release.set).start()
+        response = client.get('/download/slides')
+        assert response.status_code == 200
+        assert response.headers['ETag'] == '"%s"' % nfs.archive_cache.load_manifest('slides')['archive']
+        assert zipfile.ZipFile(io.BytesIO(response.get_data())).read('slide1.txt') == b'limited'
+
+        # Finished streams make room for the next ones
+        streamed.close()
+        assert nfs.download_streams.acquire(blocking=False)
+        nfs.download_streams.release()
+    finally:
+        release.set()
+        builder.join()
+
+
+def test_manifest_does_not_wait_for_build(nfs, client, shared_dir, monkeypatch):
+    building, release = threading.Event(), threading.Event()
+    build = nfs.archive_cache.build
+
+    def slow_build(*args, **kwargs):
+        building.set()
+        release.wait(10)
+        return build(*args, **kwargs)
+
+    monkeypatch.setattr(nfs.archive_cache, 'build', slow_build)
+    (shared_dir / 'lecture' / 'notes.txt').write_bytes(b'synced notes')
+    nfs.archive_cache.invalidate('lecture')
+    try:
+        response = client.get('/manifest/lecture')
+        assert response.status_code == 200
+        files = {entry['path']: entry for entry in response.json['files']}
+        hasher = file_hash()
+        hasher.update(b'synced notes')
+        assert files['notes.txt']['hash'] == hasher.hexdigest()
+        assert files['notes.txt']['size'] == len(b'synced notes')
+        assert response.headers['ETag'] == '"%s"' % response.json['version']
+        # The archive is built in the background
+        assert building.wait(5)
+    finally:
+        release.set()
+        while nfs.archive_cache.is_building('lecture'):
+            time.sleep(0.01)
+    assert client.get('/manifest/lecture', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_rescan_without_watcher(nfs, client, shared_dir):
+    assert nfs.app.config['WATCHER'] == 'off'
+    nfs.shared_tree.files('lecture')
+    nfs.archive_cache.get('lecture', os.path.join(nfs.SHARED_DIRECTORY, 'lecture'))
+    (shared_dir / 'lecture' / 'added.txt').write_bytes(b'added')
+    # Requests from the server's own address are admin requests
+    nfs.app.test_client().get('/scan_shared_dir', base_url='http://127.0.0.1/')
+    assert 'added.txt' in [path for path, _size, _mtime in nfs.shared_tree.files('lecture')]
+    assert not nfs.archive_cache.is_fresh('lecture')
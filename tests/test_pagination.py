@@ -0,0 +1,26 @@
+import re
+
+
+def page_links(nfs, page, pages):
+    template = nfs.app.jinja_env.from_string(
+        '{% from "pagination.html" import page_list %}'
+        '{% call(p) page_list(page, pages) %}/list?page={{ p }}{% endcall %}')
+    html = template.render(page=page, pages=pages)
+    return re.findall(r'page=(\d+)"|(pagination-ellipsis)', html)
+
+
+def test_page_window(nfs):
+    links = page_links(nfs, 10, 1000)
+    assert [int(p) if p else '...' for p, _ in links] == [1, '...', 8, 9, 10, 11, 12, '...', 1000]
+    # A single hidden page is linked instead of an ellipsis
+    links = page_links(nfs, 1, 5)
+    assert [int(p) if p else '...' for p, _ in links] == [1, 2, 3, 4, 5]
+    assert page_links(nfs, 1, 1) == []
+
+
+def test_browse_pages(nfs, client, monkeypatch):
+    monkeypatch.setitem(nfs.app.config, 'BROWSE_PAGE_SIZE', 1)
+    response = client.get('/browse/slides/?page=1')
+    assert response.status_code == 200
+    assert b'pagination-link is-current' in response.data
+    assert b'/browse/slides/?page=5' in response.data
@@ -0,0 +1,235 @@
+import io
+import csv
+import os
+import zipfile
+
+import pytest
+
+from netfshare.archive_cache import file_hash
+from netfshare.uploads import UploadSessions, UploadError
+
+CHUNK_SIZE = 1024
+# Requests from the server's own address are admin requests
+ADMIN_URL = 'http://127.0.0.1/'
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    return UploadSessions(str(tmp_path / 'state'), chunk_size=CHUNK_SIZE)
+
+
+def chunks(data):
+    return [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+
+
+def digest(data):
+    hasher = file_hash()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def send(sessions, session, index, chunk, data):
+    return sessions.write_chunk(session['id'], session['client_id'], index, chunk, io.BytesIO(data), len(data))
+
+
+def test_upload_in_order(sessions, tmp_path):
+    data = os.urandom(3 * CHUNK_SIZE + 100)
+    session = sessions.create(1, 'homework', str(tmp_path / 'student'), [{'name': 'a.bin', 'size': len(data)}])
+    for chunk, part in enumerate(chunks(data)):
+        assert send(sessions, session, 0, chunk, part) == len(part)
+    finished = sessions.finish(session['id'], 1)
+    assert (tmp_path / 'student' / 'a.bin').read_bytes() == data
+    assert finished['files'][0]['hash'] == digest(data)
+
+
+def test_out_of_order_chunks(sessions, tmp_path):
+    data = os.urandom(4 * CHUNK_SIZE)
+    session = sessions.create(1, 'homework', str(tmp_path / 'student'), [{'name': 'a.bin', 'size': len(data)}])
+    parts = chunks(data)
+    for chunk in (2, 0, 3, 1):
+        send(sessions, session, 0, chunk, parts[chunk])
+    finished = sessions.finish(session['id'], 1)
+    assert (tmp_path / 'student' / 'a.bin').read_bytes() == data
+    assert finished['files'][0]['hash'] == digest(data)
+
+
+def test_resume(tmp_path):
+    data = os.urandom(3 * CHUNK_SIZE)
+    parts = chunks(data)
+    state_dir = str(tmp_path / 'state')
+    sessions = UploadSessions(state_dir, chunk_size=CHUNK_SIZE)
+    session = sessions.create(1, 'homework', str(tmp_path / 'student'), [{'name': 'a.bin', 'size': len(data)}])
+    send(sessions, session, 0, 0, parts[0])
+    # Interrupted in the middle of a chunk
+    with pytest.raises(UploadError):
+        sessions.write_chunk(session['id'], 1, 0, 1, io.BytesIO(parts[1][:100]), len(parts[1]))
+
+    # A restarted server resumes the session from its state
+    resumed = UploadSessions(state_dir, chunk_size=CHUNK_SIZE)
+    status = resumed.status(resumed.get(session['id'], 1))
+    assert status['files'][0]['missing'] == [1, 2]
+    assert status['files'][0]['received_bytes'] == CHUNK_SIZE
+    for chunk in status['files'][0]['missing']:
+        send(resumed, session, 0, chunk, parts[chunk])
+    finished = resumed.finish(session['id'], 1)
+    assert finished['files'][0]['hash'] == digest(data)
+
+
+def test_wrong_chunk_length(sessions, tmp_path):
+    session = sessions.create(1, 'homework', str(tmp_path / 'student'),
+                              [{'name': 'a.bin', 'size': CHUNK_SIZE + 10}])
+    with pytest.raises(UploadError, match=f'{CHUNK_SIZE} bytes'):
+        send(sessions, session, 0, 0, b'x' * (CHUNK_SIZE - 1))
+    with pytest.raises(UploadError, match='10 bytes'):
+        send(sessions, session, 0, 1, b'x' * CHUNK_SIZE)
+    with pytest.raises(UploadError, match='Invalid chunk'):
+        send(sessions, session, 0, 2, b'x')
+    with pytest.raises(UploadError) as error:
+        sessions.finish(session['id'], 1)
+    assert error.value.status == 409
+
+
+def test_other_client(sessions, tmp_path):
+    session = sessions.create(1, 'homework', str(tmp_path / 'student'), [{'name': 'a.bin', 'size': 10}])
+    with pytest.raises(UploadError) as error:
+        sessions.write_chunk(session['id'], 2, 0, 0, io.BytesIO(b'x' * 10), 10)
+    assert error.value.status == 404
+
+
+def test_replace_larger_file(sessions, tmp_path):
+    target = tmp_path / 'student'
+    target.mkdir()
+    (target / 'a.bin').write_bytes(b'old' * 5000)
+    data = os.urandom(CHUNK_SIZE + 10)
+    session = sessions.create(1, 'homework', str(target), [{'name': 'a.bin', 'size': len(data)}])
+    for chunk, part in enumerate(chunks(data)):
+        send(sessions, session, 0, chunk, part)
+        # The previous upload is kept until the new one is complete
+        assert (target / 'a.bin').read_bytes() == b'old' * 5000
+    finished = sessions.finish(session['id'], 1)
+    assert (target / 'a.bin').read_bytes() == data
+    assert finished['files'][0]['hash'] == digest(data)
+    assert os.listdir(target) == ['a.bin']
+
+
+def test_expire(sessions, tmp_path):
+    target = tmp_path / 'homework' / 'student'
+    session = sessions.create(1, 'homework', str(target), [{'name': 'sub/a.bin', 'size': 2 * CHUNK_SIZE}])
+    send(sessions, session, 0, 0, b'x' * CHUNK_SIZE)
+    assert sessions.expire(60) == 0
+    assert len(os.listdir(target / 'sub')) == 1
+
+    assert sessions.expire(0) == 1
+    assert not target.exists()
+    assert (tmp_path / 'homework').is_dir()
+    assert os.listdir(sessions.state_dir) == []
+    with pytest.raises(UploadError):
+        sessions.get(session['id'], 1)
+
+
+def test_expire_keeps_previous_upload(sessions, tmp_path):
+    target = tmp_path / 'student'
+    target.mkdir()
+    (target / 'a.bin').write_bytes(b'submitted')
+    session = sessions.create(1, 'homework', str(target), [{'name': 'a.bin', 'size': 2 * CHUNK_SIZE}])
+    send(sessions, session, 0, 0, b'x' * CHUNK_SIZE)
+    assert sessions.expire(0) == 1
+    assert os.listdir(target) == ['a.bin']
+    assert (target / 'a.bin').read_bytes() == b'submitted'
+
+
+@pytest.fixture
+def multiple_uploads(nfs):
+    with nfs.app.app_context():
+        nfs.ConfigBool.query.filter_by(name='allow_multiple_uploads').one().value = True
+        nfs.db.session.commit()
+    nfs.app_cache.invalidate_config()
+    yield
+    with nfs.app.app_context():
+        nfs.ConfigBool.query.filter_by(name='allow_multiple_uploads').one().value = False
+        nfs.db.session.commit()
+    nfs.app_cache.invalidate_config()
+
+
+def flashed(client):
+    with client.session_transaction() as session:
+        return [message for _category, message in session.pop('_flashes', [])]
+
+
+def upload_form(count):
+    data = {'csrfmiddlewaretoken': 'token'}
+    data['file'] = [(io.BytesIO(b'file %d' % i), f'work/file{i}.txt') for i in range(count)]
+    return data
+
+
+def test_upload_form(nfs, client, multiple_uploads, shared_dir):
+    max_files = nfs.app.config['MAX_FILES']
+    response = client.post('/upload/homework', data=upload_form(max_files))
+    assert response.status_code == 302
+    assert flashed(client)[-1] == f'{max_files} files successfully uploaded.'
+    assert (shared_dir / 'homework' / 'Test_Student_1234' / 'work' / 'file0.txt').read_bytes() == b'file 0'
+
+
+def test_upload_form_too_many_files(nfs, client, multiple_uploads):
+    max_files = nfs.app.config['MAX_FILES']
+    for count in (max_files + 1, max_files + 5, 3 * max_files):
+        response = client.post('/upload/homework', data=upload_form(count))
+        assert response.status_code == 302
+        assert flashed(client) == [f'Too many files. Max. {max_files} files per upload.']
+
+    response = client.post('/upload/homework', data=upload_form(3 * max_files),
+                           headers={'Accept': 'application/json'})
+    assert response.status_code == 413
+
+
+def test_upload_form_without_length(nfs, client):
+    response = client.post('/upload/homework', input_stream=io.BytesIO(b'--x--'),
+                           content_type='multipart/form-data; boundary=x',
+                           headers={'Transfer-Encoding': 'chunked'})
+    assert response.status_code == 302
+    assert flashed(client) == ['The size of the upload is unknown, please try again.']
+
+
+def collected(admin, path):
+    response = admin.get(f'/collect/{path}', base_url=ADMIN_URL)
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.get_data()))
+    rows = {(row['folder'], row['file']): row
+            for row in csv.DictReader(io.StringIO(archive.read('index.csv').decode('utf-8')))}
+    return archive, rows
+
+
+def test_collect_keeps_uploads_of_deleted_clients(nfs, shared_dir):
+    student = nfs.app.test_client()
+    student.environ_base['REMOTE_ADDR'] = '10.0.0.7'
+    student.post('/id', data={'id': '5678', 'name': 'Other Student'})
+    response = student.post('/upload/homework', data={'file': [(io.BytesIO(b'report'), 'report.txt')]})
+    assert response.status_code == 302
+    (shared_dir / 'homework' / 'Copied_In').mkdir()
+    (shared_dir / 'homework' / 'Copied_In' / 'extra.txt').write_bytes(b'extra')
+
+    admin = nfs.app.test_client()
+    with nfs.app.app_context():
+        client_id = nfs.Client.query.filter_by(selected_id='5678').one().id
+    admin.get(f'/delete_client/{client_id}', base_url=ADMIN_URL)
+    archive, rows = collected(admin, 'homework')
+    assert archive.read('Other_Student_5678/report.txt') == b'report'
+    assert rows['Other_Student_5678', 'report.txt']['status'] == 'ok'
+    assert rows['Other_Student_5678', 'report.txt']['hash'] == digest(b'report')
+    assert rows['Copied_In', 'extra.txt']['status'] == 'unrecorded'
+
+    admin.get('/reset_session', base_url=ADMIN_URL)
+    archive, rows = collected(admin, 'homework')
+    assert archive.read('Other_Student_5678/report.txt') == b'report'
+    assert rows['Other_Student_5678', 'report.txt']['status'] == 'unrecorded'
+
+
+def test_upload_to_read_only_directory(nfs, client, shared_dir):
+    response = client.post('/upload/lecture/session', json={'files': [{'name': 'a.txt', 'size': 1}]})
+    assert response.status_code == 404
+    response = client.post('/upload/lecture', data={'file': [(io.BytesIO(b'x'), 'a.txt')]},
+                           headers={'Accept': 'application/json'})
+    assert response.status_code == 404
+    response = client.get('/upload/lecture')
+    assert response.status_code == 302
+    assert not (shared_dir / 'lecture' / 'Test_Student_1234').exists()